@@ -0,0 +1,57 @@
+import multiprocessing
+from django.core.management.base import BaseCommand
+from apptransformation.mdlProcess.mdlBenchmark import EXTRACTION_SCENARIOS, run_extraction_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark SAP table extraction against a local fake SAP system'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            nargs='+',
+            choices=sorted(EXTRACTION_SCENARIOS),
+            help='Scenarios to run (default: all)'
+        )
+        parser.add_argument(
+            '--rows',
+            type=int,
+            help='Override the row count of every scenario'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.005,
+            help='Simulated seconds per RFC call (default: 0.005)'
+        )
+        parser.add_argument(
+            '--row-scan-latency',
+            type=float,
+            default=0.0,
+            help='Simulated seconds per row scanned by the database (default: 0)'
+        )
+
+    def handle(self, *args, **options):
+        # Every scenario runs in a fresh process so that its peak RSS is its own
+        context = multiprocessing.get_context('spawn')
+
+        self.stdout.write(f"{'scenario':<18}{'mode':<10}{'rows':>9}{'cols':>6}{'seconds':>9}{'rows/s':>11}{'rfc calls':>11}{'rows scanned':>14}{'peak RSS MB':>13}")
+        for name in options['scenario'] or sorted(EXTRACTION_SCENARIOS):
+            scenario = dict(EXTRACTION_SCENARIOS[name])
+            if options['rows']:
+                scenario['rows'] = options['rows']
+            scenario.update(latency=options['latency'], row_scan_latency=options['row_scan_latency'])
+
+            try:
+                with context.Pool(1) as pool:
+                    result = pool.apply(run_extraction_benchmark, (name,), scenario)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{name}: benchmark failed: {e}'))
+                continue
+
+            peak_rss = f"{result['peak_rss'] / 1024 ** 2:.0f}" if result['peak_rss'] is not None else 'n/a'
+            self.stdout.write(
+                f"{result['scenario']:<18}{result['mode']:<10}{result['rows']:>9}{result['columns']:>6}"
+                f"{result['seconds']:>9.2f}{result['rows_per_second']:>11.0f}{result['rfc_calls']:>11}"
+                f"{result['rows_scanned']:>14}{peak_rss:>13}"
+            )
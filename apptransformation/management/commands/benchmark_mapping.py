@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from apptransformation.mdlProcess.mdlBenchmark import run_mapping_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark mapping, transformation rules and output preparation on a template seeded with seed_metadata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='cache/metadata.sqlite3', help='SQLite metadata file (default: cache/metadata.sqlite3)')
+        parser.add_argument('--template-name', default='Synthetic Template', help='Template name (default: Synthetic Template)')
+        parser.add_argument('--ltmc-version', default='BENCH', help='LTMC version of the template (default: BENCH)')
+        parser.add_argument('--client', default='BENCH', help='Client id (default: BENCH)')
+        parser.add_argument(
+            '--rows',
+            nargs='+',
+            type=int,
+            default=[10000, 100000],
+            help='Source table row counts to benchmark (default: 10000 100000)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'rows':>9}{'sheets':>8}{'cells':>12}{'metadata s':>12}{'mapping s':>11}{'rules s':>9}{'output s':>10}{'peak RSS MB':>13}")
+        for rows in options['rows']:
+            try:
+                result = run_mapping_benchmark(options['path'], options['template_name'], options['ltmc_version'], options['client'], rows)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{rows} rows: benchmark failed: {e}'))
+                continue
+
+            seconds = result['seconds']
+            peak_rss = f"{result['peak_rss'] / 1024 ** 2:.0f}" if result['peak_rss'] is not None else 'n/a'
+            self.stdout.write(
+                f"{result['rows']:>9}{result['target_tables']:>8}{result['output_cells']:>12}{seconds['metadata']:>12.2f}"
+                f"{seconds['mapping']:>11.2f}{seconds['rules']:>9.2f}{seconds['output']:>10.2f}{peak_rss:>13}"
+            )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from apptransformation.mdlProcess.mdlBenchmark import run_metadata_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark parsing of field mapping and transformation rule metadata'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            nargs='+',
+            type=int,
+            default=[10000, 100000],
+            help='Metadata row counts to benchmark (default: 10000 100000)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Runs per measurement, the fastest is reported (default: 3)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'rows':>9}{'fields old s':>14}{'fields new s':>14}{'speedup':>9}{'rules old s':>13}{'rules new s':>13}{'speedup':>9}")
+        for rows in options['rows']:
+            try:
+                result = run_metadata_benchmark(rows, repeat=options['repeat'])
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{rows} rows: benchmark failed: {e}'))
+                continue
+
+            self.stdout.write(
+                f"{result['rows']:>9}{result['fields_legacy_seconds']:>14.3f}{result['fields_seconds']:>14.3f}"
+                f"{result['fields_legacy_seconds'] / result['fields_seconds']:>8.1f}x"
+                f"{result['rules_legacy_seconds']:>13.3f}{result['rules_seconds']:>13.3f}"
+                f"{result['rules_legacy_seconds'] / result['rules_seconds']:>8.1f}x"
+            )
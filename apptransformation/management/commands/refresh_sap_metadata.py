@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from apptransformation.mdlProcess.mdlMetadata import get_metadata_cache
+
+
+class Command(BaseCommand):
+    help = 'Refresh the cached DDIC field metadata of SAP tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ashost', required=True, help='SAP application server')
+        parser.add_argument('--sysnr', default='00', help='SAP system number (default: 00)')
+        parser.add_argument('--client', required=True, help='SAP client')
+        parser.add_argument('--user', required=True, help='SAP user')
+        parser.add_argument('--passwd', required=True, help='SAP password')
+        parser.add_argument(
+            '--tables',
+            nargs='+',
+            type=str,
+            help='Tables to refresh'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Refresh every table already cached for this system and client'
+        )
+
+    def handle(self, *args, **options):
+        connection_params = {
+            'user': options['user'],
+            'passwd': options['passwd'],
+            'ashost': options['ashost'],
+            'sysnr': options['sysnr'],
+            'client': options['client'],
+            'lang': 'EN',
+            'trace': '0'  # Disable RFC logging
+        }
+        metadata_cache = get_metadata_cache()
+
+        lstTables = list(options['tables'] or [])
+        if options['all']:
+            lstTables += [tbl for tbl in metadata_cache.cached_tables(connection_params) if tbl not in lstTables]
+        if not lstTables:
+            raise CommandError('Pass --tables and/or --all.')
+
+        for tbl in lstTables:
+            try:
+                dfies_tab = metadata_cache.get_fields(connection_params, tbl, refresh=True)
+                self.stdout.write(self.style.SUCCESS(f'Refreshed {tbl}: {len(dfies_tab)} fields'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{tbl}: refresh failed: {e}'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from apptransformation.mdlProcess.mdlBenchmark import seed_synthetic_template
+
+
+class Command(BaseCommand):
+    help = 'Seed a local SQLite metadata database with a synthetic template for offline runs and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default='cache/metadata.sqlite3',
+            help='SQLite metadata file (default: cache/metadata.sqlite3)'
+        )
+        parser.add_argument('--template-name', default='Synthetic Template', help='Template name (default: Synthetic Template)')
+        parser.add_argument('--ltmc-version', default='BENCH', help='LTMC version of the template (default: BENCH)')
+        parser.add_argument('--client', default='BENCH', help='Client id the rules are stored for (default: BENCH)')
+        parser.add_argument('--target-tables', type=int, default=5, help='Sheets of the template (default: 5)')
+        parser.add_argument('--fields', type=int, default=50, help='Mapped fields per sheet (default: 50)')
+        parser.add_argument('--join-tables', type=int, default=3, help='Source tables joined into every sheet (default: 3)')
+        parser.add_argument('--rule-ratio', type=float, default=0.2, help='Share of fields with transformation rules (default: 0.2)')
+        parser.add_argument('--template-dir', help='Folder for the blank template file (default: next to the metadata file)')
+
+    def handle(self, *args, **options):
+        summary = seed_synthetic_template(
+            options['path'],
+            options['template_name'],
+            options['ltmc_version'],
+            clientid=options['client'],
+            template_dir=options['template_dir'],
+            target_tables=options['target_tables'],
+            fields=options['fields'],
+            join_tables=options['join_tables'],
+            rule_ratio=options['rule_ratio'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded template {summary['templateid']} '{options['template_name']}' ({options['ltmc_version']}) into {options['path']}: "
+            f"{summary['target_tables']} sheets, {summary['mapping_rows']} mapping rows, {summary['rule_rows']} rules."
+        ))
+        self.stdout.write(f"Blank template: {summary['blank_template_path']}")
+        self.stdout.write(f"Run against it with server 'sqlite' and database '{options['path']}'.")
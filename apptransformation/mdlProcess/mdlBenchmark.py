@@ -0,0 +1,341 @@
+import os
+import sys
+import time
+from xml.sax.saxutils import escape, quoteattr
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from .mdlEnum import Extraction_mode
+from .mdlFakeSap import FakeSapSystem, install_fake_sap
+from .mdlProjection import TEMPLATE_HEADER_ROW, build_ecc_field_list, read_template_headers, split_join_fields
+from .mdlTransRule import compile_rule_dict
+
+
+# Benchmark scenarios: table shape and extraction mode
+EXTRACTION_SCENARIOS = {
+    'narrow_offset': {'rows': 100000, 'fields': 6, 'field_lengths': (10,), 'extraction_mode': Extraction_mode.EnumOffset},
+    'narrow_keyrange': {'rows': 100000, 'fields': 6, 'field_lengths': (10,), 'extraction_mode': Extraction_mode.EnumKeyRange},
+    'wide_keyrange': {'rows': 50000, 'fields': 120, 'field_lengths': (1, 4, 10, 18, 35, 3, 40, 2), 'extraction_mode': Extraction_mode.EnumKeyRange},
+}
+
+
+def get_peak_rss():
+    """
+    Peak resident set size of this process in bytes, or None when unknown.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def run_extraction_benchmark(name, rows, fields, field_lengths=(10,), extraction_mode=Extraction_mode.EnumKeyRange, latency=0.0, row_scan_latency=0.0):
+    """
+    Extract one synthetic table from a fake SAP system with
+    get_data_from_sap_table_1 and measure throughput, RFC round trips and
+    memory. Run every scenario in a fresh process for a meaningful peak RSS.
+    """
+    # Imported here so that the fake system is in place before any pool is used
+    from .mdlExtraction import get_data_from_sap_table_1
+
+    tbl = 'ZBENCH'
+    connection_params = {'ashost': f'fake-sap-{name}', 'sysnr': '00', 'client': '100', 'user': 'BENCH', 'passwd': ''}
+    system = FakeSapSystem(latency=latency, row_scan_latency=row_scan_latency)
+    system.generate_table(tbl, rows, fields=fields, field_lengths=field_lengths)
+    install_fake_sap(system, connection_params)
+    lstFields = [field['FIELDNAME'] for field in system.tables[tbl]['dfies'] if field['FIELDNAME'] != 'MANDT']
+
+    rss_before = get_peak_rss()
+    start_time = time.perf_counter()
+    dicResult = get_data_from_sap_table_1(connection_params, tbl, lstFields, extraction_mode)
+    elapsed_time = time.perf_counter() - start_time
+    rss_after = get_peak_rss()
+
+    if dicResult['iserror'] == True:
+        raise RuntimeError(dicResult['error_details'])
+    df = dicResult['value'][tbl]
+    if len(df) != rows:
+        raise RuntimeError(f"Extracted {len(df)} rows, expected {rows}.")
+
+    stats = system.stats[tbl]
+    return {
+        'scenario': name,
+        'mode': extraction_mode,
+        'rows': len(df),
+        'columns': len(df.columns),
+        'seconds': elapsed_time,
+        'rows_per_second': len(df) / elapsed_time if elapsed_time else 0.0,
+        'rfc_calls': stats['RFC_READ_TABLE'] + stats['DDIF_FIELDINFO_GET'],
+        'rows_scanned': stats['rows_scanned'],
+        'peak_rss': rss_after,
+        'peak_rss_growth': rss_after - rss_before if rss_before is not None else None,
+    }
+
+
+def legacy_ecc_field_list(dfeccmapping):
+    """
+    Row-by-row reference implementation of build_ecc_field_list.
+    """
+    ecc_dict = defaultdict(list)
+    for source_table, source_field, is_main, source_join in dfeccmapping[['SoruceTable', 'SoruceField', 'IsMainTable', 'SoruceJoinFiled']].itertuples(index=False):
+        lstFields = [source_field] + (split_join_fields(source_join) if is_main == 0 else [])
+        for fld in lstFields:
+            if fld not in ecc_dict[source_table]:
+                ecc_dict[source_table].append(fld)
+    return ecc_dict
+
+
+def legacy_rule_dict(df):
+    """
+    Row-by-row reference implementation of compile_rule_dict.
+    """
+    rules_dict = defaultdict(lambda: defaultdict(list))
+    for _, row in df.iterrows():
+        rule_names = str(row['RuleName']).split('|') if pd.notna(row['RuleName']) else ['']
+        formats = str(row['Format']).split('|') if pd.notna(row['Format']) else ['']
+        custom1 = str(row['Custome1']).split('|') if pd.notna(row['Custome1']) else ['']
+        custom2 = str(row['Custome2']).split('|') if pd.notna(row['Custome2']) else ['']
+        custom3 = str(row['Custome3']).split('|') if pd.notna(row['Custome3']) else ['']
+        for i, rule_name in enumerate(rule_names):
+            if not rule_name.strip():
+                continue
+            rules_dict[row['TargetTable']][row['TargetField']].append({
+                'rule_name': rule_name.strip(),
+                'format': [f.strip() for f in formats[i:i+1] or ['']],
+                'custom1': [c.strip() for c in custom1[i:i+1] or ['']],
+                'custom2': [c.strip() for c in custom2[i:i+1] or ['']],
+                'custom3': [c.strip() for c in custom3[i:i+1] or ['']]
+            })
+    return {k: dict(v) for k, v in rules_dict.items()}
+
+
+def generate_mapping_metadata(rows, tables=20, seed=0):
+    """
+    Synthetic ECC_Field_Mapping and ConditionalRules frames of the given size.
+    """
+    rng = np.random.default_rng(seed)
+    table_names = np.array([f'ZTAB{i:02d}' for i in range(tables)])
+    source_tables = table_names[rng.integers(0, tables, rows)]
+    is_main = (source_tables == table_names[0]).astype(int)
+    join_fields = np.array(['KEY1', 'KEY1|KEY2', 'KEY1 | KEY2 | KEY3', None], dtype=object)
+
+    dfeccmapping = pd.DataFrame({
+        'SoruceTable': source_tables,
+        'SoruceField': [f'FLD{i}' for i in rng.integers(0, 200, rows)],
+        'IsMainTable': is_main,
+        'SoruceJoinFiled': np.where(is_main == 1, None, join_fields[rng.integers(0, len(join_fields), rows)]),
+    })
+
+    rule_names = np.array(['TRIM', 'UPPER|TRIM', 'DATE_FORMAT', 'PREFIX|SUFFIX|TRIM', '', None], dtype=object)
+    parameters = np.array(['', 'X', 'YYYYMMDD|', ' A | B ', None], dtype=object)
+    dfrules = pd.DataFrame({
+        'ClientID': 'BENCH',
+        'TargetTable': table_names[rng.integers(0, tables, rows)],
+        'TargetField': [f'TGT{i}' for i in rng.integers(0, 500, rows)],
+        'RuleName': rule_names[rng.integers(0, len(rule_names), rows)],
+        'Format': parameters[rng.integers(0, len(parameters), rows)],
+        'Custome1': parameters[rng.integers(0, len(parameters), rows)],
+        'Custome2': parameters[rng.integers(0, len(parameters), rows)],
+        'Custome3': parameters[rng.integers(0, len(parameters), rows)],
+    })
+    return dfeccmapping, dfrules
+
+
+def _as_tuples(rules_dict):
+    return {table: {field: [{key: tuple(value) if isinstance(value, list) else value for key, value in rule.items()} for rule in rules]
+                    for field, rules in fields.items()}
+            for table, fields in rules_dict.items()}
+
+
+def run_metadata_benchmark(rows, repeat=3):
+    """
+    Time the row-by-row and the vectorized parsing of mapping and rule
+    metadata on synthetic frames and check that both give the same result.
+    """
+    dfeccmapping, dfrules = generate_mapping_metadata(rows)
+
+    def best_of(func, df):
+        timings = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            result = func(df)
+            timings.append(time.perf_counter() - start_time)
+        return result, min(timings)
+
+    legacy_fields, legacy_fields_seconds = best_of(legacy_ecc_field_list, dfeccmapping)
+    fields, fields_seconds = best_of(build_ecc_field_list, dfeccmapping)
+    legacy_rules, legacy_rules_seconds = best_of(legacy_rule_dict, dfrules)
+    rules, rules_seconds = best_of(compile_rule_dict, dfrules)
+
+    if {tbl: tuple(lst) for tbl, lst in legacy_fields.items()} != fields:
+        raise RuntimeError("Vectorized ECC field list differs from the row-by-row result.")
+    if _as_tuples(legacy_rules) != rules:
+        raise RuntimeError("Vectorized rule dictionary differs from the row-by-row result.")
+
+    return {
+        'rows': rows,
+        'fields_legacy_seconds': legacy_fields_seconds,
+        'fields_seconds': fields_seconds,
+        'rules_legacy_seconds': legacy_rules_seconds,
+        'rules_seconds': rules_seconds,
+    }
+
+
+def write_blank_template(path, dictHeaders, header_row=TEMPLATE_HEADER_ROW):
+    """
+    Write a SpreadsheetML migration template with one sheet per target table
+    and its field names in the header row.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0"?>\n<?mso-application progid="Excel.Sheet"?>\n')
+        f.write('<Workbook xmlns="urn:schemas-microsoft-com:office:spreadsheet" xmlns:ss="urn:schemas-microsoft-com:office:spreadsheet">\n')
+        for sheet_name, lstHeaders in dictHeaders.items():
+            f.write(f' <Worksheet ss:Name={quoteattr(sheet_name)}>\n  <Table>\n')
+            f.write(f'   <Row ss:Index="1"><Cell><Data ss:Type="String">{escape(sheet_name)}</Data></Cell></Row>\n')
+            f.write(f'   <Row ss:Index="{header_row}">')
+            f.write(''.join(f'<Cell><Data ss:Type="String">{escape(header)}</Data></Cell>' for header in lstHeaders))
+            f.write('</Row>\n  </Table>\n </Worksheet>\n')
+        f.write('</Workbook>\n')
+
+
+def generate_synthetic_template(target_tables=5, fields=50, join_tables=3, rule_ratio=0.2, clientid='BENCH', seed=0):
+    """
+    Mapping, rule and header metadata of a synthetic template. Every target
+    table takes its key and half of its fields from a main source table and
+    the rest from join tables joined on KEY1. Source tables and fields are
+    named like FakeSapSystem.generate_table (KEY1, F001, ...), so the
+    template runs against generated SAP tables.
+    Returns (mapping_rows, rule_rows, {sheet: headers}, {source table: non-key field count}).
+    """
+    rng = np.random.default_rng(seed)
+    mapping_rows = []
+    rule_rows = []
+    dictHeaders = {}
+    dictSourceFields = defaultdict(int)
+
+    for t in range(target_tables):
+        target_table = f"Target {t + 1:02d}"
+        main_table = f"ZMAIN{t + 1:02d}"
+        lstJoinTables = [f"ZJOIN{(t + j) % max(join_tables, 1) + 1:02d}" for j in range(join_tables)]
+        lstHeaders = ['KEY']
+        mapping_rows.append({'SoruceTable': main_table, 'SoruceField': 'KEY1', 'TargetTable': target_table, 'TargetField': 'KEY', 'IsMainTable': 1})
+
+        for idx in range(fields):
+            if not lstJoinTables or idx < (fields + 1) // 2:
+                source_table = main_table
+                dictSourceFields[source_table] += 1
+                source_field = f"F{dictSourceFields[source_table]:03d}"
+                target_field = f"MAIN_{source_field}"
+                mapping_rows.append({'SoruceTable': source_table, 'SoruceField': source_field, 'TargetTable': target_table, 'TargetField': target_field, 'IsMainTable': 1})
+            else:
+                source_table = lstJoinTables[idx % len(lstJoinTables)]
+                source_field = f"F{idx + 1:03d}"
+                dictSourceFields[source_table] = max(dictSourceFields[source_table], idx + 1)
+                target_field = f"{source_table}_{source_field}"
+                mapping_rows.append({'SoruceTable': source_table, 'SoruceField': source_field, 'TargetTable': target_table, 'TargetField': target_field,
+                                     'IsMainTable': 0, 'SoruceJoinFiled': 'KEY1', 'TargetJoinField': 'KEY'})
+            lstHeaders.append(target_field)
+
+            if rng.random() < rule_ratio:
+                if rng.random() < 0.5:
+                    rule_rows.append({'ClientID': clientid, 'TargetTable': target_table, 'TargetField': target_field, 'RuleName': 'ZEROFILL', 'Format': '12'})
+                else:
+                    rule_rows.append({'ClientID': clientid, 'TargetTable': target_table, 'TargetField': target_field,
+                                      'RuleName': 'ADDPREFIX|ZEROFILL', 'Format': 'X|14', 'Custome1': 'LEFT'})
+        dictHeaders[target_table] = lstHeaders
+
+    return mapping_rows, rule_rows, dictHeaders, dict(dictSourceFields)
+
+
+def seed_synthetic_template(path, templatename, saptemversion, clientid='BENCH', template_dir=None, **template_options):
+    """
+    Write a synthetic template, its blank SpreadsheetML file and the client's
+    rules into a SQLite metadata file. Returns a summary dict.
+    """
+    from .mdlMetadataStore import SqliteMetadataStore
+
+    mapping_rows, rule_rows, dictHeaders, dictSourceFields = generate_synthetic_template(clientid=clientid, **template_options)
+    template_dir = template_dir or os.path.join(os.path.dirname(os.path.abspath(path)), 'templates')
+    blank_template_path = os.path.join(template_dir, f"{saptemversion}_{templatename}.xml".replace(' ', '_'))
+    write_blank_template(blank_template_path, dictHeaders)
+
+    store = SqliteMetadataStore(path)
+    store.remove_client_rules(clientid)
+    templateid = store.add_template(saptemversion, templatename, blank_template_path, mapping_rows, rule_rows=rule_rows)
+    return {
+        'templateid': templateid,
+        'blank_template_path': blank_template_path,
+        'target_tables': len(dictHeaders),
+        'mapping_rows': len(mapping_rows),
+        'rule_rows': len(rule_rows),
+        'source_tables': dictSourceFields,
+    }
+
+
+def run_mapping_benchmark(path, templatename, saptemversion, clientid='BENCH', rows=10000):
+    """
+    Run a seeded SQLite template through metadata loading, table mapping,
+    transformation rules and output preparation (text conversion and
+    alignment to the template headers, everything of the writer but the
+    Excel COM calls) on generated source tables, and time each stage.
+    """
+    from .mdlDtypes import to_output_frame
+    from .mdlEnum import Metadata_backend, Transformation_details
+    from .mdlMain import load_template_bundle, processs_transformation_rule
+    from .mdlMapping import table_mapping_parallel
+
+    timings = {}
+    rss_before = get_peak_rss()
+
+    start_time = time.perf_counter()
+    dictBundle = load_template_bundle(Metadata_backend.EnumSqlite, path, '', '', saptemversion, templatename, clientid)
+    if dictBundle['iserror'] == True:
+        raise RuntimeError(dictBundle['error_details'])
+    bundle = dictBundle['value']
+    timings['metadata'] = time.perf_counter() - start_time
+
+    # Source tables as the extraction would return them: every field as text
+    system = FakeSapSystem()
+    source_data = {}
+    for tbl, lstFields in bundle.ecc_dict.items():
+        field_count = max([int(fld[1:]) for fld in lstFields if fld.startswith('F') and fld[1:].isdigit()], default=0)
+        system.generate_table(tbl, rows, fields=field_count)
+        source_data[tbl] = system.tables[tbl]['data'][list(lstFields)]
+
+    start_time = time.perf_counter()
+    dictMapping = table_mapping_parallel(bundle.mapping_df, source_data)
+    if dictMapping['iserror'] == True:
+        raise RuntimeError(dictMapping['error_details'])
+    timings['mapping'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    dictRules = processs_transformation_rule(bundle.rules, dictMapping['value'])
+    if dictRules['iserror'] == True:
+        raise RuntimeError(dictRules['error_details'])
+    timings['rules'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    dictHeaders = read_template_headers(bundle.details[Transformation_details.EnumBlankTemplatePath])
+    output_cells = 0
+    for sheet_name, df in dictRules['value'].items():
+        df = to_output_frame(df).reindex(columns=dictHeaders.get(sheet_name, list(df.columns)), fill_value="").fillna("")
+        output_cells += df.to_numpy(dtype=object).size
+    timings['output'] = time.perf_counter() - start_time
+
+    rss_after = get_peak_rss()
+    return {
+        'rows': rows,
+        'target_tables': len(dictRules['value']),
+        'output_cells': output_cells,
+        'seconds': timings,
+        'peak_rss': rss_after,
+        'peak_rss_growth': rss_after - rss_before if rss_before is not None else None,
+    }
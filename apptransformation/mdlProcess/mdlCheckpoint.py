@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .logger import Logger
+from .mdlSpill import dataframe_to_table, table_to_dataframe
+
+
+logger = Logger.get_logger()
+
+CHECKPOINT_DIR = os.path.join("cache", "runs")
+_RUN_ID = re.compile(r"[A-Za-z0-9_-]+")
+
+
+class RunCheckpoint:
+    """
+    Run-scoped checkpoint directory. Every finished table, and every finished
+    key range or field chunk of a table, is stored as a Parquet file so that a
+    failed run can be resumed with the same run id and only fetch what is
+    missing. Parts are named by a hash of what they contain, so a resumed run
+    with a different field list or filter does not pick up stale parts. The
+    key range plan of a table is kept too, so that a resumed run reads the
+    same ranges and finds their parts.
+    """
+
+    def __init__(self, run_id=None, checkpoint_dir=CHECKPOINT_DIR):
+        # The run id names a directory, so it must not be able to leave the checkpoint directory
+        if run_id and not _RUN_ID.fullmatch(str(run_id)):
+            raise ValueError(f"Invalid run id {run_id!r}: only letters, digits, '_' and '-' are allowed.")
+        self.run_id = run_id or f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.run_dir = os.path.join(checkpoint_dir, self.run_id)
+        os.makedirs(self.run_dir, exist_ok=True)
+
+    @staticmethod
+    def make_part_key(tbl, *parts):
+        text = "|".join([tbl.upper()] + [json.dumps(part, sort_keys=True, default=str) for part in parts])
+        return tbl.replace('/', '#') + "_" + hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _path(self, part_key):
+        return os.path.join(self.run_dir, part_key + ".parquet")
+
+    def exists(self):
+        return any(file_name.endswith(".parquet") for file_name in os.listdir(self.run_dir))
+
+    def load(self, part_key, as_arrow=False):
+        """
+        Return a checkpointed DataFrame (or Arrow table), or None when the part is not finished.
+        """
+        path = self._path(part_key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            table = pq.read_table(path, memory_map=True)
+            return table if as_arrow else table_to_dataframe(table)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint {part_key} of run {self.run_id}: {e}")
+            return None
+
+    def save(self, part_key, df):
+        # Written under a temporary name first so that a crash never leaves a partial part behind
+        tmp_path = self._path(part_key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            pq.write_table(df if isinstance(df, pa.Table) else dataframe_to_table(df), tmp_path)
+            os.replace(tmp_path, self._path(part_key))
+        except Exception as e:
+            logger.warning(f"Could not checkpoint {part_key} of run {self.run_id}: {e}")
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def contains_table(self, tbl, lstFields, lstConditions=None):
+        return os.path.isfile(self._path(self.make_part_key(tbl, 'TABLE', sorted(set(lstFields)), lstConditions or [])))
+
+    def load_table(self, tbl, lstFields, lstConditions=None):
+        df = self.load(self.make_part_key(tbl, 'TABLE', sorted(set(lstFields)), lstConditions or []))
+        if df is not None:
+            logger.info(f"Resumed table {tbl} ({len(df)} rows) from checkpoint of run {self.run_id}.")
+        return df
+
+    def save_table(self, tbl, lstFields, df, lstConditions=None):
+        self.save(self.make_part_key(tbl, 'TABLE', sorted(set(lstFields)), lstConditions or []), df)
+
+    def load_key_ranges(self, tbl, key_field, lstConditions=None):
+        """
+        Return the key range plan saved for a table as [(low, high, rows)], or None.
+        """
+        table = self.load(self.make_part_key(tbl, 'PLAN', key_field, lstConditions or []), as_arrow=True)
+        if table is None:
+            return None
+        logger.info(f"Resumed {table.num_rows} key ranges of table {tbl} from checkpoint of run {self.run_id}.")
+        return [(row['low'], row['high'], row['rows']) for row in table.to_pylist()]
+
+    def save_key_ranges(self, tbl, key_field, key_ranges, lstConditions=None):
+        table = pa.table({
+            'low': pa.array([key_range[0] for key_range in key_ranges], pa.string()),
+            'high': pa.array([key_range[1] for key_range in key_ranges], pa.string()),
+            'rows': pa.array([key_range[2] for key_range in key_ranges], pa.int64()),
+        })
+        self.save(self.make_part_key(tbl, 'PLAN', key_field, lstConditions or []), table)
+
+    def remove(self):
+        """
+        Delete the run's checkpoints once the run has finished.
+        """
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+def remove_stale_checkpoints(max_age_days=7, keep_run_id=None, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Delete checkpoint directories of runs that were never resumed.
+    """
+    if not os.path.isdir(checkpoint_dir):
+        return
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    for run_id in os.listdir(checkpoint_dir):
+        run_dir = os.path.join(checkpoint_dir, run_id)
+        if run_id != keep_run_id and os.path.isdir(run_dir) and os.path.getmtime(run_dir) < cutoff:
+            logger.info(f"Removing stale checkpoints of run {run_id}.")
+            shutil.rmtree(run_dir, ignore_errors=True)
@@ -0,0 +1,86 @@
+import atexit
+import hashlib
+import threading
+from urllib.parse import quote_plus
+from sqlalchemy import create_engine, text
+from .logger import Logger
+
+
+logger = Logger.get_logger()
+
+SQL_ODBC_DRIVER = 'ODBC Driver 17 for SQL Server'
+SQL_POOL_SIZE = 5  # Connections kept open per engine
+SQL_POOL_MAX_OVERFLOW = 10  # Extra connections allowed under load, closed when returned
+SQL_POOL_TIMEOUT = 30  # Seconds to wait for a free connection
+SQL_POOL_RECYCLE = 30 * 60  # Seconds before a pooled connection is replaced, ahead of server-side idle timeouts
+
+
+class SqlEngineRegistry:
+    """
+    Process-wide registry of SQLAlchemy engines, one per server, database and
+    credentials, so that every run and every thread of the Django process
+    shares one ODBC connection pool per database. Connections are pinged on
+    checkout and all engines are disposed at shutdown.
+    """
+    _engines = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def engine_key(server, database, username, password):
+        return (str(server).lower(), str(database).lower(), str(username).lower(),
+                hashlib.sha256(str(password).encode('utf-8')).hexdigest())
+
+    @classmethod
+    def get_engine(cls, server, database, username, password):
+        """
+        Return the shared engine for these connection details, creating it on first use.
+        """
+        key = cls.engine_key(server, database, username, password)
+        with cls._lock:
+            engine = cls._engines.get(key)
+            if engine is None:
+                connection_string = (
+                    f"mssql+pyodbc://{quote_plus(username)}:{quote_plus(password)}@{server}/{database}"
+                    f"?driver={quote_plus(SQL_ODBC_DRIVER)}"
+                )
+                engine = create_engine(
+                    connection_string,
+                    pool_size=SQL_POOL_SIZE,
+                    max_overflow=SQL_POOL_MAX_OVERFLOW,
+                    pool_timeout=SQL_POOL_TIMEOUT,
+                    pool_recycle=SQL_POOL_RECYCLE,
+                    pool_pre_ping=True,
+                )
+                cls._engines[key] = engine
+                logger.info(f"Created SQL engine for {server}/{database}")
+        return engine
+
+    @classmethod
+    def dispose_all(cls):
+        with cls._lock:
+            engines = list(cls._engines.values())
+            cls._engines.clear()
+        for engine in engines:
+            try:
+                engine.dispose()
+            except Exception as e:
+                logger.warning(f"Error while disposing SQL engine: {e}")
+
+
+def sql_table_exists(conn, table_name):
+    """
+    True when the table exists in the database of the connection. Used for
+    metadata tables that older deployments do not have yet.
+    """
+    return conn.execute(text("SELECT OBJECT_ID(:table_name, 'U')"), {"table_name": table_name}).scalar() is not None
+
+
+def sql_column_exists(conn, table_name, column_name):
+    """
+    True when the table has the column. Used for metadata columns that
+    older deployments do not have yet.
+    """
+    return conn.execute(text("SELECT COL_LENGTH(:table_name, :column_name)"), {"table_name": table_name, "column_name": column_name}).scalar() is not None
+
+
+atexit.register(SqlEngineRegistry.dispose_all)
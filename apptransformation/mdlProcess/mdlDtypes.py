@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from .logger import Logger
+from .mdlMetadata import get_table_fields
+
+
+logger = Logger.get_logger()
+
+CATEGORY_MAX_RATIO = 0.5  # Distinct values per row up to which a text field becomes a categorical
+CATEGORY_MIN_ROWS = 1000  # Smaller tables are left as they are
+
+# DDIC data types converted to native dtypes
+SAP_INTEGER_TYPES = ('INT1', 'INT2', 'INT4', 'INT8')
+SAP_DECIMAL_TYPES = ('DEC', 'CURR', 'QUAN')
+SAP_DATE_TYPES = ('DATS',)
+SAP_DECIMAL_MAX_PRECISION = 38
+SAP_INITIAL_DATE = '00000000'
+
+
+def _signed_text(values):
+    """
+    Blank-trimmed text with SAP's trailing minus sign moved to the front, as an Arrow array.
+    """
+    text = pc.utf8_trim_whitespace(pa.array(values, type=pa.string(), from_pandas=True))
+    negative = pc.ends_with(text, '-')
+    text = pc.if_else(negative, pc.binary_join_element_wise('-', pc.utf8_slice_codeunits(text, 0, -1), ''), text)
+    return pc.if_else(pc.equal(text, ''), pa.scalar(None, pa.string()), text)
+
+
+def compact_column(series, field):
+    """
+    Convert one extracted text column using its DDIC metadata. Key fields stay
+    text so that joins see the same dtype on both sides.
+    """
+    datatype = str(field.get('DATATYPE', '')).strip()
+    is_key = field.get('KEYFLAG') == 'X'
+
+    try:
+        if not is_key and datatype in SAP_INTEGER_TYPES:
+            return pd.Series(pd.arrays.ArrowExtensionArray(pc.cast(_signed_text(series), pa.int64())), index=series.index, name=series.name)
+        if not is_key and datatype in SAP_DECIMAL_TYPES:
+            precision = min(max(int(field.get('LENG') or 0), 1), SAP_DECIMAL_MAX_PRECISION)
+            scale = min(int(field.get('DECIMALS') or 0), precision)
+            return pd.Series(pd.arrays.ArrowExtensionArray(pc.cast(_signed_text(series), pa.decimal128(precision, scale))), index=series.index, name=series.name)
+        if not is_key and datatype in SAP_DATE_TYPES:
+            # date32 also holds 99991231; initial dates (00000000) become null and
+            # sap_text writes them back, so any other unparsable value keeps the column as text
+            text = pa.array(series, type=pa.string(), from_pandas=True)
+            timestamps = pc.strptime(text, format='%Y%m%d', unit='s', error_is_null=True)
+            if pc.any(pc.and_(pc.is_null(timestamps), pc.not_equal(text, SAP_INITIAL_DATE))).as_py():
+                raise ValueError("values other than the initial date are not dates")
+            return pd.Series(pd.arrays.ArrowExtensionArray(pc.cast(timestamps, pa.date32())), index=series.index, name=series.name)
+    except (pa.ArrowInvalid, ValueError) as e:
+        logger.warning(f"Keeping field {series.name} ({datatype}) as text: {e}")
+
+    if len(series) >= CATEGORY_MIN_ROWS and series.nunique(dropna=False) <= len(series) * CATEGORY_MAX_RATIO:
+        return series.astype('category')
+    return series.astype('string[pyarrow]')
+
+
+def compact_sap_dtypes(df, dfies_tab):
+    """
+    Return the table with memory-compact dtypes: low-cardinality text as
+    categoricals, other text as Arrow strings, integers, decimals and dates
+    as Arrow-backed native types.
+    """
+    dictFields = {field['FIELDNAME']: field for field in dfies_tab}
+    return pd.DataFrame({col: compact_column(df[col], dictFields.get(col, {})) if df[col].dtype == object else df[col]
+                         for col in df.columns}, index=df.index)
+
+
+def compact_extracted_tables(connection_params, dictDatadf):
+    """
+    Apply compact_sap_dtypes to every extracted table, using the cached DDIC metadata.
+    """
+    dicResult = {} #Function Result Dictionary
+    try:
+        dicResult['iserror'] = False
+        dictCompact = {}
+        for tbl, df in dictDatadf.items():
+            bytes_before = df.memory_usage(deep=True).sum()
+            dictCompact[tbl] = compact_sap_dtypes(df, get_table_fields(connection_params, tbl))
+            bytes_after = dictCompact[tbl].memory_usage(deep=True).sum()
+            logger.info(f"Compacted dtypes of table {tbl}: {bytes_before / 1024 ** 2:.1f} MB -> {bytes_after / 1024 ** 2:.1f} MB.")
+        dicResult['value'] = dictCompact
+
+    except Exception as e:
+        dicResult['iserror'] = True
+        dicResult['error'] = "Unhandled Error in Compacting Extracted Data Types."
+        dicResult['error_details'] = dicResult['error']  + " | " + str(e)
+
+    return dicResult
+
+
+def sap_text(series):
+    """
+    Object-dtype text of a column in SAP's external format, so that compacted
+    columns behave like extracted text: null dates and numbers are the SAP
+    initial values they were compacted from (00000000 and blank), missing
+    text is NaN. Object columns are returned as they are.
+    """
+    if series.dtype == object:
+        return series
+
+    if isinstance(series.dtype, pd.ArrowDtype):
+        values = pa.array(series.array)
+        if pa.types.is_date(values.type):
+            values = pc.fill_null(pc.strftime(values, format='%Y%m%d'), SAP_INITIAL_DATE)
+        elif pa.types.is_integer(values.type) or pa.types.is_decimal(values.type):
+            # SAP writes the minus sign after the number
+            values = pc.cast(values, pa.string())
+            negative = pc.starts_with(values, '-')
+            values = pc.fill_null(pc.if_else(negative, pc.binary_join_element_wise(pc.utf8_slice_codeunits(values, 1), '-', ''), values), '')
+        text = pd.Series(values.to_numpy(zero_copy_only=False), index=series.index, name=series.name, dtype=object)
+    else:
+        text = series.astype(object)
+    return text.where(text.notna(), np.nan)
+
+
+def to_output_frame(df):
+    """
+    Convert every compacted column back to object text for writing.
+    """
+    if all(dtype == object for dtype in df.dtypes):
+        return df
+    return pd.DataFrame({col: sap_text(df[col]) for col in df.columns}, index=df.index)
+
+
+def align_join_dtypes(left_df, right_df, join_cols):
+    """
+    Make the join columns of two frames mergeable: where a compacted native
+    column meets a column of another kind, both sides are joined as SAP text.
+    """
+    text_kinds = (object, 'category', 'string')
+    for col in join_cols:
+        left_dtype, right_dtype = left_df[col].dtype, right_df[col].dtype
+        if left_dtype == right_dtype or (left_dtype in text_kinds and right_dtype in text_kinds):
+            continue
+        left_df = left_df.assign(**{col: sap_text(left_df[col])})
+        right_df = right_df.assign(**{col: sap_text(right_df[col])})
+    return left_df, right_df
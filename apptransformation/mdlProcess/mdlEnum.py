@@ -6,4 +6,20 @@ class Transformation_details:
     EnumCT_Script = 4
     EnumCT_Script1 = 5
     EnumCT_Script2 = 6
-    EnumCT_Script3 = 7
\ No newline at end of file
+    EnumCT_Script3 = 7
+
+
+class Extraction_mode:
+    EnumOffset = 'OFFSET'
+    EnumKeyRange = 'KEYRANGE'
+
+
+class Metadata_backend:
+    EnumSqlServer = 'mssql'
+    EnumSqlite = 'sqlite'
+
+
+class Join_policy:
+    EnumWarn = 'WARN'
+    EnumDedupe = 'DEDUPE'
+    EnumRefuse = 'REFUSE'
@@ -0,0 +1,619 @@
+import re
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from .mdlRfc import ABAPApplicationError, ABAPRuntimeError, CommunicationError
+from .logger import Logger
+from .mdlEnum import Extraction_mode
+from .mdlSapPool import SAP_POOL_MAX_SIZE, get_sap_connection
+from .mdlMetadata import get_table_fields
+from .mdlCheckpoint import RunCheckpoint
+from .mdlSpill import EXTRACTION_MEMORY_BUDGET, SpillBuffer, table_to_dataframe
+from .mdlTableCache import DELTA_FULL_REFRESH_DAYS
+
+
+logger = Logger.get_logger()
+
+RFC_OPTION_LINE_LENGTH = 72  # RFC_READ_TABLE OPTIONS-TEXT is CHAR72
+RFC_WA_LENGTH = 512  # RFC_READ_TABLE DATA-WA is CHAR512
+KEY_RANGE_SIZE = 50000  # Target rows per key range
+KEY_RANGE_MAX_RETRIES = 3
+
+# Half-open key range [low, high) of the leading key field, None for an open
+# bound, with the rows the plan counted in it; None for a range of a single
+# key value holding more than the range size, which is not counted
+KeyRange = namedtuple('KeyRange', ['low', 'high', 'rows'])
+
+# RFC_READ_TABLE right-aligns these types in the WA line, so they are trimmed on both sides
+RFC_NUMERIC_TYPES = ('P', 'F', 'I', 'b', 's', '8')
+
+# Filter operators allowed in ECC_Extraction_Filter, with their Open SQL form
+SAP_FILTER_OPERATORS = {'EQ': '=', 'NE': '<>', 'GT': '>', 'GE': '>=', 'LT': '<', 'LE': '<=', 'LIKE': 'LIKE'}
+_SAP_FIELD_NAME = re.compile(r"^[A-Z0-9_/]+$")
+
+# A token is a run of non blanks, where a quoted ABAP literal ('' escapes a quote) may contain blanks
+_OPTION_TOKEN = re.compile(r"(?:'(?:[^']|'')*'|[^\s'])+")
+
+
+def quote_sap_literal(value):
+    """
+    Quote a value as an ABAP character literal for a dynamic WHERE clause.
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def build_rfc_options(lstConditions):
+    """
+    AND the given WHERE conditions together and wrap the clause into
+    RFC_READ_TABLE OPTIONS lines without breaking a literal across lines.
+    """
+    lstOptions = []
+    conditions = [cond for cond in lstConditions if cond]
+    if not conditions:
+        return lstOptions
+
+    where_clause = " AND ".join(f"( {cond} )" if len(conditions) > 1 else cond for cond in conditions)
+
+    line = ''
+    for token in _OPTION_TOKEN.findall(where_clause):
+        if len(token) > RFC_OPTION_LINE_LENGTH:
+            raise ValueError(f"WHERE token longer than {RFC_OPTION_LINE_LENGTH} characters: {token}")
+        if line and len(line) + 1 + len(token) > RFC_OPTION_LINE_LENGTH:
+            lstOptions.append({'TEXT': line})
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    if line:
+        lstOptions.append({'TEXT': line})
+
+    return lstOptions
+
+
+def build_filter_condition(field, operator, value):
+    """
+    Compile one filter row into an Open SQL condition. IN, NOT IN and
+    BETWEEN take their values pipe-delimited, like the other mapping columns.
+    """
+    field = str(field).strip().upper()
+    operator = " ".join(str(operator).upper().split())
+    values = [val.strip() for val in str(value).split('|')] if pd.notna(value) else ['']
+
+    if not _SAP_FIELD_NAME.match(field):
+        raise ValueError(f"Invalid filter field name: {field}")
+
+    if operator in SAP_FILTER_OPERATORS:
+        return f"{field} {SAP_FILTER_OPERATORS[operator]} {quote_sap_literal(values[0])}"
+    if operator in ('IN', 'NOT IN'):
+        return f"{field} {operator} ( {', '.join(quote_sap_literal(val) for val in values)} )"
+    if operator == 'BETWEEN':
+        if len(values) != 2:
+            raise ValueError(f"BETWEEN filter on {field} needs two values, got: {value}")
+        return f"{field} BETWEEN {quote_sap_literal(values[0])} AND {quote_sap_literal(values[1])}"
+    raise ValueError(f"Unsupported filter operator '{operator}' on field {field}")
+
+
+def compile_extraction_filters(df_filters):
+    """
+    Compile ECC_Extraction_Filter rows into WHERE conditions per source table.
+    All conditions of one table are ANDed when the OPTIONS are built.
+    """
+    dictFilters = defaultdict(list)
+    for row in df_filters.itertuples(index=False):
+        condition = build_filter_condition(row.FilterField, row.Operator, row.FilterValue)
+        if condition not in dictFilters[row.SoruceTable]:
+            dictFilters[row.SoruceTable].append(condition)
+    return dict(dictFilters)
+
+
+def compile_delta_config(df_delta):
+    """
+    Compile ECC_Delta_Config rows into the delta settings per source table:
+    the pipe-delimited date fields set on creation or change, and the days
+    after which the table is extracted in full again. Tables without change
+    fields are always extracted in full.
+    """
+    dictDelta = {}
+    for row in df_delta.itertuples(index=False):
+        fields = [fld.strip().upper() for fld in str(row.ChangeFields).split('|') if fld.strip()] if pd.notna(row.ChangeFields) else []
+        if not fields:
+            continue
+        for fld in fields:
+            if not _SAP_FIELD_NAME.match(fld):
+                raise ValueError(f"Invalid delta change field name: {fld}")
+        full_refresh_days = int(row.FullRefreshDays) if pd.notna(row.FullRefreshDays) else DELTA_FULL_REFRESH_DAYS
+        dictDelta[row.SoruceTable] = {'fields': fields, 'full_refresh_days': full_refresh_days}
+    return dictDelta
+
+
+def get_key_fields(dfies_tab):
+    """
+    Return the primary-key fields from a DDIF_FIELDINFO_GET DFIES_TAB, in key
+    order and without the client field.
+    """
+    key_fields = [field for field in dfies_tab if field.get('KEYFLAG') == 'X' and field.get('DATATYPE') != 'CLNT']
+    key_fields.sort(key=lambda field: int(field.get('POSITION') or 0))
+    return [field['FIELDNAME'] for field in key_fields]
+
+
+def build_key_range_condition(key_field, key_range):
+    """
+    Build the WHERE conditions selecting one half-open key range [low, high).
+    An open bound is given as None.
+    """
+    low, high = key_range[0], key_range[1]
+    lstConditions = []
+    if low is not None:
+        lstConditions.append(f"{key_field} >= {quote_sap_literal(low)}")
+    if high is not None:
+        lstConditions.append(f"{key_field} < {quote_sap_literal(high)}")
+    return lstConditions
+
+
+def build_delta_condition(delta_fields, watermark):
+    """
+    Build the WHERE condition selecting rows created or changed on or after
+    the watermark date (YYYYMMDD) in any of the given date fields.
+    """
+    return " OR ".join(f"{fld} >= {quote_sap_literal(watermark)}" for fld in delta_fields)
+
+
+def merge_key_ranges(key_ranges, range_size=KEY_RANGE_SIZE):
+    """
+    Merge neighbouring KeyRanges while their counted rows fit in range_size.
+    The ranges must be consecutive, each one starting where the previous ends.
+    """
+    lstMerged = []
+    for key_range in key_ranges:
+        previous = lstMerged[-1] if lstMerged else None
+        if (previous is not None and previous.rows is not None and key_range.rows is not None
+                and previous.rows + key_range.rows <= range_size):
+            lstMerged[-1] = KeyRange(previous.low, key_range.high, previous.rows + key_range.rows)
+        else:
+            lstMerged.append(key_range)
+    return lstMerged
+
+
+def plan_key_ranges(connection, tbl, key_field, lstConditions=None, range_size=KEY_RANGE_SIZE):
+    """
+    Split the selected rows into consecutive KeyRanges of at most range_size
+    rows. Each range is probed for range_size + 1 key values; a range holding
+    more is split at the median of the values SAP returned for it. The
+    boundaries are real key values compared by SAP's database, so the ranges
+    always partition the table whatever order it collates keys in, and every
+    probe is a bounded read instead of a ROWSKIPS page that rescans the
+    skipped rows.
+    """
+    key_ranges = []
+    # Ranges still to plan, lowest first, with their probed key values once known
+    lstPending = [(None, None, None)]
+    while lstPending:
+        low, high, values = lstPending.pop()
+        if values is None:
+            values = probe_key_values(connection, tbl, key_field, (low, high), lstConditions, range_size + 1)
+        if len(values) <= range_size:
+            key_ranges.append(KeyRange(low, high, len(values)))
+            continue
+
+        # A split value that SAP sorts first leaves the lower part empty, so then the next candidate is tried
+        candidates = sorted(set(values) - {low})
+        low_values = []
+        while candidates and not low_values:
+            split = candidates.pop(len(candidates) // 2)
+            low_values = probe_key_values(connection, tbl, key_field, (low, split), lstConditions, range_size + 1)
+        if not low_values:
+            key_ranges.append(KeyRange(low, high, None))
+            continue
+        lstPending.append((split, high, None))
+        lstPending.append((low, split, low_values))
+
+    key_ranges = merge_key_ranges(key_ranges, range_size)
+    counted_rows = sum(key_range.rows for key_range in key_ranges if key_range.rows is not None)
+    uncounted = sum(key_range.rows is None for key_range in key_ranges)
+    logger.info(f"Planned {len(key_ranges)} key ranges on {tbl}.{key_field} for {counted_rows} rows"
+                + (f" and {uncounted} single-value ranges over {range_size} rows." if uncounted else "."))
+    return key_ranges
+
+
+def probe_key_values(connection, tbl, key_field, key_range, lstConditions=None, max_rows=KEY_RANGE_SIZE + 1):
+    """
+    Read up to max_rows values of the key field in one key range.
+    """
+    range_rows, _ = read_table_key_range(connection, tbl, [key_field], key_field, key_range, lstConditions, row_count=max_rows)
+    return [row.rstrip() for row in range_rows]
+
+
+def iter_table_pages(connection, tbl, lstFields, lstConditions=None, row_chunk_size=1000):
+    """
+    Page through RFC_READ_TABLE with ROWSKIPS/ROWCOUNT, yielding the WA rows
+    and the FIELDS metadata of every page. Every call makes SAP rescan the
+    skipped rows, so this is only used for tables without a usable key.
+    """
+    skip_rows = 0
+    lstOptions = build_rfc_options(lstConditions or [])
+
+    while True:
+        result = connection.call(
+            'RFC_READ_TABLE',
+            DELIMITER='|',
+            QUERY_TABLE=tbl,
+            FIELDS=[{'FIELDNAME': fld} for fld in lstFields],
+            OPTIONS=lstOptions,
+            ROWSKIPS=skip_rows,
+            ROWCOUNT=row_chunk_size
+        )
+        if not result:
+            break
+        page_rows = [row['WA'] for row in result.get('DATA', [])]
+        yield page_rows, result.get('FIELDS', [])
+
+        if len(page_rows) < row_chunk_size:
+            break
+        skip_rows += row_chunk_size
+
+
+def read_table_rows(connection, tbl, lstFields, lstConditions=None, row_chunk_size=1000):
+    """
+    Read all pages of iter_table_pages. Returns the WA rows and the FIELDS metadata.
+    """
+    data_rows = []
+    fields = []
+    for page_rows, page_fields in iter_table_pages(connection, tbl, lstFields, lstConditions, row_chunk_size):
+        fields = page_fields or fields
+        data_rows.extend(page_rows)
+    return data_rows, fields
+
+
+def read_table_key_range(connection, tbl, lstFields, key_field, key_range, lstConditions=None, max_retries=KEY_RANGE_MAX_RETRIES, row_count=0):
+    """
+    Read the rows of one key range in a single RFC_READ_TABLE call, all of
+    them or the first row_count. A failed range is retried on its own
+    without touching the ranges already read. Returns the WA rows and the
+    FIELDS metadata.
+    """
+    lstRangeOptions = build_rfc_options((lstConditions or []) + build_key_range_condition(key_field, key_range))
+
+    attempt = 1
+    while True:
+        try:
+            result = connection.call(
+                'RFC_READ_TABLE',
+                DELIMITER='|',
+                QUERY_TABLE=tbl,
+                FIELDS=[{'FIELDNAME': fld} for fld in lstFields],
+                OPTIONS=lstRangeOptions,
+                ROWCOUNT=row_count
+            )
+            return [row['WA'] for row in result.get('DATA', [])], result.get('FIELDS', [])
+        except CommunicationError as e:
+            if attempt >= max_retries:
+                raise
+            logger.warning(f"Retrying key range {key_range} of table {tbl} (attempt {attempt}/{max_retries}): {e}")
+            connection.reopen()
+            attempt += 1
+
+
+def decode_wa_table(data_rows, fields):
+    """
+    Decode RFC_READ_TABLE WA lines into an Arrow table by slicing each field at
+    its OFFSET/LENGTH from FIELDS, so a '|' inside a value is harmless. The
+    lines are loaded once into an Arrow string array and every column is cut
+    out of it in Arrow, without building a Python list per row.
+    """
+    wa_array = pa.array(data_rows, type=pa.string())
+
+    lstColumns = []
+    for field in fields:
+        offset = int(field['OFFSET'])
+        length = int(field['LENGTH'])
+        column = pc.utf8_slice_codeunits(wa_array, start=offset, stop=offset + length)
+        if field.get('TYPE') in RFC_NUMERIC_TYPES:
+            column = pc.utf8_trim_whitespace(column)
+        else:
+            column = pc.utf8_rtrim_whitespace(column)
+        lstColumns.append(column)
+
+    return pa.table(lstColumns, names=[field['FIELDNAME'] for field in fields])
+
+
+def decode_wa_rows(data_rows, fields, arrow_strings=False):
+    """
+    Decode RFC_READ_TABLE WA lines into a DataFrame (see decode_wa_table).
+    With arrow_strings the columns stay Arrow-backed, otherwise they are
+    converted to the usual object dtype.
+    """
+    table = decode_wa_table(data_rows, fields)
+
+    dictColumns = {}
+    for name, column in zip(table.column_names, table.columns):
+        if arrow_strings:
+            dictColumns[name] = pd.Series(column, dtype=pd.ArrowDtype(pa.string()))
+        else:
+            dictColumns[name] = column.to_numpy(zero_copy_only=False)
+
+    return pd.DataFrame(dictColumns, columns=table.column_names)
+
+
+def get_field_width(field):
+    """
+    Width a DFIES field takes in the RFC_READ_TABLE WA line.
+    """
+    return max(int(field.get('LENG') or 0), int(field.get('OUTPUTLEN') or 0))
+
+
+def plan_field_chunks(dfies_tab, lstFields, key_fields, max_width=RFC_WA_LENGTH):
+    """
+    Bin-pack the non-key fields into as few RFC_READ_TABLE calls as possible
+    (first fit decreasing on the DDIC width), so that no call, with the key
+    fields and the '|' delimiters added, goes over the WA line width.
+    Fields that cannot fit in any call are reported as skipped.
+    """
+    field_widths = {field['FIELDNAME']: get_field_width(field) for field in dfies_tab}
+
+    # Every field takes its width plus one delimiter; the last delimiter is not written
+    key_width = sum(field_widths[fld] + 1 for fld in key_fields)
+    capacity = max_width + 1 - key_width
+
+    lstNonKeyFields = [fld for fld in dict.fromkeys(lstFields) if fld not in key_fields]
+    lstChunks = []
+    lstChunkSizes = []
+    lstSkipped = []
+    for fld in sorted(lstNonKeyFields, key=lambda fld: field_widths[fld], reverse=True):
+        size = field_widths[fld] + 1
+        if size > capacity:
+            lstSkipped.append(fld)
+            continue
+        for idx, used in enumerate(lstChunkSizes):
+            if used + size <= capacity:
+                lstChunks[idx].append(fld)
+                lstChunkSizes[idx] += size
+                break
+        else:
+            lstChunks.append([fld])
+            lstChunkSizes.append(size)
+
+    # Keep the requested field order inside each chunk
+    field_order = {fld: idx for idx, fld in enumerate(lstNonKeyFields)}
+    lstChunks = [sorted(chunk, key=field_order.get) for chunk in lstChunks]
+
+    return {
+        'chunks': lstChunks,
+        'chunk_widths': [key_width + used - 1 for used in lstChunkSizes],
+        'key_fields': list(key_fields),
+        'key_width': max(key_width - 1, 0),
+        'skipped': lstSkipped,
+    }
+
+
+def estimate_table_sizes(connection, connection_params, dictTableFields):
+    """
+    Estimate rows (EM_GET_NUMBER_OF_ENTRIES) and WA row width (cached DDIC
+    lengths of the requested and key fields) for every table, for scheduling.
+    Unknown values are estimated as 0.
+    """
+    dictRows = {}
+    try:
+        result = connection.call('EM_GET_NUMBER_OF_ENTRIES', IT_TABLES=[{'TABNAME': tbl} for tbl in dictTableFields])
+        dictRows = {row['TABNAME']: int(row['TABROWS']) for row in result['IT_TABLES']}
+    except (ABAPApplicationError, ABAPRuntimeError) as e:
+        logger.warning(f"Could not read table row counts, scheduling by row width only: {e}")
+
+    dictSizes = {}
+    for tbl, lstFields in dictTableFields.items():
+        width = 0
+        try:
+            dfies_tab = get_table_fields(connection_params, tbl, connection)
+            field_widths = {field['FIELDNAME']: get_field_width(field) for field in dfies_tab}
+            lstReadFields = set(get_key_fields(dfies_tab)) | set(lstFields)
+            width = sum(field_widths.get(fld, 0) + 1 for fld in lstReadFields)
+        except (ABAPApplicationError, ABAPRuntimeError) as e:
+            logger.warning(f"Could not read field lengths of table {tbl} for scheduling: {e}")
+        dictSizes[tbl] = {'rows': dictRows.get(tbl, 0), 'width': width}
+
+    return dictSizes
+
+
+def read_field_chunk(connection, tbl, lstFields, key_field=None, key_ranges=None, lstConditions=None, row_chunk_size=1000, checkpoint=None, memory_budget=EXTRACTION_MEMORY_BUDGET):
+    """
+    Read one set of fields as a DataFrame (see read_field_table); Arrow-backed
+    on the memory-mapped spill file when it is larger than the memory budget.
+    """
+    table, _ = read_field_table(connection, tbl, lstFields, key_field, key_ranges, lstConditions, row_chunk_size, checkpoint, memory_budget)
+    return table_to_dataframe(table, memory_budget)
+
+
+def read_field_table(connection, tbl, lstFields, key_field=None, key_ranges=None, lstConditions=None, row_chunk_size=1000, checkpoint=None, memory_budget=EXTRACTION_MEMORY_BUDGET):
+    """
+    Read one set of fields as an Arrow table, by key range when ranges are
+    given and by ROWSKIPS paging otherwise. Returns the table and the rows
+    read per key range, in plan order (one entry for a paged read). With a
+    run checkpoint every finished key range, or the whole paged read, is
+    saved and reused on resume. The decoded pages spill to an Arrow file once
+    they exceed the memory budget, and the table is memory-mapped from there.
+    """
+    if key_ranges:
+        return read_key_ranges(connection, tbl, lstFields, key_field, key_ranges, lstConditions, checkpoint, memory_budget)
+
+    part_key = RunCheckpoint.make_part_key(tbl, 'ROWS', list(lstFields), lstConditions or [])
+    table = checkpoint.load(part_key, as_arrow=True) if checkpoint is not None else None
+    if table is None:
+        # The spill file is removed once the table is built; a spilled table keeps its memory map
+        with SpillBuffer(memory_budget, tbl) as spill_buffer:
+            for page_rows, fields in iter_table_pages(connection, tbl, lstFields, lstConditions, row_chunk_size):
+                if fields:
+                    spill_buffer.append(decode_wa_table(page_rows, fields))
+            table = spill_buffer.to_table(lstFields)
+        if checkpoint is not None:
+            checkpoint.save(part_key, table)
+    return table, [table.num_rows]
+
+
+def read_key_ranges(connection, tbl, lstFields, key_field, key_ranges, lstConditions=None, checkpoint=None, memory_budget=EXTRACTION_MEMORY_BUDGET):
+    """
+    Read one set of fields range by range (see read_field_table). The ranges
+    partition the table, so rows changed since planning are still read once;
+    a range returning more rows than planned is only logged.
+    """
+    range_rows = []
+    with SpillBuffer(memory_budget, tbl) as spill_buffer:
+        resumed = 0
+        for key_range in key_ranges:
+            part_key = RunCheckpoint.make_part_key(tbl, 'RANGE', list(lstFields), key_field, list(key_range[:2]), lstConditions or [])
+            range_table = checkpoint.load(part_key, as_arrow=True) if checkpoint is not None else None
+            if range_table is None:
+                wa_rows, fields = read_table_key_range(connection, tbl, lstFields, key_field, key_range, lstConditions)
+                if not fields:
+                    range_rows.append(0)
+                    continue
+                range_table = decode_wa_table(wa_rows, fields)
+                if key_range.rows is not None and range_table.num_rows > key_range.rows:
+                    logger.info(f"Key range {key_range[:2]} of table {tbl} grew from {key_range.rows} to {range_table.num_rows} rows since planning.")
+                if checkpoint is not None:
+                    checkpoint.save(part_key, range_table)
+            else:
+                resumed += 1
+            spill_buffer.append(range_table)
+            range_rows.append(range_table.num_rows)
+
+        if resumed:
+            logger.info(f"Resumed {resumed} of {len(key_ranges)} key ranges of table {tbl} from checkpoint.")
+        return spill_buffer.to_table(lstFields), range_rows
+
+
+def fetch_field_chunk(connection_params, tbl, chunk_fields, key_fields, key_ranges=None, lstConditions=None, row_chunk_size=1000, checkpoint=None, memory_budget=EXTRACTION_MEMORY_BUDGET):
+    """
+    Fetch one field chunk over its own pooled connection. The key fields are
+    always read along with the chunk so that chunks can be stitched by key.
+    Chunks come from plan_field_chunks and should fit the WA line; should SAP
+    still reject one, it is split in half and retried, and a single field
+    that still fails is skipped. Returns a list of (Arrow table, rows per key
+    range) as read by read_field_table.
+    """
+    lstReadFields = list(dict.fromkeys(key_fields + chunk_fields))
+    try:
+        with get_sap_connection(connection_params) as connection:
+            table, range_rows = read_field_table(connection, tbl, lstReadFields, key_fields[0] if key_fields else None, key_ranges, lstConditions, row_chunk_size, checkpoint, memory_budget)
+    except (ABAPApplicationError, ABAPRuntimeError) as e:
+        if len(chunk_fields) <= 1:
+            logger.warning(f"Skipping field(s) {chunk_fields} of table {tbl} due to repeated fetch failure: {e}")
+            return []
+        half = len(chunk_fields) // 2
+        logger.warning(f"Chunk fetch error for fields {chunk_fields} of table {tbl}, splitting chunk: {e}")
+        return (fetch_field_chunk(connection_params, tbl, chunk_fields[:half], key_fields, key_ranges, lstConditions, row_chunk_size, checkpoint, memory_budget)
+                + fetch_field_chunk(connection_params, tbl, chunk_fields[half:], key_fields, key_ranges, lstConditions, row_chunk_size, checkpoint, memory_budget))
+
+    logger.info(f"Successfully fetched {table.num_rows} rows for fields {chunk_fields} from table {tbl}")
+    return [(table, range_rows)]
+
+
+def stitch_field_chunks(lstChunks, key_fields, memory_budget=EXTRACTION_MEMORY_BUDGET, name='stitch'):
+    """
+    Join the field chunks of one table, given as (Arrow table, rows per key
+    range), into a single DataFrame on the key fields. All chunks read the
+    same key ranges, so they are joined range by range on zero-copy slices
+    and the joined ranges collect in a SpillBuffer: a spilled table is never
+    loaded whole. Without key fields the chunks can only be placed side by
+    side by position.
+    """
+    if not key_fields:
+        logger.warning("No key fields available, stitching field chunks by row position.")
+        return pd.concat([table_to_dataframe(table, memory_budget).reset_index(drop=True) for table, _ in lstChunks], axis=1)
+    if len(lstChunks) == 1:
+        return table_to_dataframe(lstChunks[0][0], memory_budget)
+
+    # Chunks split into different ranges (a paged fallback next to a ranged read) are joined whole
+    if len({len(range_rows) for _, range_rows in lstChunks}) > 1:
+        lstChunks = [(table, [table.num_rows]) for table, _ in lstChunks]
+
+    sort_keys = [(fld, 'ascending') for fld in key_fields]
+    with SpillBuffer(memory_budget, name) as spill_buffer:
+        offsets = [0] * len(lstChunks)
+        for range_idx in range(len(lstChunks[0][1])):
+            joined = None
+            for chunk_idx, (table, range_rows) in enumerate(lstChunks):
+                part = table.slice(offsets[chunk_idx], range_rows[range_idx])
+                offsets[chunk_idx] += range_rows[range_idx]
+                joined = part if joined is None else joined.join(part, keys=key_fields, join_type='full outer', use_threads=False)
+            spill_buffer.append(joined.sort_by(sort_keys))
+        columns = list(dict.fromkeys(col for table, _ in lstChunks for col in table.column_names))
+        return table_to_dataframe(spill_buffer.to_table(columns), memory_budget)
+
+
+def get_data_from_sap_table_1(connection_params, tbl, lstFields, extraction_mode=Extraction_mode.EnumKeyRange, lstConditions=None, allow_empty=False, checkpoint=None, memory_budget=EXTRACTION_MEMORY_BUDGET):
+    """
+    Extract one SAP table: plan key ranges and field chunks, fetch the chunks
+    concurrently and stitch them by key. The value is {tbl: DataFrame}.
+    """
+    dicResult = {}
+    row_chunk_size = 1000  # Rows per chunk
+
+    try:
+        dicResult['iserror'] = False
+
+        with get_sap_connection(connection_params) as connection:
+            logger.info(f"Connected to SAP successfully. Processing table: {tbl}")
+
+            # Get actual available fields from the table, from the DDIC cache
+            dfies_tab = get_table_fields(connection_params, tbl, connection)
+            actual_fields = list(set(field['FIELDNAME'] for field in dfies_tab))
+
+            # Validate fields
+            lstNotFoundField = [fld for fld in lstFields if fld not in actual_fields]
+            if lstNotFoundField:
+                strError = f"Fields not found in table {tbl}: {','.join(lstNotFoundField)}"
+                dicResult.update({'iserror': True, 'error': strError, 'error_details': strError})
+                logger.warning(strError)
+                return dicResult
+
+            # Split the table into key ranges once; every field chunk reads the same ranges,
+            # and a resumed run reuses the checkpointed plan so that its finished ranges match
+            key_ranges = []
+            key_fields = get_key_fields(dfies_tab)
+            if extraction_mode == Extraction_mode.EnumKeyRange and key_fields:
+                if checkpoint is not None:
+                    key_ranges = [KeyRange(*key_range) for key_range in checkpoint.load_key_ranges(tbl, key_fields[0], lstConditions) or []]
+                if not key_ranges:
+                    try:
+                        key_ranges = plan_key_ranges(connection, tbl, key_fields[0], lstConditions)
+                        if checkpoint is not None:
+                            checkpoint.save_key_ranges(tbl, key_fields[0], key_ranges, lstConditions)
+                    except (ABAPApplicationError, ABAPRuntimeError) as e:
+                        logger.warning(f"Key range planning failed for table {tbl}, falling back to ROWSKIPS paging: {e}")
+
+        # Pack the non-key fields into as few WA-sized chunks as possible; every chunk also carries the key fields
+        dictFieldPlan = plan_field_chunks(dfies_tab, lstFields, key_fields)
+        lstFieldChunks = dictFieldPlan['chunks']
+        if not lstFieldChunks and key_fields:
+            lstFieldChunks = [[]]
+        logger.info(f"Field chunk plan for table {tbl}: {len(lstFieldChunks)} call(s), widths {dictFieldPlan['chunk_widths']}, "
+                    f"key fields {key_fields} ({dictFieldPlan['key_width']} chars), chunks {lstFieldChunks}")
+        if dictFieldPlan['skipped']:
+            logger.warning(f"Skipping field(s) {dictFieldPlan['skipped']} of table {tbl}: wider than the {RFC_WA_LENGTH} character WA line.")
+
+        # Fetch the chunks concurrently, each over its own pooled connection
+        lstChunks = []
+        with ThreadPoolExecutor(max_workers=SAP_POOL_MAX_SIZE) as executor:
+            lsttask = [executor.submit(fetch_field_chunk, connection_params, tbl, chunk, key_fields, key_ranges, lstConditions, row_chunk_size, checkpoint, memory_budget)
+                       for chunk in lstFieldChunks]
+            for task in lsttask:
+                lstChunks.extend(task.result())
+
+        all_data_df = stitch_field_chunks(lstChunks, key_fields, memory_budget, tbl) if lstChunks else pd.DataFrame()
+
+        if all_data_df.empty and not allow_empty:
+            strError = f"No data retrieved from SAP for table {tbl}"
+            dicResult.update({'iserror': True, 'error': strError, 'error_details': strError})
+            logger.warning(strError)
+            return dicResult
+
+        dicResult['value'] = {tbl: all_data_df}
+        dicResult['plan'] = dictFieldPlan
+        logger.info(f"Total {len(all_data_df)} rows and {len(all_data_df.columns)} columns fetched from table {tbl}.")
+
+    except Exception as e:
+        strError = f"Unhandled error while fetching data from SAP table: {tbl} | {str(e)}"
+        dicResult.update({'iserror': True, 'error': strError, 'error_details': strError})
+        logger.warning(strError)
+
+    return dicResult
@@ -0,0 +1,305 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+import numpy as np
+import pandas as pd
+from .mdlRfc import ABAPApplicationError, CommunicationError
+from .mdlSapPool import SapConnectionPool
+
+
+FAKE_SAP_WA_LENGTH = 512  # RFC_READ_TABLE DATA-WA is CHAR512
+FAKE_SAP_NUMERIC_TYPES = ('P', 'F', 'I')
+
+_WHERE_TOKEN = re.compile(r"'(?:[^']|'')*'|<>|>=|<=|=|>|<|\(|\)|,|[A-Za-z0-9_/]+")
+_COMPARISON_OPERATORS = {'=': 'EQ', '<>': 'NE', '>': 'GT', '>=': 'GE', '<': 'LT', '<=': 'LE'}
+
+
+class FakeSapSystem:
+    """
+    In-memory SAP system with synthetic tables, answering the function modules
+    the extraction uses. Counts calls and scanned rows per table so that
+    benchmarks can report RFC round trips.
+    """
+
+    def __init__(self, latency=0.0, row_scan_latency=0.0):
+        self.latency = latency  # Seconds per RFC call
+        self.row_scan_latency = row_scan_latency  # Seconds per row the database scans
+        self.tables = {}
+        self.stats = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def add_table(self, name, fields, data):
+        """
+        Register a table. fields is a list of dicts with FIELDNAME, LENG and
+        optionally KEYFLAG ('X'), INTTYPE and DATATYPE; data is a DataFrame of
+        strings with one column per field.
+        """
+        dfies_tab = []
+        offset = 0
+        for position, field in enumerate(fields, start=1):
+            leng = int(field['LENG'])
+            inttype = field.get('INTTYPE', 'C')
+            dfies_tab.append({
+                'TABNAME': name,
+                'FIELDNAME': field['FIELDNAME'],
+                'POSITION': f"{position:04d}",
+                'OFFSET': f"{offset:06d}",
+                'KEYFLAG': field.get('KEYFLAG', ''),
+                'DATATYPE': field.get('DATATYPE', 'CHAR'),
+                'INTTYPE': inttype,
+                'LENG': f"{leng:06d}",
+                'OUTPUTLEN': f"{int(field.get('OUTPUTLEN', leng)):06d}",
+                'DECIMALS': '000000',
+                'FIELDTEXT': field.get('FIELDTEXT', field['FIELDNAME']),
+            })
+            offset += leng
+        self.tables[name] = {'dfies': dfies_tab, 'data': data.reset_index(drop=True)}
+        if name != 'DD02L':
+            self._activate(name)
+
+    def _activate(self, name):
+        # Record a new active DDIC version of the table in DD02L, as an activation would
+        now = time.localtime()
+        dd02l = self.tables['DD02L']['data'] if 'DD02L' in self.tables else pd.DataFrame(columns=['TABNAME', 'AS4LOCAL', 'AS4VERS', 'AS4DATE', 'AS4TIME'])
+        previous = dd02l.loc[dd02l['TABNAME'] == name, 'AS4VERS']
+        version = int(previous.iloc[0]) + 1 if len(previous) else 0
+        row = {'TABNAME': name, 'AS4LOCAL': 'A', 'AS4VERS': f"{version:04d}",
+               'AS4DATE': time.strftime('%Y%m%d', now), 'AS4TIME': time.strftime('%H%M%S', now)}
+        dd02l = pd.concat([dd02l[dd02l['TABNAME'] != name], pd.DataFrame([row])], ignore_index=True)
+        self.add_table('DD02L', [{'FIELDNAME': 'TABNAME', 'LENG': 30, 'KEYFLAG': 'X'}, {'FIELDNAME': 'AS4LOCAL', 'LENG': 1, 'KEYFLAG': 'X'},
+                                 {'FIELDNAME': 'AS4VERS', 'LENG': 4, 'KEYFLAG': 'X'}, {'FIELDNAME': 'AS4DATE', 'LENG': 8, 'DATATYPE': 'DATS'},
+                                 {'FIELDNAME': 'AS4TIME', 'LENG': 6, 'DATATYPE': 'TIMS'}], dd02l)
+
+    def generate_table(self, name, rows, fields=10, key_fields=1, field_lengths=(10,), distinct_values=50, seed=0):
+        """
+        Add a synthetic table with a client field, key_fields unique CHAR18
+        key fields and `fields` non-key fields whose lengths cycle through
+        field_lengths. Rows are stored in shuffled order, as a database does
+        not return them in key order.
+        """
+        rng = np.random.default_rng(seed)
+        lstFields = [{'FIELDNAME': 'MANDT', 'LENG': 3, 'KEYFLAG': 'X', 'DATATYPE': 'CLNT'}]
+        dictData = {'MANDT': np.full(rows, '100', dtype=object)}
+
+        row_ids = rng.permutation(rows)
+        for idx in range(key_fields):
+            fld = f"KEY{idx + 1}"
+            lstFields.append({'FIELDNAME': fld, 'LENG': 18, 'KEYFLAG': 'X'})
+            # Only the last key field has to be unique; the leading ones group rows
+            divisor = 1 if idx == key_fields - 1 else max(rows // 100, 1)
+            dictData[fld] = pd.Series(row_ids // divisor).astype(str).str.zfill(18).to_numpy(dtype=object)
+
+        for idx in range(fields):
+            fld = f"F{idx + 1:03d}"
+            leng = field_lengths[idx % len(field_lengths)]
+            lstFields.append({'FIELDNAME': fld, 'LENG': leng})
+            vocabulary = np.array([f"V{val}"[:leng] for val in range(distinct_values)], dtype=object)
+            dictData[fld] = vocabulary[rng.integers(0, distinct_values, rows)]
+
+        self.add_table(name, lstFields, pd.DataFrame(dictData))
+
+    def _count(self, tbl, key, value=1):
+        with self._lock:
+            self.stats[tbl][key] += value
+
+    def _table(self, tbl):
+        if tbl not in self.tables:
+            raise ABAPApplicationError(f"Table {tbl} not found", 5, 'TABLE_NOT_AVAILABLE')
+        return self.tables[tbl]
+
+    def call(self, func_name, **params):
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, '_' + func_name.lower(), None)
+        if handler is None:
+            raise ABAPApplicationError(f"Function module {func_name} not found", 5, 'FU_NOT_FOUND')
+        return handler(**params)
+
+    def _rfc_ping(self):
+        return {}
+
+    def _ddif_fieldinfo_get(self, TABNAME, **params):
+        table = self._table(TABNAME)
+        self._count(TABNAME, 'DDIF_FIELDINFO_GET')
+        return {'DFIES_TAB': [dict(field) for field in table['dfies']]}
+
+    def _em_get_number_of_entries(self, IT_TABLES):
+        lstTables = []
+        for row in IT_TABLES:
+            table = self.tables.get(row['TABNAME'])
+            lstTables.append({'TABNAME': row['TABNAME'], 'TABROWS': len(table['data']) if table else 0})
+        return {'IT_TABLES': lstTables}
+
+    def _rfc_read_table(self, QUERY_TABLE, DELIMITER='', FIELDS=None, OPTIONS=None, ROWSKIPS=0, ROWCOUNT=0, **params):
+        table = self._table(QUERY_TABLE)
+        self._count(QUERY_TABLE, 'RFC_READ_TABLE')
+        dictDfies = {field['FIELDNAME']: field for field in table['dfies']}
+
+        lstFieldNames = [field['FIELDNAME'] for field in FIELDS] if FIELDS else list(dictDfies)
+        lstOutFields = []
+        offset = 0
+        for fld in lstFieldNames:
+            if fld not in dictDfies:
+                raise ABAPApplicationError(f"Field {fld} not valid", 5, 'FIELD_NOT_VALID')
+            length = int(dictDfies[fld]['OUTPUTLEN'])
+            lstOutFields.append({'FIELDNAME': fld, 'OFFSET': f"{offset:06d}", 'LENGTH': f"{length:06d}",
+                                 'TYPE': dictDfies[fld]['INTTYPE'], 'FIELDTEXT': dictDfies[fld]['FIELDTEXT']})
+            offset += length + len(DELIMITER)
+        if offset - len(DELIMITER) > FAKE_SAP_WA_LENGTH:
+            raise ABAPApplicationError("Data buffer exceeded", 5, 'DATA_BUFFER_EXCEEDED')
+
+        # The database evaluates the WHERE clause and walks past ROWSKIPS rows before returning any
+        data = table['data']
+        where_clause = " ".join(line['TEXT'] for line in OPTIONS or [])
+        if where_clause.strip():
+            data = data[_WhereParser(where_clause).evaluate(data)]
+        rows_scanned = min(len(data), ROWSKIPS + ROWCOUNT) if ROWCOUNT else len(data)
+        data = data.iloc[ROWSKIPS:ROWSKIPS + ROWCOUNT] if ROWCOUNT else data.iloc[ROWSKIPS:]
+        self._count(QUERY_TABLE, 'rows_scanned', rows_scanned)
+        self._count(QUERY_TABLE, 'rows_returned', len(data))
+        if self.row_scan_latency:
+            time.sleep(self.row_scan_latency * rows_scanned)
+
+        wa_lines = pd.Series('', index=data.index, dtype=object)
+        for idx, field in enumerate(lstOutFields):
+            values = data[field['FIELDNAME']].astype(str)
+            length = int(field['LENGTH'])
+            if field['TYPE'] in FAKE_SAP_NUMERIC_TYPES:
+                values = values.str.rjust(length)
+            else:
+                values = values.str.ljust(length)
+            wa_lines = wa_lines + (DELIMITER if idx else '') + values.str[:length]
+
+        return {'FIELDS': lstOutFields, 'DATA': [{'WA': line.rstrip()} for line in wa_lines]}
+
+
+class _WhereParser:
+    """
+    Evaluates the subset of Open SQL WHERE syntax the extraction generates:
+    comparisons, [NOT] IN, [NOT] BETWEEN, [NOT] LIKE, AND, OR, NOT and parentheses.
+    """
+
+    def __init__(self, where_clause):
+        self.tokens = _WHERE_TOKEN.findall(where_clause)
+        self.pos = 0
+
+    def evaluate(self, data):
+        self.data = data
+        mask = self._or()
+        if self.pos != len(self.tokens):
+            raise ABAPApplicationError(f"Syntax error in WHERE near {self.tokens[self.pos]}", 5, 'OPTION_NOT_VALID')
+        return mask
+
+    def _peek(self):
+        return self.tokens[self.pos].upper() if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def _literal(self):
+        token = self._next()
+        if not token.startswith("'"):
+            raise ABAPApplicationError(f"Literal expected, got {token}", 5, 'OPTION_NOT_VALID')
+        return token[1:-1].replace("''", "'").rstrip()
+
+    def _or(self):
+        mask = self._and()
+        while self._peek() == 'OR':
+            self._next()
+            mask = mask | self._and()
+        return mask
+
+    def _and(self):
+        mask = self._not()
+        while self._peek() == 'AND':
+            self._next()
+            mask = mask & self._not()
+        return mask
+
+    def _not(self):
+        if self._peek() == 'NOT':
+            self._next()
+            return ~self._not()
+        if self._peek() == '(':
+            self._next()
+            mask = self._or()
+            self._next()  # ')'
+            return mask
+        return self._predicate()
+
+    def _predicate(self):
+        column = self.data[self._next().upper()].astype(str).str.rstrip()
+        negate = False
+        if self._peek() == 'NOT':
+            self._next()
+            negate = True
+        operator = self._next().upper()
+        operator = _COMPARISON_OPERATORS.get(operator, operator)
+
+        if operator == 'IN':
+            self._next()  # '('
+            values = [self._literal()]
+            while self._peek() == ',':
+                self._next()
+                values.append(self._literal())
+            self._next()  # ')'
+            mask = column.isin(values)
+        elif operator == 'BETWEEN':
+            low = self._literal()
+            self._next()  # AND
+            mask = (column >= low) & (column <= self._literal())
+        elif operator == 'LIKE':
+            pattern = "^" + re.escape(self._literal()).replace('%', '.*').replace('_', '.') + "$"
+            mask = column.str.match(pattern)
+        else:
+            value = self._literal()
+            mask = {'EQ': column == value, 'NE': column != value, 'GT': column > value,
+                    'GE': column >= value, 'LT': column < value, 'LE': column <= value}[operator]
+        return ~mask if negate else mask
+
+
+class FakeSapConnection:
+    """
+    Drop-in stand-in for pyrfc.Connection backed by a FakeSapSystem.
+    """
+
+    def __init__(self, system, **connection_params):
+        self.system = system
+        self.connection_params = connection_params
+        self.alive = True
+
+    def call(self, func_name, **params):
+        if not self.alive:
+            raise CommunicationError("Connection closed", 1, 'RFC_COMMUNICATION_FAILURE')
+        return self.system.call(func_name, **params)
+
+    def ping(self):
+        self.call('RFC_PING')
+
+    def reopen(self):
+        self.alive = True
+
+    def close(self):
+        self.alive = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def install_fake_sap(system, connection_params):
+    """
+    Route every pooled connection for these parameters to the fake system.
+    """
+    pool_key = SapConnectionPool.pool_key(connection_params)
+    with SapConnectionPool._pools_lock:
+        old_pool = SapConnectionPool._pools.pop(pool_key, None)
+    if old_pool is not None:
+        old_pool.close_all()
+    return SapConnectionPool.get_pool(connection_params, connection_factory=partial(FakeSapConnection, system))
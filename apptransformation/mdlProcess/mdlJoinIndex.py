@@ -0,0 +1,150 @@
+import threading
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from .logger import Logger
+from .mdlDtypes import sap_text
+from .mdlEnum import Join_policy
+
+
+logger = Logger.get_logger()
+
+JOIN_MAX_OUTPUT_ROWS = 5000000  # Predicted rows of one join above which it is refused under every policy but DEDUPE
+
+# Hash index of a source table on its join key columns. For repeated keys,
+# unique_keys, key_counts and first_positions hold the per-key row count and
+# first row, the statistics the cardinality guard works from.
+JoinIndex = namedtuple('JoinIndex', ['source_table', 'key_columns', 'index', 'is_unique', 'duplicate_keys', 'unique_keys', 'key_counts', 'first_positions'])
+
+# Outcome of the cardinality check of one join, as recorded in the run's join report
+JoinCheck = namedtuple('JoinCheck', ['target_table', 'source_table', 'source_join_fields', 'target_join_fields', 'rows', 'predicted_rows', 'duplicate_keys', 'policy', 'action'])
+
+
+def _key_values(series):
+    # Keys are matched as SAP text, so that compacted and text columns find each other
+    return sap_text(series).to_numpy(dtype=object)
+
+
+def _key_index(arrays):
+    if len(arrays) == 1:
+        return pd.Index(arrays[0], dtype=object)
+    return pd.MultiIndex.from_arrays(arrays)
+
+
+class JoinIndexCache:
+    """
+    Per-run cache of join key indexes. The index of a source table on a set
+    of key columns is built once, and every join on those keys, from any
+    target table and any thread, resolves to a get_indexer lookup plus a
+    take of the source columns instead of a full hash join. Duplicate keys
+    are detected when the index is built.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, source_table, source_df, key_columns):
+        """
+        Return the JoinIndex of source_df on key_columns, building it on first use.
+        """
+        key = (source_table, id(source_df), tuple(key_columns))
+        with self._lock:
+            join_index = self._indexes.get(key)
+            if join_index is not None:
+                return join_index
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        # Built once even when several target tables ask for it at the same time
+        with key_lock:
+            with self._lock:
+                join_index = self._indexes.get(key)
+            if join_index is None:
+                join_index = self._build(source_table, source_df, key_columns)
+                with self._lock:
+                    self._indexes[key] = join_index
+        return join_index
+
+    @staticmethod
+    def _build(source_table, source_df, key_columns):
+        index = _key_index([_key_values(source_df[col]) for col in key_columns])
+        if index.is_unique:
+            logger.info(f"Join index on {source_table} ({'|'.join(key_columns)}): {len(index)} unique keys.")
+            return JoinIndex(source_table, tuple(key_columns), index, True, 0, None, None, None)
+
+        # Rows per key and the first row of every key
+        codes, unique_keys = pd.factorize(index, use_na_sentinel=False)
+        key_counts = np.bincount(codes, minlength=len(unique_keys))
+        first_positions = np.unique(codes, return_index=True)[1]
+        duplicate_keys = int(len(index) - len(unique_keys))
+        logger.warning(f"Join index on {source_table} ({'|'.join(key_columns)}): {duplicate_keys} of {len(index)} rows repeat a key, "
+                       f"up to {int(key_counts.max())} rows per key.")
+        return JoinIndex(source_table, tuple(key_columns), index, False, duplicate_keys, pd.Index(unique_keys), key_counts, first_positions)
+
+    def __len__(self):
+        return len(self._indexes)
+
+
+def join_target_keys(target_df, target_columns):
+    """
+    The join keys of the target rows, comparable with a JoinIndex.
+    """
+    return _key_index([_key_values(target_df[col]) for col in target_columns])
+
+
+def predict_join_rows(join_index, target_keys):
+    """
+    Rows a left merge on this index would return, from the per-key counts, without merging.
+    """
+    if join_index.is_unique:
+        return len(target_keys)
+    key_positions = join_index.unique_keys.get_indexer(target_keys)
+    return int(np.where(key_positions >= 0, join_index.key_counts[key_positions], 1).sum())
+
+
+def lookup_join_positions(join_index, target_keys):
+    """
+    Row position in the source table of every target row, -1 where the key
+    has no match. For repeated keys the first source row is used.
+    """
+    if join_index.is_unique:
+        return join_index.index.get_indexer(target_keys)
+    key_positions = join_index.unique_keys.get_indexer(target_keys)
+    return np.where(key_positions >= 0, join_index.first_positions[key_positions], -1)
+
+
+def take_join_column(series, positions, index):
+    """
+    The source column gathered at the looked-up positions, NaN where unmatched, as a left merge gives it.
+    """
+    return pd.Series(series.array.take(np.asarray(positions, dtype=np.intp), allow_fill=True), index=index, name=series.name)
+
+
+def check_join_cardinality(target_table, step, join_index, target_keys, policy):
+    """
+    Decide how a join is run before anything is allocated:
+    'lookup' for unique source keys, 'merge' when repeated keys are not hit,
+    and for joins that would add rows 'warn' (merge anyway), 'dedupe'
+    (first source row per key) or 'refuse', according to the policy.
+    Joins predicted above JOIN_MAX_OUTPUT_ROWS are refused unless deduplicated.
+    """
+    rows = len(target_keys)
+    predicted_rows = predict_join_rows(join_index, target_keys)
+    if join_index.is_unique:
+        action = 'lookup'
+    elif predicted_rows <= rows:
+        action = 'merge'
+    elif policy == Join_policy.EnumDedupe:
+        action = 'dedupe'
+    elif policy == Join_policy.EnumRefuse or predicted_rows > JOIN_MAX_OUTPUT_ROWS:
+        action = 'refuse'
+    else:
+        action = 'warn'
+
+    check = JoinCheck(target_table, step.source_table, '|'.join(step.source_join_fields), '|'.join(step.target_join_fields),
+                      rows, predicted_rows, join_index.duplicate_keys, policy, action)
+    if action in ('dedupe', 'refuse', 'warn'):
+        logger.warning(f"Join of {step.source_table} into {target_table} on {check.target_join_fields} would grow {rows} rows to {predicted_rows} "
+                       f"({join_index.duplicate_keys} repeated source keys), policy {policy}: {action}.")
+    return check
@@ -1,24 +1,36 @@
 from .logger import Logger
 import pandas as pd
-from pyrfc import Connection
-from urllib.parse import quote_plus
-from sqlalchemy import create_engine, text
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
-import win32com.client as win32
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import pythoncom
 import multiprocessing
 from datetime import datetime
-from pyrfc import ABAPApplicationError, ABAPRuntimeError, LogonError, CommunicationError
+from .mdlRfc import ABAPApplicationError, ABAPRuntimeError
 
 from .splitter import XmlSplitter
 from .mdlMapping import *
 from .mdlTransRule import *
 from .mdlEnum import *
+from .mdlExtraction import *
+from .mdlSapPool import *
+from .mdlTableCache import *
+from .mdlMetadata import *
+from .mdlProjection import *
+from .mdlDtypes import *
+from .mdlCheckpoint import *
+from .mdlSpill import *
+from .mdlDbPool import *
+from .mdlTemplateBundle import *
+from .mdlMetadataStore import *
 import zipfile
 
+# Excel output goes through COM (pywin32, Windows only); metadata loading, extraction and mapping run without it
+try:
+    import win32com.client as win32
+    import pythoncom
+except ImportError:
+    win32 = None
+    pythoncom = None
+
 try:
     from importlib.metadata import version, PackageNotFoundError
     try:
@@ -39,9 +51,9 @@ def add_prefix_suffix(df, field_name, affix, position='LEFT'):
         dicResult['iserror'] = False
 
         if position == 'LEFT':
-            df[field_name] = affix + df[field_name].astype(str)
+            df[field_name] = affix + sap_text(df[field_name]).astype(str)
         else:
-            df[field_name] = df[field_name].astype(str) + affix
+            df[field_name] = sap_text(df[field_name]).astype(str) + affix
 
     except (ValueError, TypeError) as e:
         dicResult['iserror'] = True
@@ -86,14 +98,12 @@ def get_sap_table_fields(connection_params,table_name):
     dicResult = {} #Function Result Dictionary
     try:
         dicResult['iserror'] = False
-        # Create SAP connection
-        with Connection(**connection_params) as conn:
-            # Call RFC_READ_TABLE to get field metadata
-            result = conn.call('RFC_READ_TABLE', QUERY_TABLE=table_name, ROWCOUNT=1)
-            
-            # Extract field names
-            field_names = [field['FIELDNAME'] for field in result['FIELDS']]
-            print(field_names)
+        # Field metadata from the DDIC cache
+        dfies_tab = get_table_fields(connection_params, table_name)
+
+        # Extract field names
+        field_names = [field['FIELDNAME'] for field in dfies_tab]
+        print(field_names)
 
         dicResult['value'] = field_names
 
@@ -103,7 +113,7 @@ def get_sap_table_fields(connection_params,table_name):
         dicResult['error_details'] = dicResult['error']  + " | " + str(e)
     return dicResult
 
-# Function to create an SQLAlchemy connection
+# Function to get the shared, pooled SQLAlchemy engine of a database
 @log_execution_time
 def get_sqlalchemy_connection(server, database, username, password):
 
@@ -111,17 +121,8 @@ def get_sqlalchemy_connection(server, database, username, password):
     dicResult = {} #Function Result Dictionary
     try:
         dicResult['iserror'] = False
-        # Define your SQLAlchemy connection string
-        driver = 'ODBC Driver 17 for SQL Server'
-
-        # Encode username and password
-        encoded_username = quote_plus(username)
-        encoded_password = quote_plus(password)
-        connection_string = (
-            f"mssql+pyodbc://{encoded_username}:{encoded_password}@{server}/{database}"
-            f"?driver={quote_plus(driver)}"
-        )
-        engine = create_engine(connection_string)
+        # One engine and connection pool per server, database and credentials for the whole process
+        engine = SqlEngineRegistry.get_engine(server, database, username, password)
         return engine
     except Exception as e:
         dicResult['iserror'] = True
@@ -131,25 +132,50 @@ def get_sqlalchemy_connection(server, database, username, password):
     return dicResult
 
 @log_execution_time
-def thread_extract_data_from_sap(connection_params,dictECCFieldMapping,sqltblname):
+def thread_extract_data_from_sap(connection_params,dictECCFieldMapping,sqltblname,extraction_mode=Extraction_mode.EnumKeyRange,bypass_cache=False,delta_extraction=False,dictFilters=None,checkpoint=None,memory_budget=EXTRACTION_MEMORY_BUDGET,dictDeltaConfig=None):
     # Initialize variables
     dicResult = {} #Function Result Dictionary
     dictDatadf = {}
+    dictFilters = dictFilters or {}
+    dictDeltaConfig = dictDeltaConfig or {}
+    executor = None
     try:
         dicResult['iserror'] = False
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            lsttask = []
-            for tbl,list in dictECCFieldMapping.items():
-                lsttask.append(executor.submit(get_data_from_sap_table_1,connection_params,tbl,list))
-
-            for task in lsttask:
-                dict = task.result()
-                if dict['iserror'] == True:
-                    dicResult['iserror'] = True
-                    dicResult['error'] = dict['error']
-                    dicResult['error_details'] = dict['error_details']
-                    return dicResult
-                dictDatadf.update(dict['value'])
+        remove_spill_files(max_age=SPILL_FILE_MAX_AGE)
+
+        # Estimate the size of every table that has to come from SAP; cached and checkpointed tables need no SAP call at all
+        table_cache = get_table_cache()
+        dictToExtract = {tbl: lstFields for tbl, lstFields in dictECCFieldMapping.items()
+                         if (bypass_cache or not table_cache.contains(connection_params,tbl,lstFields,dictFilters.get(tbl)))
+                         and (checkpoint is None or not checkpoint.contains_table(tbl,lstFields,dictFilters.get(tbl)))}
+        dictTableSize = {}
+        if dictToExtract:
+            with get_sap_connection(connection_params) as connection:
+                dictTableSize = estimate_table_sizes(connection,connection_params,dictToExtract)
+
+        # Largest tables first, so that a big table submitted late does not set the wall-clock time
+        lstTables = sorted(dictECCFieldMapping,
+                           key=lambda tbl: dictTableSize.get(tbl, {}).get('rows', 0) * dictTableSize.get(tbl, {}).get('width', 0),
+                           reverse=True)
+        max_workers = get_host_connection_budget(connection_params)
+        logger.info(f"Extraction schedule ({max_workers} parallel): " + ", ".join(
+            f"{tbl} ({dictTableSize[tbl]['rows']} rows x {dictTableSize[tbl]['width']} chars)" if tbl in dictTableSize else f"{tbl} (cached)"
+            for tbl in lstTables))
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        dicttask = {executor.submit(extract_sap_table,connection_params,tbl,dictECCFieldMapping[tbl],extraction_mode,bypass_cache,delta_extraction,dictFilters.get(tbl),checkpoint,memory_budget,dictDeltaConfig.get(tbl)): tbl
+                    for tbl in lstTables}
+
+        # Fail fast: stop at the first failed table and cancel everything not started yet
+        for task in as_completed(dicttask):
+            dict = task.result()
+            if dict['iserror'] == True:
+                logger.warning(f"Extraction of table {dicttask[task]} failed, cancelled remaining tables.")
+                dicResult['iserror'] = True
+                dicResult['error'] = dict['error']
+                dicResult['error_details'] = dict['error_details']
+                return dicResult
+            dictDatadf.update(dict['value'])
 
         dicResult['value'] = dictDatadf
 
@@ -158,22 +184,71 @@ def thread_extract_data_from_sap(connection_params,dictECCFieldMapping,sqltblnam
         dicResult['error'] = "Unhandled Error in genretaing Dashboard Data."
         dicResult['error_details'] = dicResult['error']  + " | " + str(e)
 
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return dicResult
+
+def extract_sap_table(connection_params,tbl,lstFields,extraction_mode=Extraction_mode.EnumKeyRange,bypass_cache=False,delta_extraction=False,lstFilterConditions=None,checkpoint=None,memory_budget=EXTRACTION_MEMORY_BUDGET,delta_config=None):
+    # A table finished by an earlier attempt of this run is taken from the run checkpoint
+    lstFilterConditions = lstFilterConditions or []
+    if checkpoint is not None:
+        df = checkpoint.load_table(tbl,lstFields,lstFilterConditions)
+        if df is not None:
+            return {'iserror': False, 'value': {tbl: df}}
+
+    # Serve the table from the local cache unless bypassed; a fresh extraction always refreshes the cache
+    table_cache = get_table_cache()
+    delta_fields = delta_config['fields'] if delta_config else []
+    if not bypass_cache:
+        df = table_cache.get(connection_params,tbl,lstFields,lstFilterConditions)
+        if df is not None:
+            return {'iserror': False, 'value': {tbl: df}}
+
+        # Fetch only the rows changed since the snapshot was taken and upsert them into it,
+        # until the periodic full extraction that drops the rows deleted in SAP is due
+        if delta_extraction and delta_fields:
+            snapshot_df, snapshot_meta = table_cache.get_snapshot(connection_params,tbl,lstFields,lstFilterConditions)
+            if snapshot_df is not None and is_full_refresh_due(snapshot_meta,delta_config['full_refresh_days']):
+                logger.info(f"Snapshot of table {tbl} is older than {delta_config['full_refresh_days']} days since its last full extraction, extracting in full.")
+            elif snapshot_df is not None and snapshot_meta['key_fields']:
+                watermark = get_delta_watermark()
+                lstConditions = lstFilterConditions + [build_delta_condition(delta_fields,snapshot_meta['watermark'])]
+                dicResult = get_data_from_sap_table_1(connection_params,tbl,lstFields,extraction_mode,lstConditions,allow_empty=True,checkpoint=checkpoint,memory_budget=memory_budget)
+                if dicResult['iserror'] == True:
+                    return dicResult
+
+                delta_df = dicResult['value'][tbl]
+                df = merge_delta(snapshot_df,delta_df,snapshot_meta['key_fields'])
+                logger.info(f"Merged {len(delta_df)} changed rows since {snapshot_meta['watermark']} into snapshot of table {tbl} ({len(df)} rows).")
+                table_cache.put(connection_params,tbl,lstFields,df,watermark,snapshot_meta['key_fields'],lstFilterConditions,snapshot_meta['full_refresh'])
+                if checkpoint is not None:
+                    checkpoint.save_table(tbl,lstFields,df,lstFilterConditions)
+                dicResult['value'] = {tbl: df}
+                return dicResult
+
+    watermark = get_delta_watermark() if delta_fields else None
+    dicResult = get_data_from_sap_table_1(connection_params,tbl,lstFields,extraction_mode,lstFilterConditions,checkpoint=checkpoint,memory_budget=memory_budget)
+    if dicResult['iserror'] == False:
+        table_cache.put(connection_params,tbl,lstFields,dicResult['value'][tbl],watermark,dicResult['plan']['key_fields'],lstFilterConditions)
+        if checkpoint is not None:
+            checkpoint.save_table(tbl,lstFields,dicResult['value'][tbl],lstFilterConditions)
     return dicResult
 
-def get_data_from_sap_table(connection_params,tbl,lstFields):
+def get_data_from_sap_table(connection_params,tbl,lstFields,extraction_mode=Extraction_mode.EnumKeyRange,memory_budget=EXTRACTION_MEMORY_BUDGET):
     # Initialize variables
     dicResult = {} #Function Result Dictionary
     chunk_size = 1000
     try:
         dicResult['iserror'] = False
-        # Establish SAP connection
-        with Connection(**connection_params) as connection:
+        # Check out a pooled SAP connection
+        with get_sap_connection(connection_params) as connection:
             logger.info(f"Connected to SAP successfully. for table Process: {tbl}")
             
-            lstActField = []
-            result = connection.call('RFC_READ_TABLE', QUERY_TABLE=tbl,ROWCOUNT=0)
-            for field in result['FIELDS']:
-                lstActField.append(field['FIELDNAME'])
+            # Field metadata from the DDIC cache instead of a metadata-only RFC_READ_TABLE
+            dfies_tab = get_table_fields(connection_params, tbl, connection)
+            lstActField = [field['FIELDNAME'] for field in dfies_tab]
 
             lstNotFoundField = [fld  for fld in lstFields if fld not in lstActField]
             if len(lstNotFoundField) > 0:
@@ -184,28 +259,22 @@ def get_data_from_sap_table(connection_params,tbl,lstFields):
                 dicResult['error_details'] = strError
                 logger.warning(strError)
                 return dicResult
-            
-            # Chunked data fetch
-            all_data = []
-            skip_rows = 0
-
-            while True:
 
-                result = connection.call('RFC_READ_TABLE',DELIMITER = '|',QUERY_TABLE=tbl,FIELDS = lstFields,ROWSKIPS=skip_rows,ROWCOUNT=chunk_size)
-                if not result or 'DATA' not in result:
-                    break
-                
-                data_rows = [row['WA'] for row in result['DATA']]
-                all_data.extend(data_rows)
-
-                #logger.info(f"For Table: {tbl} Process. Fetched {len(data_rows)} rows (Skipped: {skip_rows}).")
-
-                if len(data_rows) < chunk_size:
-                    break  # Last chunk reached
+            # Split the table into key ranges, or fall back to ROWSKIPS paging
+            key_ranges = []
+            if extraction_mode == Extraction_mode.EnumKeyRange:
+                key_fields = get_key_fields(dfies_tab)
+                if key_fields:
+                    try:
+                        key_ranges = plan_key_ranges(connection, tbl, key_fields[0])
+                    except (ABAPApplicationError, ABAPRuntimeError) as e:
+                        logger.warning(f"Key range planning failed for table {tbl}, falling back to ROWSKIPS paging: {e}")
 
-                skip_rows += chunk_size
+            # Chunked data fetch; every page is decoded as it arrives and spills to disk past the memory budget
+            df = read_field_chunk(connection, tbl, lstFields, key_fields[0] if key_ranges else None, key_ranges,
+                                  row_chunk_size=chunk_size, memory_budget=memory_budget)
 
-            if not all_data:
+            if df.empty:
                 strError = f"No data retrieved from SAP. for table {tbl}"
                 dicResult['iserror'] = True
                 dicResult['error'] = strError
@@ -213,9 +282,6 @@ def get_data_from_sap_table(connection_params,tbl,lstFields):
                 logger.warning(strError)
                 return dicResult
             
-            # Extract columns
-            columns = [field['FIELDNAME'] for field in result['FIELDS']]
-            df = pd.DataFrame([row.split('|') for row in all_data], columns=columns)
             logger.info(f"Total {len(df)} rows fetched from table {tbl}.")
             dicResult['value'] = {tbl:df}
 
@@ -227,96 +293,6 @@ def get_data_from_sap_table(connection_params,tbl,lstFields):
 
     return dicResult
 
-def get_data_from_sap_table_1(connection_params, tbl, lstFields):
-    dicResult = {}
-    row_chunk_size = 1000  # Rows per chunk
-    field_chunk_start_size = 10  # Initial number of fields per chunk
-
-    try:
-        dicResult['iserror'] = False
-        all_data_df = pd.DataFrame()
-
-        with Connection(**connection_params) as connection:
-            logger.info(f"Connected to SAP successfully. Processing table: {tbl}")
-
-            # Get actual available fields from the table
-            result = connection.call('DDIF_FIELDINFO_GET', TABNAME=tbl, LANGU='EN', ALL_TYPES='X')
-            actual_fields = list(set(field['FIELDNAME'] for field in result['DFIES_TAB']))
-
-            # Validate fields
-            lstNotFoundField = [fld for fld in lstFields if fld not in actual_fields]
-            if lstNotFoundField:
-                strError = f"Fields not found in table {tbl}: {','.join(lstNotFoundField)}"
-                dicResult.update({'iserror': True, 'error': strError, 'error_details': strError})
-                logger.warning(strError)
-                return dicResult
-
-            # Begin chunking by fields
-            i = 0
-            while i < len(lstFields):
-                current_chunk_size = field_chunk_start_size
-                success = False
-
-                while not success and current_chunk_size > 0:
-                    current_fields = lstFields[i:i+current_chunk_size]
-                    temp_data = []
-                    skip_rows = 0
-
-                    try:
-                        while True:
-                            result = connection.call(
-                                'RFC_READ_TABLE',
-                                DELIMITER='|',
-                                QUERY_TABLE=tbl,
-                                FIELDS=[{'FIELDNAME': fld} for fld in current_fields],
-                                ROWSKIPS=skip_rows,
-                                ROWCOUNT=row_chunk_size
-                            )
-
-                            if not result or 'DATA' not in result or not result['DATA']:
-                                break
-
-                            temp_data.extend([row['WA'] for row in result['DATA']])
-                            if len(result['DATA']) < row_chunk_size:
-                                break
-                            skip_rows += row_chunk_size
-
-                        # Convert chunk data to DataFrame
-                        df_chunk = pd.DataFrame(
-                            [row.split('|') for row in temp_data],
-                            columns=[f['FIELDNAME'] for f in result['FIELDS']]
-                        )
-
-                        # Concatenate column-wise
-                        all_data_df = pd.concat([all_data_df, df_chunk], axis=1)
-                        logger.info(f"Successfully fetched fields {i}-{i+current_chunk_size} from table {tbl}")
-                        success = True
-                        i += current_chunk_size
-
-                    except (ABAPApplicationError, ABAPRuntimeError, CommunicationError, LogonError) as e:
-                        logger.warning(f"Chunk fetch error at fields {i}-{i+current_chunk_size}: {e}")
-                        current_chunk_size -= 2  # Reduce field chunk size and retry
-
-                if current_chunk_size == 0:
-                    logger.warning(f"Skipping field '{lstFields[i]}' due to repeated fetch failure.")
-                    i += 1  # Skip the problematic field
-
-            if all_data_df.empty:
-                strError = f"No data retrieved from SAP for table {tbl}"
-                dicResult.update({'iserror': True, 'error': strError, 'error_details': strError})
-                logger.warning(strError)
-                return dicResult
-
-            dicResult['value'] = {tbl: all_data_df}
-            logger.info(f"Total {len(all_data_df)} rows and {len(all_data_df.columns)} columns fetched from table {tbl}.")
-
-    except Exception as e:
-        strError = f"Unhandled error while fetching data from SAP table: {tbl} | {str(e)}"
-        dicResult.update({'iserror': True, 'error': strError, 'error_details': strError})
-        logger.warning(strError)
-
-    return dicResult
-
 @log_execution_time
 def connect_to_sap(strTbl, lstFields = '',lngrowcnt = '', lngrowskps = ''):
     # SAP connection parameters
@@ -331,8 +307,8 @@ def connect_to_sap(strTbl, lstFields = '',lngrowcnt = '', lngrowskps = ''):
     }
     
     try:
-        # Establish SAP connection
-        with Connection(**connection_params) as connection:
+        # Check out a pooled SAP connection
+        with get_sap_connection(connection_params) as connection:
             logger.info("Connected to SAP successfully.")
             
             lstActField = []
@@ -357,17 +333,11 @@ def connect_to_sap(strTbl, lstFields = '',lngrowcnt = '', lngrowskps = ''):
                 logger.warning("No data retrieved from SAP.")
                 return pd.DataFrame()
             
-            # Extract column names
-            columns = [field['FIELDNAME'] for field in result['FIELDS']]
-            
             # Extract data rows
             data_rows = [row['WA'] for row in result['DATA']]
-            
-            # # Split each row by the delimiter '|'
-            # split_data = [row.split('|') for row in data_rows]
 
             # Convert to DataFrame
-            df = pd.DataFrame([row.split('|') for row in data_rows], columns=columns)
+            df = decode_wa_rows(data_rows, result['FIELDS'])
     
             df.to_excel('Data_Test.xlsx',index=False)
 
@@ -387,38 +357,19 @@ def fetch_ecc_mapping(server, database, username, password, templateid,clientid)
     dicResult = {} #Function Result Dictionary
     try:
         dicResult['iserror'] = False
-        # Create database connection
-        engine = get_sqlalchemy_connection(server, database, username, password)
+        # SQL Server, or a local SQLite file for offline runs
+        store = get_metadata_store(server, database, username, password)
+        logger.info('SQL Connection Establish for to featch ECC Mapping')
 
-
-        if isinstance(engine, dict):
-            dicResult['iserror'] = True
-            dicResult['error'] = engine['error']
-            dicResult['error_details'] = dicResult['error']
-            return dicResult
-        else:
-            logger.info('SQL Connection Establish for to featch ECC Mapping')
-        
-        # Define the query
-        query = text("""SELECT [SoruceTable],[SoruceField],[TargetTable],[TargetField]
-                                ,[IsMainTable],[SoruceJoinFiled],[TargetJoinField]
-                        FROM [ECC_Field_Mapping] WHERE [TemplateID] = :templateid AND (([ClientFlag] = '' OR [ClientFlag] IS NULL OR [ClientFlag] = :clientid))
-                        AND LOWER(TRIM(:clientid)) NOT IN (SELECT LOWER(TRIM(value)) FROM STRING_SPLIT([ExcludeClientFlag], '|'))
-                     """)
-
-        params = {"templateid": templateid,'clientid':clientid}
-        # Execute query
-        with engine.connect() as conn:
-            df  = pd.read_sql(query, conn, params=params)
+        df, df_filters = store.read_ecc_mapping(templateid, clientid)
 
         # Process data into dictionary
-        ecc_dict = defaultdict(list)
-        for index, row in df .iterrows():
-            if row['SoruceField'] not in ecc_dict[row['SoruceTable']]:
-                ecc_dict[row['SoruceTable']].append(row['SoruceField'])
+        ecc_dict = build_ecc_field_list(df)
 
         dicResult['value'] = ecc_dict
         dicResult['mapping_df'] = df
+        dicResult['filters'] = compile_extraction_filters(df_filters)
+        dicResult['delta_config'] = compile_delta_config(store.read_delta_config())
 
     except Exception as e:
         dicResult['iserror'] = True
@@ -432,68 +383,14 @@ def fetch_tranformation_rule(server, database, username, password, clientid):
     dicResult = {} #Function Result Dictionary
     try:
         dicResult['iserror'] = False
-        # Establish database connection
-        engine = get_sqlalchemy_connection(server, database, username, password)
-        
+        # SQL Server, or a local SQLite file for offline runs
+        store = get_metadata_store(server, database, username, password)
+        logger.info('SQL Connection Establish for to featch Transformation Rule')
 
-        if isinstance(engine, dict):
-            dicResult['iserror'] = True
-            dicResult['error'] = engine['error']
-            dicResult['error_details'] = dicResult['error']
-            return dicResult
-        else:
-            logger.info('SQL Connection Establish for to featch Transformation Rule')
-
-        # Define and execute query with parameterized input
-        query = text("""SELECT [ClientID]
-                            ,[TargetTable]
-                            ,[TargetField]
-                            ,[RuleName]
-                            ,[Format]
-                            ,[Custome1]
-                            ,[Custome2]
-                            ,[Custome3]
-                        FROM [INNOVAPTE].[dbo].[ConditionalRules] WHERE [ClientID] = :clientid""")
-
-        params = {"clientid": clientid}
-
-        # Execute query
-        with engine.connect() as conn:
-            # Read results directly into DataFrame
-            df  = pd.read_sql(query, conn, params=params)
+        df = store.read_transformation_rules(clientid)
 
         # Process rules into structured dictionary
-        rules_dict = defaultdict(lambda: defaultdict(list))
-        
-        for _, row in df.iterrows():
-            table = row['TargetTable']
-            field = row['TargetField']
-            
-            # Split all pipe-delimited fields
-            rule_names = str(row['RuleName']).split('|') if pd.notna(row['RuleName']) else ['']
-            formats = str(row['Format']).split('|') if pd.notna(row['Format']) else ['']
-            custom1 = str(row['Custome1']).split('|') if pd.notna(row['Custome1']) else ['']
-            custom2 = str(row['Custome2']).split('|') if pd.notna(row['Custome2']) else ['']
-            custom3 = str(row['Custome3']).split('|') if pd.notna(row['Custome3']) else ['']
-            
-            # Create rule info for each rule name
-            for i, rule_name in enumerate(rule_names):
-                if not rule_name.strip():
-                    continue
-                    
-                rule_info = {
-                    'rule_name': rule_name.strip(),
-                    'format': [f.strip() for f in formats[i:i+1] or ['']],
-                    'custom1': [c.strip() for c in custom1[i:i+1] or ['']],
-                    'custom2': [c.strip() for c in custom2[i:i+1] or ['']],
-                    'custom3': [c.strip() for c in custom3[i:i+1] or ['']]
-                }
-                
-                # Ensure all lists have same length as rule_names
-                rules_dict[table][field].append(rule_info)
-
-        # Convert defaultdict to regular dict
-        dicResult['value'] = {k: dict(v) for k, v in rules_dict.items()}
+        dicResult['value'] = compile_rule_dict(df)
 
     except Exception as e:
         dicResult['iserror'] = True
@@ -508,33 +405,11 @@ def fetch_transformation_details(server, database, username, password, saptemver
     dicResult = {} #Function Result Dictionary
     try:
         dicResult['iserror'] = False
-        # Create database connection
-        engine = get_sqlalchemy_connection(server, database, username, password)
+        # SQL Server, or a local SQLite file for offline runs
+        store = get_metadata_store(server, database, username, password)
+        logger.info('SQL Connection Establish for to featch Transformation Details')
 
-        if isinstance(engine, dict):
-            dicResult['iserror'] = True
-            dicResult['error'] = engine['error']
-            dicResult['error_details'] = dicResult['error']
-            return dicResult
-        else:
-            logger.info('SQL Connection Establish for to featch Transformation Details')
-        
-        # Define the query
-        query = text("""SELECT [TemplateID] 
-                        ,[LTMCVersion]
-                        ,[TemplateName]
-                        ,[BlankTemplatePath]
-                        ,[Script]
-                        ,[Script1]
-                        ,[Script2]
-                        ,[Script3]
-                    FROM [tblTransformationMaster] 
-            WHERE [LTMCVersion] = :saptemversion AND [TemplateName] = :templatename""")
-
-        # Execute query
-        with engine.connect() as conn:
-            result = conn.execute(query, {"saptemversion": saptemversion, "templatename": templatename})
-            rows = result.fetchone()
+        rows = store.read_template_details(saptemversion, templatename)
 
         if rows is None:
             dicResult['iserror'] = True
@@ -550,6 +425,94 @@ def fetch_transformation_details(server, database, username, password, saptemver
 
     return dicResult
 
+@log_execution_time
+def load_template_bundle(server, database, username, password, saptemversion, templatename, clientid, executor=None):
+    # Initialize variables
+    dicResult = {} #Function Result Dictionary
+    own_executor = None
+    try:
+        dicResult['iserror'] = False
+        bundle_cache = get_template_bundle_cache()
+        key = bundle_cache.make_key(server, database, username, password, saptemversion, templatename, clientid)
+
+        # Recently validated bundles are used without touching the database
+        bundle, checked_at = bundle_cache.get(key)
+        if bundle is not None and bundle_cache.is_fresh(checked_at):
+            dicResult['value'] = bundle
+            return dicResult
+
+        # One checksum query decides whether the cached bundle is still valid
+        checksum = get_metadata_store(server, database, username, password).bundle_checksum(saptemversion, templatename, clientid)
+        if bundle is not None and bundle.checksum == checksum:
+            bundle_cache.touch(key, bundle)
+            logger.info(f"Template bundle for {templatename}-{saptemversion} ({clientid}) is unchanged.")
+            dicResult['value'] = bundle
+            return dicResult
+
+        # The rules do not depend on the template, so they load while details and mapping are fetched
+        logger.info(f"Compiling template bundle for {templatename}-{saptemversion} ({clientid}).")
+        if executor is None:
+            executor = own_executor = ThreadPoolExecutor(max_workers=1)
+        rules_future = executor.submit(fetch_tranformation_rule, server, database, username, password, clientid)
+
+        dictDetails = fetch_transformation_details(server, database, username, password, saptemversion, templatename)
+        if dictDetails['iserror'] == True:
+            return dictDetails
+
+        dictMapping = fetch_ecc_mapping(server, database, username, password, dictDetails['value'][Transformation_details.EnumTemplateid], clientid)
+        if dictMapping['iserror'] == True:
+            return dictMapping
+
+        bundle = TemplateBundle(
+            details=tuple(dictDetails['value']),
+            mapping_df=dictMapping['mapping_df'],
+            ecc_dict=dict(dictMapping['value']),
+            filters=dictMapping['filters'],
+            delta_config=dictMapping['delta_config'],
+            rules=None,
+            checksum=checksum,
+        )
+        dicResult['value'] = bundle
+        dicResult['rules_future'] = rules_future
+        dicResult['bundle_key'] = key
+
+        # Without a caller's executor nobody finishes the bundle later, so wait for the rules here
+        if own_executor is not None:
+            dicResult = finish_template_bundle(dicResult)
+
+    except Exception as e:
+        dicResult['iserror'] = True
+        dicResult['error'] = "Unhandled Error in Loading Template Bundle."
+        dicResult['error_details'] = dicResult['error']  + " | " + str(e)
+
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown(wait=False)
+
+    return dicResult
+
+def finish_template_bundle(dictTemplateBundle):
+    # Wait for rules still loading in the background, then cache the complete bundle
+    dicResult = {} #Function Result Dictionary
+    try:
+        dicResult['iserror'] = False
+        bundle = dictTemplateBundle['value']
+        rules_future = dictTemplateBundle.get('rules_future')
+        if rules_future is not None:
+            dictRules = rules_future.result()
+            if dictRules['iserror'] == True:
+                return dictRules
+            bundle = bundle._replace(rules=dictRules['value'])
+            get_template_bundle_cache().put(dictTemplateBundle['bundle_key'], bundle)
+        dicResult['value'] = bundle
+
+    except Exception as e:
+        dicResult['iserror'] = True
+        dicResult['error'] = "Unhandled Error in Loading Transformation Rules."
+        dicResult['error_details'] = dicResult['error']  + " | " + str(e)
+
+    return dicResult
+
 @log_execution_time
 def processs_transformation_rule(dictTransformationRule,dicttblmapping):
     # Initialize variables
@@ -620,63 +583,15 @@ def table_mapping(dfeccmapping, source_data):
         target_groups = dfmapping_main.groupby('TargetTable')
 
         for target_table, group in target_groups:
-            logger.info(f"Processing TargetTable: {target_table}")
-
-            mapped_columns = {}
-            main_rows = group[group['IsMainTable'] == 1]
-            non_main_rows = group[group['IsMainTable'] == 0]
-
-            # Estimate row count for alignment
-            row_count = max([len(source_data[table]) for table in main_rows['SoruceTable'].unique() if table in source_data], default=0)
-
-            # Process main table mappings
-            for _, row in main_rows.iterrows():
-                source_table = row['SoruceTable']
-                source_field = row['SoruceField']
-                target_field = row['TargetField']
-
-                source_df = source_data.get(source_table)
-                if source_df is not None and source_field in source_df.columns:
-                    mapped_columns[target_field] = source_df[source_field].reset_index(drop=True)
-                    #logger.debug(f"Mapped {source_table}.{source_field} to {target_table}.{target_field}")
-                else:
-                    mapped_columns[target_field] = pd.Series([pd.NA] * row_count)
-                    logger.warning(f"Missing {source_table}.{source_field}, filled NaN for {target_table}.{target_field}")
-
-            # Create DataFrame from mapped columns
-            target_df = pd.DataFrame(mapped_columns)
-
-            # Process non-main mappings with joins
-            for _, row in non_main_rows.iterrows():
-                source_table = row['SoruceTable']
-                source_field = row['SoruceField']
-                target_field = row['TargetField']
-
-                source_df = source_data.get(source_table)
-                if source_df is None:
-                    logger.warning(f"Source table {source_table} not found, skipping join for {target_field}")
-                    continue
-
-                source_join_cols = str(row['SoruceJoinFiled']).split('|')
-                target_join_cols = str(row['TargetJoinField']).split('|')
-
-                join_fields_source = source_join_cols + [source_field]
-                join_fields_target = target_join_cols + [target_field]
-
-                if join_fields_source != join_fields_target:
-                    col_mapping = dict(zip(join_fields_source, join_fields_target))
-                    temp_df = source_df[join_fields_source].rename(columns=col_mapping).copy()
-                    logger.debug(f"Renamed join columns: {col_mapping}")
-                else:
-                    temp_df = source_df[join_fields_source].copy()
-
-                # Merge only if the target field not present
-                if target_field not in target_df.columns:
-                    target_df = pd.merge(target_df, temp_df, how='left', on=target_join_cols)
-                    logger.debug(f"Merged {source_table} into {target_table} on {target_join_cols}")
+            # Compiled join plan: one merge per source table and join fields
+            target_table, target_df = process_target_table(target_table, group, source_data)
+            if target_df is None:
+                dicResult['iserror'] = True
+                dicResult['error'] = f"Unhandled Error in ECC Table Mapping of {target_table}."
+                dicResult['error_details'] = dicResult['error']
+                return dicResult
 
             final_target_dataframes[target_table] = target_df
-            logger.info(f"Completed mapping for TargetTable: {target_table}")
 
         dicResult['value'] = final_target_dataframes
         logger.info("table_mapping function completed successfully.")
@@ -696,6 +611,12 @@ def write_multiple_sheets_to_excel(df_dict, template_path, save_path, batch_size
     dicResult = {} #Function Result Dictionary
     try:
         dicResult['iserror'] = False
+        if win32 is None:
+            dicResult['iserror'] = True
+            dicResult['error'] = "Excel output needs pywin32 (win32com), which is not installed."
+            dicResult['error_details'] = dicResult['error']
+            logger.error(dicResult['error_details'])
+            return dicResult
 
         try:
             logger.info("Starting write_multiple_sheets_to_excel...")
@@ -711,6 +632,8 @@ def write_multiple_sheets_to_excel(df_dict, template_path, save_path, batch_size
 
             for sheet_name, df in df_dict.items():
                 logger.info(f"Processing sheet: {sheet_name}")
+                # Compacted dtypes are written as SAP text
+                df = to_output_frame(df)
                 df.to_excel(f'{sheet_name}.xlsx',index =False)
                 try:
                     ws = wb.Sheets(sheet_name)
@@ -896,18 +819,18 @@ if __name__ == '__main__':
     multiprocessing.freeze_support()
 
 @log_execution_time
-def process_transformation(server,database,username,password,saptepmversion,templatename,sapuser,sappass,sapashost,sapclient,strOutPutPath,clientid):
+def process_transformation(server,database,username,password,saptepmversion,templatename,sapuser,sappass,sapashost,sapclient,strOutPutPath,clientid,bypass_cache=False,delta_extraction=False,compact_dtypes=False,run_id=None,resume=False,memory_budget=EXTRACTION_MEMORY_BUDGET,join_policy=Join_policy.EnumWarn):
 
     # Initialize variables
     dicResult = {} #Function Result Dictionary
     dictECCFieldMapping = {} 
-    dictTransformationDetails = {}
     dictsapextraction = {}
     dicttblmapping = {}
     dictWriteExcel = {}
     dictXMLConvert = {}
     dictTransformationRule = {}
     dictTransformationRuleProcess = {}
+    metadata_executor = None
         # SAP connection parameters
     connection_params = {
         'user': f'{sapuser}',
@@ -922,48 +845,50 @@ def process_transformation(server,database,username,password,saptepmversion,temp
     try:
         dicResult['iserror'] = False
 
-
-        logger.info("Collecting Transformation Details From DB")
-        dictTransformationDetails = fetch_transformation_details(server,database,username,password,saptepmversion,templatename)
-
-        if dictTransformationDetails['iserror'] == True:
-            dicResult['iserror'] = dictTransformationDetails['iserror']
-            dicResult['error'] = dictTransformationDetails['error']
-            dicResult['error_details'] = dictTransformationDetails['error_details']
-            logger.error(dictTransformationDetails['error_details'])
+        # Finished tables and key ranges are checkpointed per run; resume=True with the run id of a failed run reuses them
+        if run_id and not resume:
+            RunCheckpoint(run_id).remove()
+        elif resume and not run_id:
+            logger.warning("resume requested without a run id, starting a new run.")
+        remove_stale_checkpoints(keep_run_id=run_id)
+        checkpoint = RunCheckpoint(run_id)
+        dicResult['run_id'] = checkpoint.run_id
+        logger.info(f"Transformation run id: {checkpoint.run_id}" + (" (resumed)" if resume and run_id else ""))
+
+        # Extraction starts as soon as details and mapping are in; a rules query still running finishes in the background
+        logger.info("Loading Template Bundle (Transformation Details, ECC Field Mapping, Transformation Rules)")
+        metadata_executor = ThreadPoolExecutor(max_workers=1)
+        dictTemplateBundle = load_template_bundle(server,database,username,password,saptepmversion,templatename,clientid,metadata_executor)
+
+        if dictTemplateBundle['iserror'] == True:
+            dicResult['iserror'] = dictTemplateBundle['iserror']
+            dicResult['error'] = dictTemplateBundle['error']
+            dicResult['error_details'] = dictTemplateBundle['error_details']
+            logger.error(dictTemplateBundle['error_details'])
             return dicResult
 
-        lstTransforamtionDetails = dictTransformationDetails['value']
-
-        logger.info("Collecting ECC Field Mapping From DB")
-        dictECCFieldMapping = fetch_ecc_mapping(server,database,username,password,lstTransforamtionDetails[Transformation_details.EnumTemplateid],clientid)
+        template_bundle = dictTemplateBundle['value']
+        lstTransforamtionDetails = template_bundle.details
+        dictExtractionFilters = template_bundle.filters
+        dictDeltaConfig = template_bundle.delta_config
 
+        # Extract, join and rule-process only the fields that reach the template headers
+        dictECCFieldMapping = apply_template_projection(template_bundle.mapping_df,lstTransforamtionDetails[Transformation_details.EnumBlankTemplatePath])
         if dictECCFieldMapping['iserror'] == True:
             dicResult['iserror'] = dictECCFieldMapping['iserror']
             dicResult['error'] = dictECCFieldMapping['error']
             dicResult['error_details'] = dictECCFieldMapping['error_details']
             logger.error(dictECCFieldMapping['error_details'])
             return dicResult
-        
+
         dfeccmapping = dictECCFieldMapping['mapping_df']
         dictECCFieldMapping = dictECCFieldMapping['value']
         
         logger.info("Details Collected from DB For ECC Field Mapping")
-        logger.info("Collecting ECC Transformation Rule From DB")
-
-        dictTransformationRule = fetch_tranformation_rule(server,database,username,password,clientid)
-        if dictTransformationRule['iserror'] == True:
-            dicResult['iserror'] = dictTransformationRule['iserror']
-            dicResult['error'] = dictTransformationRule['error']
-            dicResult['error_details'] = dictTransformationRule['error_details']
-            logger.error(dictTransformationRule['error_details'])
-            return dicResult
-
-        dictTransformationRule = dictTransformationRule['value']
 
         templatename = str(templatename).replace(" - ","_").replace(" ","_")
         sqltblname = saptepmversion + "_" + templatename + "_"
-        dictsapextraction = thread_extract_data_from_sap(connection_params,dictECCFieldMapping,sqltblname)
+        dictsapextraction = thread_extract_data_from_sap(connection_params,dictECCFieldMapping,sqltblname,bypass_cache=bypass_cache,delta_extraction=delta_extraction,dictFilters=dictExtractionFilters,checkpoint=checkpoint,memory_budget=memory_budget,dictDeltaConfig=dictDeltaConfig)
 
         if dictsapextraction['iserror'] == True:    
             dicResult['iserror'] = True
@@ -973,7 +898,24 @@ def process_transformation(server,database,username,password,saptepmversion,temp
             return dicResult
         dictsapextraction = dictsapextraction['value']
 
-        dicttblmapping = table_mapping_parallel(dfeccmapping,dictsapextraction)
+        # Opt-in: categoricals, Arrow strings and native numeric and date types to cut memory
+        if compact_dtypes:
+            dictsapextraction = compact_extracted_tables(connection_params,dictsapextraction)
+            if dictsapextraction['iserror'] == True:
+                dicResult['iserror'] = True
+                dicResult['error'] = dictsapextraction['error']
+                dicResult['error_details'] = dictsapextraction['error_details']
+                logger.error(dictsapextraction['error_details'])
+                return dicResult
+            dictsapextraction = dictsapextraction['value']
+
+        # Joins that would multiply rows are warned about, deduplicated or refused before merging
+        dicttblmapping = table_mapping_parallel(dfeccmapping,dictsapextraction,join_policy=join_policy)
+        dicResult['join_report'] = dicttblmapping.get('join_report', [])
+        for check in dicResult['join_report']:
+            if check['action'] in ('warn', 'dedupe', 'refuse'):
+                logger.warning(f"Join report: {check['source_table']} into {check['target_table']} on {check['target_join_fields']}: "
+                               f"{check['rows']} -> {check['predicted_rows']} rows, {check['action']}.")
 
         if dicttblmapping['iserror'] == True:    
             dicResult['iserror'] = True
@@ -984,6 +926,16 @@ def process_transformation(server,database,username,password,saptepmversion,temp
         
         dicttblmapping = dicttblmapping['value']
 
+        logger.info("Collecting ECC Transformation Rule")
+        dictTemplateBundle = finish_template_bundle(dictTemplateBundle)
+        if dictTemplateBundle['iserror'] == True:
+            dicResult['iserror'] = True
+            dicResult['error'] = dictTemplateBundle['error']
+            dicResult['error_details'] = dictTemplateBundle['error_details']
+            logger.error(dictTemplateBundle['error_details'])
+            return dicResult
+        dictTransformationRule = dictTemplateBundle['value'].rules
+
         dictTransformationRuleProcess = processs_transformation_rule(dictTransformationRule,dicttblmapping)
         if dictTransformationRuleProcess['iserror'] == True:    
             dicResult['iserror'] = True
@@ -1020,10 +972,16 @@ def process_transformation(server,database,username,password,saptepmversion,temp
             logger.error(dictConverttoZip['error_details']) 
             return dicResult
 
+        # The run is complete, its checkpoints are no longer needed
+        checkpoint.remove()
         dicResult['value'] = dictConverttoZip['value']
 
     except Exception as e:
         dicResult['iserror'] = True
         dicResult['error'] = "Unhandled Error in Process Transformation."
         dicResult['error_details'] = dicResult['error']  + " | " + str(e)
+
+    finally:
+        if metadata_executor is not None:
+            metadata_executor.shutdown(wait=False)
     return dicResult
\ No newline at end of file
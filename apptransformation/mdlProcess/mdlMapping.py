@@ -1,12 +1,22 @@
 
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 from .logger import Logger
+from .mdlDtypes import align_join_dtypes
+from .mdlEnum import Join_policy
+from .mdlJoinIndex import JOIN_MAX_OUTPUT_ROWS, JoinIndexCache, check_join_cardinality, join_target_keys, lookup_join_positions, take_join_column
+from .mdlProjection import split_join_fields
 import time
 
 
 
 logger = Logger.get_logger()
 
+MAPPING_MAX_WORKERS = 8  # Upper bound of target tables mapped at the same time
+
 def log_execution_time(func):
     """
     Decorator to log the total execution time of a function.
@@ -25,76 +35,189 @@ def log_execution_time(func):
     return wrapper
 
 
-def process_target_table(target_table, group, source_data):
+# One left merge of a target table: every field taken from one source table on the same join fields
+JoinStep = namedtuple('JoinStep', ['source_table', 'source_join_fields', 'target_join_fields', 'fields', 'policy'])
+# Execution plan of a target table: main-table columns as (source table, source field, target field), then the joins in order
+TargetTablePlan = namedtuple('TargetTablePlan', ['target_table', 'main_tables', 'main_fields', 'joins'])
+
+# Join policies from the strictest; a join step takes the strictest policy of its mapping rows
+JOIN_POLICY_ORDER = (Join_policy.EnumRefuse, Join_policy.EnumDedupe, Join_policy.EnumWarn)
+
+
+def compile_join_plan(target_table, group, join_policy=Join_policy.EnumWarn):
+    """
+    Compile the mapping rows of one target table into a TargetTablePlan.
+    Join rows with the same source table and join fields become one
+    JoinStep, run where the first of them appears. A target field is taken
+    from the first row that maps it, as when every row was merged on its own.
+    A JoinPolicy column on the mapping overrides join_policy per row.
+    """
+    main_rows = group[group['IsMainTable'] == 1]
+    non_main_rows = group[group['IsMainTable'] == 0]
+
+    main_fields = tuple(main_rows[['SoruceTable', 'SoruceField', 'TargetField']].itertuples(index=False, name=None))
+    setClaimed = {target_field for _, _, target_field in main_fields}
+
+    if 'JoinPolicy' in non_main_rows.columns:
+        row_policies = non_main_rows['JoinPolicy'].fillna('').astype(str).str.strip().str.upper()
+        row_policies = row_policies.where(row_policies.isin(JOIN_POLICY_ORDER), join_policy)
+    else:
+        row_policies = pd.Series(join_policy, index=non_main_rows.index)
+
+    dictSteps = {}
+    dictPolicies = {}
+    for (source_table, source_field, target_field, source_join, target_join), policy in zip(
+            non_main_rows[['SoruceTable', 'SoruceField', 'TargetField', 'SoruceJoinFiled', 'TargetJoinField']].itertuples(index=False), row_policies):
+        if target_field in setClaimed:
+            continue
+        setClaimed.add(target_field)
+        key = (source_table, tuple(split_join_fields(source_join)), tuple(split_join_fields(target_join)))
+        dictSteps.setdefault(key, []).append((source_field, target_field))
+        dictPolicies[key] = min(dictPolicies.get(key, policy), policy, key=JOIN_POLICY_ORDER.index)
+
+    joins = tuple(JoinStep(source_table, source_join_fields, target_join_fields, tuple(fields), dictPolicies[(source_table, source_join_fields, target_join_fields)])
+                  for (source_table, source_join_fields, target_join_fields), fields in dictSteps.items())
+    return TargetTablePlan(target_table, tuple(main_rows['SoruceTable'].unique()), main_fields, joins)
+
+
+def describe_join_plan(plan):
     """
-    Process a single target table mapping in parallel.
+    Readable summary of a TargetTablePlan, one line per step.
+    """
+    lstLines = [f"Join plan for {plan.target_table}: {len(plan.main_fields)} main fields from {', '.join(map(str, plan.main_tables)) or '-'}, "
+                f"{len(plan.joins)} joins for {sum(len(step.fields) for step in plan.joins)} joined fields"]
+    for idx, step in enumerate(plan.joins, start=1):
+        lstLines.append(f"  {idx}. {step.source_table} on {'|'.join(step.source_join_fields)} -> {'|'.join(step.target_join_fields)} ({step.policy}): "
+                        f"{', '.join(target_field for _, target_field in step.fields)}")
+    return "\n".join(lstLines)
+
+
+def shared_column(series):
+    """
+    A source column under a fresh RangeIndex, sharing the source's buffer.
+    Target frames only ever replace whole columns (rules assign with
+    df[field] = ...), so the source data is never written through a view.
+    """
+    return pd.Series(series.array, copy=False)
+
+
+def missing_column(row_count):
+    """
+    An all-NA object column of row_count rows: a read-only broadcast of one
+    value rather than row_count separate entries.
+    """
+    return pd.Series(np.broadcast_to(np.array(pd.NA, dtype=object), (row_count,)), dtype=object, copy=False)
+
+
+def add_columns(df, dictColumns):
+    """
+    The frame with extra columns, keeping every column in its own block:
+    pd.concat or df.insert would copy the existing columns into one.
+    """
+    return pd.DataFrame({**{col: df[col] for col in df.columns}, **dictColumns}, index=df.index, copy=False)
+
+
+def execute_join_plan(plan, source_data, join_indexes=None, join_report=None):
+    """
+    Build the target DataFrame of a TargetTablePlan from the extracted source
+    tables. Joins on unique source keys are looked up in join_indexes (a
+    JoinIndexCache shared by the run); the others pass the cardinality check
+    first and are merged, deduplicated or refused. Every check is appended
+    to join_report.
+    """
+    if join_indexes is None:
+        join_indexes = JoinIndexCache()
+    target_table = plan.target_table
+    mapped_columns = {}
+
+    # Estimate row count for alignment
+    row_count = max([len(source_data[table]) for table in plan.main_tables if table in source_data], default=0)
+
+    # Process main table mappings: the target columns are views of the source column buffers
+    for source_table, source_field, target_field in plan.main_fields:
+        source_df = source_data.get(source_table)
+        if source_df is not None and source_field in source_df.columns:
+            mapped_columns[target_field] = shared_column(source_df[source_field])
+        else:
+            mapped_columns[target_field] = missing_column(row_count)
+            logger.warning(f"Missing {source_table}.{source_field}, filled NaN for {target_table}.{target_field}")
+
+    # Create DataFrame from mapped columns, without copying or consolidating them
+    target_df = pd.DataFrame(mapped_columns, copy=False)
+
+    # One merge per join step, bringing in all of its fields at once
+    for step in plan.joins:
+        source_df = source_data.get(step.source_table)
+        if source_df is None:
+            logger.warning(f"Source table {step.source_table} not found, skipping join for {', '.join(target_field for _, target_field in step.fields)}")
+            continue
+        if not step.target_join_fields or len(step.source_join_fields) != len(step.target_join_fields):
+            logger.warning(f"Invalid join fields {'|'.join(step.source_join_fields)} -> {'|'.join(step.target_join_fields)} for {step.source_table}, "
+                           f"skipping join for {', '.join(target_field for _, target_field in step.fields)}")
+            continue
+
+        target_join_cols = list(step.target_join_fields)
+        join_index = join_indexes.get(step.source_table, source_df, step.source_join_fields)
+        target_keys = join_target_keys(target_df, target_join_cols)
+
+        # Predicted from the cached key counts, before any merge allocates memory
+        check = check_join_cardinality(target_table, step, join_index, target_keys, step.policy)
+        if join_report is not None:
+            join_report.append(check)
+        if check.action == 'refuse':
+            reason = f"policy {step.policy}" if step.policy == Join_policy.EnumRefuse else f"limit {JOIN_MAX_OUTPUT_ROWS} rows"
+            raise ValueError(f"Join of {step.source_table} on {check.target_join_fields} would grow {target_table} from {check.rows} "
+                             f"to {check.predicted_rows} rows ({reason}).")
+
+        if check.action in ('lookup', 'dedupe'):
+            # At most one source row per key: a lookup and a gather, row count and order unchanged
+            positions = lookup_join_positions(join_index, target_keys)
+            joined_columns = {target_field: take_join_column(source_df[source_field], positions, target_df.index) for source_field, target_field in step.fields}
+            target_df = add_columns(target_df, joined_columns)
+            logger.debug(f"Looked up {len(step.fields)} fields of {step.source_table} for {target_table} on {target_join_cols}")
+            continue
+
+        dictJoinColumns = {target_col: source_df[source_col] for source_col, target_col in zip(step.source_join_fields, step.target_join_fields)}
+        dictJoinColumns.update({target_field: source_df[source_field] for source_field, target_field in step.fields})
+        temp_df = pd.DataFrame(dictJoinColumns, copy=False)
+
+        target_df, temp_df = align_join_dtypes(target_df, temp_df, target_join_cols)
+        target_df = pd.merge(target_df, temp_df, how='left', on=target_join_cols)
+        logger.debug(f"Merged {len(step.fields)} fields of {step.source_table} into {target_table} on {target_join_cols}")
+
+    return target_df
+
+
+def process_target_table(target_table, group, source_data, raise_errors=False, join_indexes=None, join_policy=Join_policy.EnumWarn, join_report=None):
+    """
+    Process a single target table mapping. Errors are logged and returned as
+    a None frame, or raised with raise_errors.
     """
     try:
         logger.info(f"Processing TargetTable: {target_table}")
 
-        mapped_columns = {}
-        main_rows = group[group['IsMainTable'] == 1]
-        non_main_rows = group[group['IsMainTable'] == 0]
-
-        # Estimate row count for alignment
-        row_count = max([len(source_data[table]) for table in main_rows['SoruceTable'].unique() if table in source_data], default=0)
-
-        # Process main table mappings
-        for _, row in main_rows.iterrows():
-            source_table = row['SoruceTable']
-            source_field = row['SoruceField']
-            target_field = row['TargetField']
-
-            source_df = source_data.get(source_table)
-            if source_df is not None and source_field in source_df.columns:
-                mapped_columns[target_field] = source_df[source_field].reset_index(drop=True)
-            else:
-                mapped_columns[target_field] = pd.Series([pd.NA] * row_count)
-                logger.warning(f"Missing {source_table}.{source_field}, filled NaN for {target_table}.{target_field}")
-
-        # Create DataFrame from mapped columns
-        target_df = pd.DataFrame(mapped_columns)
-
-        # Process non-main mappings with joins
-        for _, row in non_main_rows.iterrows():
-            source_table = row['SoruceTable']
-            source_field = row['SoruceField']
-            target_field = row['TargetField']
-
-            source_df = source_data.get(source_table)
-            if source_df is None:
-                logger.warning(f"Source table {source_table} not found, skipping join for {target_field}")
-                continue
-
-            source_join_cols = str(row['SoruceJoinFiled']).split('|')
-            target_join_cols = str(row['TargetJoinField']).split('|')
-
-            join_fields_source = source_join_cols + [source_field]
-            join_fields_target = target_join_cols + [target_field]
-
-            if join_fields_source != join_fields_target:
-                col_mapping = dict(zip(join_fields_source, join_fields_target))
-                temp_df = source_df[join_fields_source].rename(columns=col_mapping).copy()
-                logger.debug(f"Renamed join columns: {col_mapping}")
-            else:
-                temp_df = source_df[join_fields_source].copy()
-
-            # Merge only if the target field is not present
-            if target_field not in target_df.columns:
-                target_df = pd.merge(target_df, temp_df, how='left', on=target_join_cols)
-                logger.debug(f"Merged {source_table} into {target_table} on {target_join_cols}")
+        plan = compile_join_plan(target_table, group, join_policy)
+        logger.info(describe_join_plan(plan))
+        target_df = execute_join_plan(plan, source_data, join_indexes, join_report)
 
         logger.info(f"Completed mapping for TargetTable: {target_table}")
         return target_table, target_df
 
     except Exception as e:
         logger.exception(f"Error processing {target_table}: {e}")
+        if raise_errors:
+            raise
         return target_table, None
 
 @log_execution_time
-def table_mapping_parallel(dfeccmapping, source_data, num_workers=None):
+def table_mapping_parallel(dfeccmapping, source_data, num_workers=None, join_policy=Join_policy.EnumWarn):
     """
-    Parallel processing version of table_mapping using ProcessPoolExecutor.
+    Map all target tables concurrently on a thread pool. The threads share
+    the extracted source_data, so nothing is pickled or copied per task, and
+    the merges and column copies run largely outside the GIL. Every failed
+    target table is reported, not only the first. join_policy applies to
+    joins that would multiply rows, unless the mapping's JoinPolicy column
+    sets one; the checks are returned as join_report.
     """
     dicResult = {'iserror': False}
     final_target_dataframes = {}
@@ -103,24 +226,43 @@ def table_mapping_parallel(dfeccmapping, source_data, num_workers=None):
         logger.info("Starting table_mapping_parallel function.")
 
         # Extract required columns
-        dfmapping_main = dfeccmapping[['SoruceTable', 'SoruceField', 'TargetTable', 'TargetField', 'SoruceJoinFiled', 'TargetJoinField', 'IsMainTable']]
-        target_groups = dfmapping_main.groupby('TargetTable')
+        lstColumns = ['SoruceTable', 'SoruceField', 'TargetTable', 'TargetField', 'SoruceJoinFiled', 'TargetJoinField', 'IsMainTable']
+        dfmapping_main = dfeccmapping[lstColumns + (['JoinPolicy'] if 'JoinPolicy' in dfeccmapping.columns else [])]
+        target_groups = list(dfmapping_main.groupby('TargetTable'))
         logger.info("table_mapping_parallel: Required Columns Extracted")
 
-        for target_table, group in target_groups:
-            target_table, target_df = process_target_table(target_table, group, source_data)
-            if target_df is not None:
-                final_target_dataframes[target_table] = target_df
-            else:
-                logger.info(f"table_mapping_parallel: {target_table} target df is none ")
-                dicResult['iserror'] = True
-                dicResult['error'] = "Unhandled Error in table_mapping_parallel: {target_table} target df is none."
-                dicResult['error_details'] = f"{dicResult['error']}"
-                return dicResult
+        num_workers = num_workers or min(MAPPING_MAX_WORKERS, os.cpu_count() or 1)
+        num_workers = max(1, min(num_workers, len(target_groups)))
+        logger.info(f"table_mapping_parallel: mapping {len(target_groups)} target tables with {num_workers} workers")
+
+        # Join key indexes of the source tables, built once and shared by all target tables
+        join_indexes = JoinIndexCache()
+        lstJoinReport = []
+
+        dictErrors = {}
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            dicttask = {executor.submit(process_target_table, target_table, group, source_data, True, join_indexes, join_policy, lstJoinReport): target_table
+                        for target_table, group in target_groups}
+            for future in as_completed(dicttask):
+                target_table = dicttask[future]
+                try:
+                    final_target_dataframes[target_table] = future.result()[1]
+                    logger.info(f"table_mapping_parallel: {target_table} mapped ({len(final_target_dataframes)}/{len(target_groups)})")
+                except Exception as e:
+                    dictErrors[target_table] = str(e)
+        dicResult['join_report'] = [check._asdict() for check in lstJoinReport]
+
+        if dictErrors:
+            dicResult['iserror'] = True
+            dicResult['error'] = f"Error in table_mapping_parallel for target tables: {', '.join(sorted(dictErrors))}."
+            dicResult['error_details'] = dicResult['error'] + " | " + " | ".join(f"{target_table}: {error}" for target_table, error in sorted(dictErrors.items()))
+            dicResult['table_errors'] = dictErrors
+            return dicResult
 
         logger.info("table_mapping_parallel: Process Completed ")
 
-        dicResult['value'] = final_target_dataframes
+        # Completion order is arbitrary; keep the target tables in mapping order
+        dicResult['value'] = {target_table: final_target_dataframes[target_table] for target_table, _ in target_groups}
         logger.info("table mapping completed successfully.")
 
     except Exception as e:
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from .mdlRfc import ABAPApplicationError, ABAPRuntimeError, CommunicationError, LogonError
+from .logger import Logger
+from .mdlSapPool import get_sap_connection
+
+
+logger = Logger.get_logger()
+
+METADATA_CACHE_DIR = os.path.join("cache", "sap_metadata")
+METADATA_VERIFY_INTERVAL = 24 * 60 * 60  # Seconds before the DDIC version of a cached table is checked again
+METADATA_CACHE_FORMAT = 1  # Bump when the cached field layout changes
+
+# DFIES columns kept in the cache
+METADATA_DFIES_KEYS = ('FIELDNAME', 'POSITION', 'OFFSET', 'KEYFLAG', 'DATATYPE', 'INTTYPE', 'LENG', 'OUTPUTLEN', 'DECIMALS')
+
+
+class SapMetadataCache:
+    """
+    Persistent cache of DDIF_FIELDINFO_GET field metadata, one JSON file per
+    SAP system, client and table. A cached table is trusted until its DDIC
+    version (DD02L AS4VERS/AS4DATE/AS4TIME) has to be checked again, and is
+    still served when SAP cannot be reached.
+    """
+
+    def __init__(self, cache_dir=METADATA_CACHE_DIR, verify_interval=METADATA_VERIFY_INTERVAL):
+        self.cache_dir = cache_dir
+        self.verify_interval = verify_interval
+        self._lock = threading.Lock()
+        self._memory = {}
+
+    @staticmethod
+    def system_key(connection_params):
+        parts = [
+            str(connection_params.get('ashost') or connection_params.get('mshost') or ''),
+            str(connection_params.get('sysnr', '')),
+            str(connection_params.get('client', '')),
+        ]
+        return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, connection_params, tbl):
+        # Namespaced tables (/ABC/TABLE) must not create sub directories
+        return os.path.join(self.cache_dir, self.system_key(connection_params), tbl.replace('/', '#') + ".json")
+
+    def _load(self, connection_params, tbl):
+        path = self._path(connection_params, tbl)
+        with self._lock:
+            if path in self._memory:
+                return self._memory[path]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('format') != METADATA_CACHE_FORMAT:
+            return None
+        with self._lock:
+            self._memory[path] = entry
+        return entry
+
+    def _store(self, connection_params, tbl, entry):
+        path = self._path(connection_params, tbl)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._memory[path] = entry
+
+    @staticmethod
+    def read_table_version(connection, tbl):
+        """
+        Active DDIC version of a table from DD02L, or None when it cannot be read.
+        """
+        try:
+            result = connection.call(
+                'RFC_READ_TABLE',
+                QUERY_TABLE='DD02L',
+                DELIMITER='|',
+                FIELDS=[{'FIELDNAME': 'AS4VERS'}, {'FIELDNAME': 'AS4DATE'}, {'FIELDNAME': 'AS4TIME'}],
+                OPTIONS=[{'TEXT': f"TABNAME = '{tbl}' AND AS4LOCAL = 'A'"}],
+                ROWCOUNT=1
+            )
+        except (ABAPApplicationError, ABAPRuntimeError) as e:
+            logger.warning(f"Could not read DDIC version of table {tbl}: {e}")
+            return None
+        return result['DATA'][0]['WA'].strip() if result.get('DATA') else None
+
+    def fetch(self, connection, connection_params, tbl):
+        """
+        Read the table's metadata from SAP and store it in the cache.
+        """
+        result = connection.call('DDIF_FIELDINFO_GET', TABNAME=tbl, LANGU='EN', ALL_TYPES='X')
+        entry = {
+            'format': METADATA_CACHE_FORMAT,
+            'table': tbl,
+            'version': self.read_table_version(connection, tbl),
+            'checked': time.time(),
+            'fields': [{key: field.get(key, '') for key in METADATA_DFIES_KEYS} for field in result['DFIES_TAB']],
+        }
+        self._store(connection_params, tbl, entry)
+        logger.info(f"Cached DDIC metadata of table {tbl} ({len(entry['fields'])} fields, version {entry['version']}).")
+        return entry
+
+    def get_fields(self, connection_params, tbl, connection=None, refresh=False):
+        """
+        Return the DFIES field list of a table. SAP is only called on a cache
+        miss, a refresh, or when the DDIC version is due to be checked; an open
+        connection may be passed in to avoid checking out another one.
+        """
+        entry = None if refresh else self._load(connection_params, tbl)
+        if entry is not None and time.time() - entry['checked'] <= self.verify_interval:
+            return entry['fields']
+
+        try:
+            with nullcontext(connection) if connection is not None else get_sap_connection(connection_params) as conn:
+                if entry is not None:
+                    version = self.read_table_version(conn, tbl)
+                    if version is not None and version == entry['version']:
+                        entry = dict(entry, checked=time.time())
+                        self._store(connection_params, tbl, entry)
+                        return entry['fields']
+                    logger.info(f"DDIC version of table {tbl} changed ({entry['version']} -> {version}), refreshing metadata.")
+                return self.fetch(conn, connection_params, tbl)['fields']
+        except (CommunicationError, LogonError) as e:
+            if entry is None:
+                raise
+            logger.warning(f"SAP not reachable, using cached metadata of table {tbl}: {e}")
+            return entry['fields']
+
+    def cached_tables(self, connection_params):
+        system_dir = os.path.join(self.cache_dir, self.system_key(connection_params))
+        if not os.path.isdir(system_dir):
+            return []
+        return sorted(file_name[:-len(".json")].replace('#', '/') for file_name in os.listdir(system_dir) if file_name.endswith(".json"))
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """
+    Return the process-wide DDIC metadata cache.
+    """
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = SapMetadataCache()
+        return _metadata_cache
+
+
+def get_table_fields(connection_params, tbl, connection=None, refresh=False):
+    """
+    Cached DDIF_FIELDINFO_GET DFIES_TAB for a table.
+    """
+    return get_metadata_cache().get_fields(connection_params, tbl, connection, refresh)
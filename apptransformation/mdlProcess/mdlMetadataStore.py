@@ -0,0 +1,283 @@
+import os
+import sqlite3
+import threading
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from .logger import Logger
+from .mdlDbPool import SqlEngineRegistry, sql_column_exists, sql_table_exists
+from .mdlEnum import Metadata_backend
+from .mdlTemplateBundle import query_bundle_checksum
+
+
+logger = Logger.get_logger()
+
+# Columns of the metadata tables, in the order the fetchers select them
+TEMPLATE_DETAILS_COLUMNS = ['TemplateID', 'LTMCVersion', 'TemplateName', 'BlankTemplatePath', 'Script', 'Script1', 'Script2', 'Script3']
+ECC_MAPPING_COLUMNS = ['SoruceTable', 'SoruceField', 'TargetTable', 'TargetField', 'IsMainTable', 'SoruceJoinFiled', 'TargetJoinField']
+EXTRACTION_FILTER_COLUMNS = ['SoruceTable', 'FilterField', 'Operator', 'FilterValue']
+DELTA_CONFIG_COLUMNS = ['SoruceTable', 'ChangeFields', 'FullRefreshDays']
+TRANSFORMATION_RULE_COLUMNS = ['ClientID', 'TargetTable', 'TargetField', 'RuleName', 'Format', 'Custome1', 'Custome2', 'Custome3']
+
+
+class SqlServerMetadataStore:
+    """
+    Template metadata in the SQL Server database of the application.
+    """
+
+    def __init__(self, server, database, username, password):
+        self.engine = SqlEngineRegistry.get_engine(server, database, username, password)
+
+    def read_template_details(self, saptemversion, templatename):
+        query = text("""SELECT [TemplateID]
+                        ,[LTMCVersion]
+                        ,[TemplateName]
+                        ,[BlankTemplatePath]
+                        ,[Script]
+                        ,[Script1]
+                        ,[Script2]
+                        ,[Script3]
+                    FROM [tblTransformationMaster]
+            WHERE [LTMCVersion] = :saptemversion AND [TemplateName] = :templatename""")
+        with self.engine.connect() as conn:
+            return conn.execute(query, {"saptemversion": saptemversion, "templatename": templatename}).fetchone()
+
+    def read_ecc_mapping(self, templateid, clientid):
+        """
+        Return the field mapping and the extraction filters of a template for a client.
+        """
+        query = """SELECT [SoruceTable],[SoruceField],[TargetTable],[TargetField]
+                                ,[IsMainTable],[SoruceJoinFiled],[TargetJoinField]{join_policy}
+                        FROM [ECC_Field_Mapping] WHERE [TemplateID] = :templateid AND (([ClientFlag] = '' OR [ClientFlag] IS NULL OR [ClientFlag] = :clientid))
+                        AND LOWER(TRIM(:clientid)) NOT IN (SELECT LOWER(TRIM(value)) FROM STRING_SPLIT([ExcludeClientFlag], '|'))
+                     """
+        # Row filters pushed down into the SAP extraction, per template or per client
+        filter_query = text("""SELECT [SoruceTable],[FilterField],[Operator],[FilterValue]
+                        FROM [ECC_Extraction_Filter] WHERE [TemplateID] = :templateid AND (([ClientFlag] = '' OR [ClientFlag] IS NULL OR [ClientFlag] = :clientid))
+                     """)
+        params = {"templateid": templateid, 'clientid': clientid}
+        with self.engine.connect() as conn:
+            # JoinPolicy overrides the run's join policy per mapping row; databases created before it have no such column
+            join_policy = ",[JoinPolicy]" if sql_column_exists(conn, 'ECC_Field_Mapping', 'JoinPolicy') else ""
+            df = pd.read_sql(text(query.format(join_policy=join_policy)), conn, params=params)
+            # Databases created before ECC_Extraction_Filter existed have no filters
+            if sql_table_exists(conn, 'ECC_Extraction_Filter'):
+                df_filters = pd.read_sql(filter_query, conn, params=params)
+            else:
+                df_filters = pd.DataFrame(columns=EXTRACTION_FILTER_COLUMNS)
+        return df, df_filters
+
+    def read_delta_config(self):
+        """
+        Return the delta extraction settings per source table.
+        """
+        query = text("""SELECT [SoruceTable],[ChangeFields],[FullRefreshDays] FROM [ECC_Delta_Config]""")
+        with self.engine.connect() as conn:
+            # Without ECC_Delta_Config every table is extracted in full
+            if not sql_table_exists(conn, 'ECC_Delta_Config'):
+                return pd.DataFrame(columns=DELTA_CONFIG_COLUMNS)
+            return pd.read_sql(query, conn)
+
+    def read_transformation_rules(self, clientid):
+        query = text("""SELECT [ClientID]
+                            ,[TargetTable]
+                            ,[TargetField]
+                            ,[RuleName]
+                            ,[Format]
+                            ,[Custome1]
+                            ,[Custome2]
+                            ,[Custome3]
+                        FROM [INNOVAPTE].[dbo].[ConditionalRules] WHERE [ClientID] = :clientid""")
+        with self.engine.connect() as conn:
+            return pd.read_sql(query, conn, params={"clientid": clientid})
+
+    def bundle_checksum(self, saptemversion, templatename, clientid):
+        return query_bundle_checksum(self.engine, saptemversion, templatename, clientid)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tblTransformationMaster (
+    TemplateID INTEGER PRIMARY KEY,
+    LTMCVersion TEXT NOT NULL,
+    TemplateName TEXT NOT NULL,
+    BlankTemplatePath TEXT,
+    Script TEXT,
+    Script1 TEXT,
+    Script2 TEXT,
+    Script3 TEXT,
+    UNIQUE (LTMCVersion, TemplateName)
+);
+CREATE TABLE IF NOT EXISTS ECC_Field_Mapping (
+    ID INTEGER PRIMARY KEY,
+    TemplateID INTEGER NOT NULL,
+    SoruceTable TEXT,
+    SoruceField TEXT,
+    TargetTable TEXT,
+    TargetField TEXT,
+    IsMainTable INTEGER,
+    SoruceJoinFiled TEXT,
+    TargetJoinField TEXT,
+    JoinPolicy TEXT,
+    ClientFlag TEXT,
+    ExcludeClientFlag TEXT
+);
+CREATE INDEX IF NOT EXISTS IX_ECC_Field_Mapping_TemplateID ON ECC_Field_Mapping (TemplateID);
+CREATE TABLE IF NOT EXISTS ECC_Extraction_Filter (
+    ID INTEGER PRIMARY KEY,
+    TemplateID INTEGER NOT NULL,
+    SoruceTable TEXT,
+    FilterField TEXT,
+    Operator TEXT,
+    FilterValue TEXT,
+    ClientFlag TEXT
+);
+CREATE INDEX IF NOT EXISTS IX_ECC_Extraction_Filter_TemplateID ON ECC_Extraction_Filter (TemplateID);
+CREATE TABLE IF NOT EXISTS ECC_Delta_Config (
+    SoruceTable TEXT PRIMARY KEY,
+    ChangeFields TEXT,
+    FullRefreshDays INTEGER
+);
+CREATE TABLE IF NOT EXISTS ConditionalRules (
+    ID INTEGER PRIMARY KEY,
+    ClientID TEXT NOT NULL,
+    TargetTable TEXT,
+    TargetField TEXT,
+    RuleName TEXT,
+    Format TEXT,
+    Custome1 TEXT,
+    Custome2 TEXT,
+    Custome3 TEXT
+);
+CREATE INDEX IF NOT EXISTS IX_ConditionalRules_ClientID ON ConditionalRules (ClientID);
+"""
+
+
+class SqliteMetadataStore:
+    """
+    The same metadata schema in a local SQLite file, for running and
+    profiling the pipeline without SQL Server. Rows are filtered with the
+    same client rules as on SQL Server.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        # SQLite connections are cheap and must not be shared across threads
+        self.engine = create_engine(f"sqlite:///{self.path}", poolclass=NullPool)
+
+    def create_schema(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with sqlite3.connect(self.path) as conn:
+            conn.executescript(_SQLITE_SCHEMA)
+
+    def read_template_details(self, saptemversion, templatename):
+        query = text(f"SELECT {', '.join(TEMPLATE_DETAILS_COLUMNS)} FROM tblTransformationMaster WHERE LTMCVersion = :saptemversion AND TemplateName = :templatename")
+        with self.engine.connect() as conn:
+            return conn.execute(query, {"saptemversion": saptemversion, "templatename": templatename}).fetchone()
+
+    def read_ecc_mapping(self, templateid, clientid):
+        """
+        Return the field mapping and the extraction filters of a template for a client.
+        """
+        client_condition = "TemplateID = :templateid AND (ClientFlag = '' OR ClientFlag IS NULL OR ClientFlag = :clientid)"
+        query = text(f"SELECT {', '.join(ECC_MAPPING_COLUMNS)}, JoinPolicy, ExcludeClientFlag FROM ECC_Field_Mapping WHERE {client_condition} ORDER BY ID")
+        filter_query = text(f"SELECT {', '.join(EXTRACTION_FILTER_COLUMNS)} FROM ECC_Extraction_Filter WHERE {client_condition} ORDER BY ID")
+        params = {"templateid": templateid, 'clientid': clientid}
+        with self.engine.connect() as conn:
+            df = pd.read_sql(query, conn, params=params)
+            df_filters = pd.read_sql(filter_query, conn, params=params)
+
+        # SQLite has no STRING_SPLIT: drop the rows whose ExcludeClientFlag lists the client
+        excluded = df['ExcludeClientFlag'].fillna('').astype(str).str.split('|').explode().str.strip().str.lower() == str(clientid).strip().lower()
+        df = df[~excluded.groupby(level=0).any()]
+        return df[ECC_MAPPING_COLUMNS + ['JoinPolicy']].reset_index(drop=True), df_filters
+
+    def read_delta_config(self):
+        """
+        Return the delta extraction settings per source table.
+        """
+        query = text(f"SELECT {', '.join(DELTA_CONFIG_COLUMNS)} FROM ECC_Delta_Config ORDER BY SoruceTable")
+        with self.engine.connect() as conn:
+            return pd.read_sql(query, conn)
+
+    def read_transformation_rules(self, clientid):
+        query = text(f"SELECT {', '.join(TRANSFORMATION_RULE_COLUMNS)} FROM ConditionalRules WHERE ClientID = :clientid ORDER BY ID")
+        with self.engine.connect() as conn:
+            return pd.read_sql(query, conn, params={"clientid": clientid})
+
+    def bundle_checksum(self, saptemversion, templatename, clientid):
+        # Any committed write changes the file, so its size and modification time stand in for row checksums
+        stat = os.stat(self.path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def add_template(self, saptemversion, templatename, blank_template_path, mapping_rows, filter_rows=(), rule_rows=()):
+        """
+        Insert a template with its mapping, extraction filter and rule rows
+        (dicts keyed by column name), replacing a template of the same name.
+        Returns the template id.
+        """
+        self.create_schema()
+        with sqlite3.connect(self.path) as conn:
+            row = conn.execute("SELECT TemplateID FROM tblTransformationMaster WHERE LTMCVersion = ? AND TemplateName = ?", (saptemversion, templatename)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM ECC_Field_Mapping WHERE TemplateID = ?", row)
+                conn.execute("DELETE FROM ECC_Extraction_Filter WHERE TemplateID = ?", row)
+                conn.execute("DELETE FROM tblTransformationMaster WHERE TemplateID = ?", row)
+            templateid = conn.execute("INSERT INTO tblTransformationMaster (LTMCVersion, TemplateName, BlankTemplatePath) VALUES (?, ?, ?)",
+                                      (saptemversion, templatename, blank_template_path)).lastrowid
+
+            mapping_columns = ECC_MAPPING_COLUMNS + ['JoinPolicy', 'ClientFlag', 'ExcludeClientFlag']
+            conn.executemany(f"INSERT INTO ECC_Field_Mapping (TemplateID, {', '.join(mapping_columns)}) VALUES ({', '.join(['?'] * (len(mapping_columns) + 1))})",
+                             [(templateid, *[mapping_row.get(col) for col in mapping_columns]) for mapping_row in mapping_rows])
+            filter_columns = EXTRACTION_FILTER_COLUMNS + ['ClientFlag']
+            conn.executemany(f"INSERT INTO ECC_Extraction_Filter (TemplateID, {', '.join(filter_columns)}) VALUES ({', '.join(['?'] * (len(filter_columns) + 1))})",
+                             [(templateid, *[filter_row.get(col) for col in filter_columns]) for filter_row in filter_rows])
+            conn.executemany(f"INSERT INTO ConditionalRules ({', '.join(TRANSFORMATION_RULE_COLUMNS)}) VALUES ({', '.join(['?'] * len(TRANSFORMATION_RULE_COLUMNS))})",
+                             [tuple(rule_row.get(col) for col in TRANSFORMATION_RULE_COLUMNS) for rule_row in rule_rows])
+        return templateid
+
+    def set_delta_config(self, delta_rows):
+        """
+        Replace the delta extraction settings with the given rows (dicts keyed
+        by column name).
+        """
+        self.create_schema()
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("DELETE FROM ECC_Delta_Config")
+            conn.executemany(f"INSERT INTO ECC_Delta_Config ({', '.join(DELTA_CONFIG_COLUMNS)}) VALUES ({', '.join(['?'] * len(DELTA_CONFIG_COLUMNS))})",
+                             [tuple(delta_row.get(col) for col in DELTA_CONFIG_COLUMNS) for delta_row in delta_rows])
+
+    def remove_client_rules(self, clientid):
+        self.create_schema()
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("DELETE FROM ConditionalRules WHERE ClientID = ?", (clientid,))
+
+
+# Metadata stores by backend; SQL Server is used for any other server name
+METADATA_STORES = {
+    Metadata_backend.EnumSqlServer: SqlServerMetadataStore,
+    Metadata_backend.EnumSqlite: SqliteMetadataStore,
+}
+
+_metadata_stores = {}
+_metadata_stores_lock = threading.Lock()
+
+
+def get_metadata_backend(server):
+    return Metadata_backend.EnumSqlite if str(server).strip().lower() == Metadata_backend.EnumSqlite else Metadata_backend.EnumSqlServer
+
+
+def get_metadata_store(server, database, username, password):
+    """
+    Return the metadata store of the connection details. The server name
+    'sqlite' selects a local SQLite file, given as the database; anything
+    else is a SQL Server instance.
+    """
+    backend = get_metadata_backend(server)
+    if backend == Metadata_backend.EnumSqlite:
+        key = (backend, os.path.abspath(database))
+        with _metadata_stores_lock:
+            if key not in _metadata_stores:
+                _metadata_stores[key] = METADATA_STORES[backend](database)
+            return _metadata_stores[key]
+    # Engines are already shared per database by SqlEngineRegistry
+    return METADATA_STORES[backend](server, database, username, password)
@@ -0,0 +1,147 @@
+import os
+import xml.etree.ElementTree as ET
+import pandas as pd
+from .logger import Logger
+
+
+logger = Logger.get_logger()
+
+TEMPLATE_HEADER_ROW = 5  # Row of the migration template holding the field names
+_SS_NAMESPACE = '{urn:schemas-microsoft-com:office:spreadsheet}'
+
+
+def read_template_headers(template_path, header_row=TEMPLATE_HEADER_ROW):
+    """
+    Read the header row of every sheet of a migration template, as
+    {sheet name: [header, ...]}. SpreadsheetML (.xml) templates are parsed
+    directly, .xlsx templates through openpyxl.
+    """
+    if os.path.splitext(template_path)[1].lower() in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        wb = load_workbook(template_path, read_only=True)
+        try:
+            return {ws.title: [cell for cell in next(ws.iter_rows(min_row=header_row, max_row=header_row, values_only=True), ()) if cell is not None]
+                    for ws in wb.worksheets}
+        finally:
+            wb.close()
+
+    dictHeaders = {}
+    sheet_name = None
+    row_idx = 0
+    for event, elem in ET.iterparse(template_path, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == _SS_NAMESPACE + 'Worksheet':
+                sheet_name = elem.get(_SS_NAMESPACE + 'Name')
+                dictHeaders[sheet_name] = []
+                row_idx = 0
+            continue
+
+        if elem.tag == _SS_NAMESPACE + 'Row':
+            # Rows and cells may skip positions with ss:Index
+            row_idx = int(elem.get(_SS_NAMESPACE + 'Index', row_idx + 1))
+            if row_idx == header_row and sheet_name is not None:
+                for cell in elem.iter(_SS_NAMESPACE + 'Cell'):
+                    data = cell.find(_SS_NAMESPACE + 'Data')
+                    if data is not None and data.text is not None:
+                        dictHeaders[sheet_name].append(data.text)
+            elem.clear()
+        elif elem.tag == _SS_NAMESPACE + 'Worksheet':
+            sheet_name = None
+            elem.clear()
+
+    return dictHeaders
+
+
+def split_join_fields(value):
+    """
+    Fields of a pipe-separated SoruceJoinFiled / TargetJoinField value.
+    """
+    if value is None or pd.isna(value) or str(value).strip() == '':
+        return []
+    return [fld.strip() for fld in str(value).split('|')]
+
+
+def project_ecc_mapping(dfeccmapping, dictTemplateHeaders):
+    """
+    Keep only the ECC_Field_Mapping rows whose target field reaches the
+    template output: a target field is needed when it is a template header,
+    or when a needed join row joins on it. Target tables are matched to the
+    sheets without regard to case, as Excel finds the sheet when writing;
+    target tables without a template sheet are dropped, as the writer skips them.
+    """
+    dictSheetHeaders = {str(sheet_name).lower(): lstHeaders for sheet_name, lstHeaders in dictTemplateHeaders.items()}
+
+    lstKeep = []
+    for target_table, group in dfeccmapping.groupby('TargetTable', sort=False):
+        lstHeaders = dictSheetHeaders.get(str(target_table).lower())
+        if lstHeaders is None:
+            logger.warning(f"Projection: no template sheet for {target_table}, dropping its {len(group)} mapping rows.")
+            continue
+
+        setNeeded = set(lstHeaders)
+        while True:
+            needed_rows = group[group['TargetField'].isin(setNeeded)]
+            setJoin = {fld for value in needed_rows.loc[needed_rows['IsMainTable'] == 0, 'TargetJoinField'] for fld in split_join_fields(value)}
+            if setJoin <= setNeeded:
+                break
+            setNeeded |= setJoin
+
+        if len(needed_rows) < len(group):
+            logger.info(f"Projection: {target_table} needs {len(needed_rows)} of {len(group)} mapping rows.")
+        lstKeep.append(needed_rows)
+
+    if not lstKeep:
+        return dfeccmapping.iloc[0:0]
+    return pd.concat(lstKeep)
+
+
+def build_ecc_field_list(dfeccmapping):
+    """
+    SAP fields to extract per source table: every mapped source field plus the
+    source join fields of the join rows, in order of first use, as
+    {table: (field, ...)}.
+    """
+    df = dfeccmapping[['SoruceTable', 'SoruceField', 'IsMainTable', 'SoruceJoinFiled']].reset_index(drop=True)
+    df_source = pd.DataFrame({'table': df['SoruceTable'], 'field': df['SoruceField'], 'row': df.index, 'pos': 0})
+
+    # One row per join field of the join rows, placed after the row's own source field
+    join_fields = df.loc[(df['IsMainTable'] == 0) & df['SoruceJoinFiled'].notna(), 'SoruceJoinFiled'].astype(str).str.split('|').explode().str.strip()
+    join_fields = join_fields[join_fields != '']
+    df_join = pd.DataFrame({'table': df.loc[join_fields.index, 'SoruceTable'].to_numpy(), 'field': join_fields.to_numpy(),
+                            'row': join_fields.index, 'pos': join_fields.groupby(level=0).cumcount().to_numpy() + 1})
+
+    df_fields = (pd.concat([df_source, df_join], ignore_index=True)
+                 .sort_values(['row', 'pos'], kind='stable')
+                 .drop_duplicates(['table', 'field']))
+    return df_fields.groupby('table', sort=False)['field'].agg(tuple).to_dict()
+
+
+def apply_template_projection(dfeccmapping, template_path):
+    """
+    Project the ECC mapping onto the template headers and rebuild the SAP
+    field list per source table. When the template cannot be read the full
+    mapping is used.
+    """
+    dicResult = {} #Function Result Dictionary
+    try:
+        dicResult['iserror'] = False
+        try:
+            dictTemplateHeaders = read_template_headers(template_path)
+        except Exception as e:
+            logger.warning(f"Could not read template headers from {template_path}, extracting all mapped fields: {e}")
+            dictTemplateHeaders = None
+
+        df_projected = dfeccmapping if dictTemplateHeaders is None else project_ecc_mapping(dfeccmapping, dictTemplateHeaders)
+        ecc_dict = build_ecc_field_list(df_projected)
+        logger.info(f"Projection: extracting {sum(len(lstFields) for lstFields in ecc_dict.values())} fields from {len(ecc_dict)} tables "
+                    f"({len(df_projected)} of {len(dfeccmapping)} mapping rows).")
+
+        dicResult['value'] = ecc_dict
+        dicResult['mapping_df'] = df_projected
+
+    except Exception as e:
+        dicResult['iserror'] = True
+        dicResult['error'] = "Unhandled Error in Template Projection."
+        dicResult['error_details'] = dicResult['error']  + " | " + str(e)
+
+    return dicResult
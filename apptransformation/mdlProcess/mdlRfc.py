@@ -0,0 +1,46 @@
+# pyrfc connection and exception types for the extraction modules. pyrfc needs
+# the SAP NW RFC SDK; where it is not installed (offline benchmarks and tests
+# against mdlFakeSap) stand-ins with the same names and constructor arguments
+# are used, and opening a real connection fails.
+try:
+    from pyrfc import Connection, RFCError, RFCLibError, ABAPApplicationError, ABAPRuntimeError, CommunicationError, LogonError
+    PYRFC_AVAILABLE = True
+except ImportError:
+    PYRFC_AVAILABLE = False
+
+    class RFCError(Exception):
+        pass
+
+    class RFCLibError(RFCError):
+        def __init__(self, message=None, code=None, key=None, msg_class=None, msg_type=None, msg_number=None,
+                     msg_v1=None, msg_v2=None, msg_v3=None, msg_v4=None):
+            super().__init__(message)
+            self.message = message
+            self.code = code
+            self.key = key
+            self.msg_class = msg_class
+            self.msg_type = msg_type
+            self.msg_number = msg_number
+            self.msg_v1 = msg_v1
+            self.msg_v2 = msg_v2
+            self.msg_v3 = msg_v3
+            self.msg_v4 = msg_v4
+
+        def __str__(self):
+            return f"(rc={self.code}): key={self.key}, message={self.message}"
+
+    class ABAPApplicationError(RFCLibError):
+        pass
+
+    class ABAPRuntimeError(RFCLibError):
+        pass
+
+    class CommunicationError(RFCLibError):
+        pass
+
+    class LogonError(RFCLibError):
+        pass
+
+    class Connection:
+        def __init__(self, **connection_params):
+            raise RFCError("pyrfc is not installed: install pyrfc and the SAP NW RFC SDK to connect to SAP.")
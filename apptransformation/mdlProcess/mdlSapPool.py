@@ -0,0 +1,187 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from .mdlRfc import Connection, CommunicationError, LogonError
+from .logger import Logger
+
+
+logger = Logger.get_logger()
+
+SAP_POOL_MAX_SIZE = 3  # Default connections in use at once per SAP host
+SAP_HOST_CONNECTION_BUDGET = {}  # ashost -> connections in use at once, overrides SAP_POOL_MAX_SIZE
+SAP_POOL_IDLE_TIMEOUT = 300  # Seconds before an idle connection is closed
+SAP_POOL_PING_AFTER = 30  # Seconds idle before a connection is pinged on checkout
+SAP_POOL_REAP_INTERVAL = 60  # Seconds between sweeps of the reaper thread that closes idle connections
+
+
+class SapConnectionPool:
+    """
+    Pool of pyrfc connections for one set of connection parameters.
+    Connections are health checked on checkout and closed once idle too long,
+    by a daemon reaper thread so that SAP sessions are released when traffic
+    stops. All pools for the same SAP host share that host's connection budget.
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+    _host_slots = {}
+    _reaper = None
+    _reaper_stop = threading.Event()
+
+    def __init__(self, connection_params, idle_timeout=SAP_POOL_IDLE_TIMEOUT, connection_factory=Connection):
+        self.connection_params = dict(connection_params)
+        self.host = self.connection_params.get('ashost') or self.connection_params.get('mshost')
+        self.max_size = get_host_connection_budget(self.connection_params)
+        self.idle_timeout = idle_timeout
+        self.connection_factory = connection_factory
+        self._idle = []  # (connection, returned_at), most recently used last
+        self._lock = threading.Lock()
+        with SapConnectionPool._pools_lock:
+            if self.host not in SapConnectionPool._host_slots:
+                SapConnectionPool._host_slots[self.host] = threading.BoundedSemaphore(self.max_size)
+            self._slots = SapConnectionPool._host_slots[self.host]
+
+    @staticmethod
+    def pool_key(connection_params):
+        return tuple(sorted((key, str(value)) for key, value in connection_params.items()))
+
+    @classmethod
+    def get_pool(cls, connection_params, **kwargs):
+        """
+        Return the shared pool for these connection parameters, creating it on first use.
+        """
+        key = cls.pool_key(connection_params)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+        if pool is None:
+            pool = cls(connection_params, **kwargs)
+            with cls._pools_lock:
+                pool = cls._pools.setdefault(key, pool)
+                cls._start_reaper()
+        return pool
+
+    @classmethod
+    def _start_reaper(cls):
+        # Called with _pools_lock held
+        if cls._reaper is None or not cls._reaper.is_alive():
+            cls._reaper_stop.clear()
+            cls._reaper = threading.Thread(target=cls._reap_idle, name="sap-pool-reaper", daemon=True)
+            cls._reaper.start()
+
+    @classmethod
+    def _reap_idle(cls):
+        while not cls._reaper_stop.wait(SAP_POOL_REAP_INTERVAL):
+            with cls._pools_lock:
+                pools = list(cls._pools.values())
+            for pool in pools:
+                try:
+                    pool.close_idle()
+                except Exception as e:
+                    logger.warning(f"Error while closing idle SAP connections to {pool.host}: {e}")
+
+    @classmethod
+    def close_all_pools(cls):
+        cls._reaper_stop.set()
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close_all()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a live connection for the duration of the with block.
+        A connection that failed with a communication or logon error is dropped
+        instead of being returned to the pool.
+        """
+        self._slots.acquire()
+        conn = None
+        broken = False
+        try:
+            conn = self._checkout()
+            yield conn
+        except (CommunicationError, LogonError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self._checkin(conn, broken)
+            self._slots.release()
+
+    def _checkout(self):
+        self.close_idle()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+
+            if self._is_healthy(conn, time.monotonic() - returned_at):
+                return conn
+            self._close(conn)
+
+        logger.info(f"Opening new SAP connection to {self.host}")
+        return self.connection_factory(**self.connection_params)
+
+    def _checkin(self, conn, broken=False):
+        if broken or not getattr(conn, 'alive', True):
+            self._close(conn)
+            return
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def _is_healthy(self, conn, idle_seconds):
+        if not getattr(conn, 'alive', True):
+            return False
+        if idle_seconds < SAP_POOL_PING_AFTER:
+            return True
+        try:
+            conn.ping()
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding stale SAP connection to {self.host}: {e}")
+            return False
+
+    def close_idle(self):
+        """
+        Close connections that have been idle longer than the idle timeout.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [conn for conn, returned_at in self._idle if now - returned_at > self.idle_timeout]
+            self._idle = [(conn, returned_at) for conn, returned_at in self._idle if now - returned_at <= self.idle_timeout]
+        for conn in expired:
+            self._close(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle = [conn for conn, _ in self._idle]
+            self._idle = []
+        for conn in idle:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Error while closing SAP connection: {e}")
+
+
+def get_host_connection_budget(connection_params):
+    """
+    Number of connections that may be in use at once against this SAP host.
+    """
+    host = connection_params.get('ashost') or connection_params.get('mshost')
+    return SAP_HOST_CONNECTION_BUDGET.get(host, SAP_POOL_MAX_SIZE)
+
+
+def get_sap_connection(connection_params):
+    """
+    Check out a pooled SAP connection: `with get_sap_connection(params) as conn:`
+    """
+    return SapConnectionPool.get_pool(connection_params).connection()
+
+
+atexit.register(SapConnectionPool.close_all_pools)
@@ -0,0 +1,193 @@
+import atexit
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+from .logger import Logger
+
+
+logger = Logger.get_logger()
+
+SPILL_DIR = os.path.join("cache", "spill")
+EXTRACTION_MEMORY_BUDGET = 512 * 1024 ** 2  # Default bytes of decoded pages one read keeps in memory before spilling
+SPILL_FILE_MAX_AGE = 24 * 60 * 60  # Seconds before a left-over spill file of a crashed process is removed
+
+_spill_files = []  # Spill files of this process not yet removed
+_released_spill_files = []  # Closed spill files that could not be removed yet (still mapped on Windows)
+_spill_files_lock = threading.Lock()
+
+
+class SpillBuffer:
+    """
+    Collects the decoded RFC pages of one read as Arrow tables. Once they take
+    more than the memory budget they are written to an Arrow IPC file, and
+    every later page is appended there instead of being held in RAM. The
+    result of a spilled read is memory-mapped from that file, so its columns
+    are Arrow-backed and live in the page cache rather than the heap.
+    Use it as a context manager, or call close(), to remove the file once
+    the result has been built.
+    """
+
+    def __init__(self, memory_budget=EXTRACTION_MEMORY_BUDGET, name='extract', spill_dir=SPILL_DIR):
+        self.memory_budget = memory_budget
+        self.name = name
+        self.spill_dir = spill_dir
+        self.path = None
+        self._pages = []
+        self._bytes = 0
+        self._rows = 0
+        self._schema = None
+        self._writer = None
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    @property
+    def rows(self):
+        return self._rows
+
+    def append(self, table):
+        """
+        Add one decoded page. All pages of a read have the same string columns.
+        """
+        if self._schema is None:
+            self._schema = table.schema
+        elif table.schema != self._schema:
+            table = table.select(self._schema.names).cast(self._schema)
+        self._rows += table.num_rows
+
+        if self._writer is not None:
+            self._writer.write_table(table)
+            return
+
+        self._pages.append(table)
+        self._bytes += table.nbytes
+        if self.memory_budget is not None and self._bytes > self.memory_budget:
+            self._spill()
+
+    def _spill(self):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.path = os.path.join(self.spill_dir, f"{self.name.replace('/', '#')}_{os.getpid()}_{uuid.uuid4().hex[:8]}.arrow")
+        with _spill_files_lock:
+            _spill_files.append(self.path)
+        logger.info(f"Spilling {self.name} to {self.path} after {self._rows} rows ({self._bytes / 1024 ** 2:.0f} MB in memory).")
+
+        self._writer = pa.ipc.new_file(self.path, self._schema)
+        for table in self._pages:
+            self._writer.write_table(table)
+        self._pages = []
+        self._bytes = 0
+
+    def to_table(self, columns):
+        """
+        The collected rows as one Arrow table, memory-mapped from the spill
+        file when the read spilled.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            table = pa.ipc.open_file(pa.memory_map(self.path, 'r')).read_all()
+            logger.info(f"Memory-mapped {table.num_rows} spilled rows of {self.name} from {self.path}.")
+            return table
+
+        if not self._pages:
+            return pa.table({name: pa.array([], pa.string()) for name in columns}) if self._schema is None else self._schema.empty_table()
+        table = pa.concat_tables(self._pages)
+        self._pages = []
+        return table
+
+    def to_dataframe(self, columns):
+        """
+        The collected rows as a DataFrame (see table_to_dataframe).
+        """
+        return table_to_dataframe(self.to_table(columns), self.memory_budget)
+
+    def close(self):
+        """
+        Remove the spill file. A DataFrame returned by to_dataframe stays valid:
+        on POSIX the mapping outlives the unlinked file, and on Windows, where a
+        mapped file cannot be removed, it is removed by the next
+        remove_spill_files call after the DataFrame is released.
+        """
+        self._pages = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.path is None:
+            return
+        with _spill_files_lock:
+            if self.path in _spill_files:
+                _spill_files.remove(self.path)
+        if not _remove_file(self.path):
+            with _spill_files_lock:
+                _released_spill_files.append(self.path)
+        self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def table_to_dataframe(table, memory_budget=EXTRACTION_MEMORY_BUDGET):
+    """
+    Convert an Arrow table to a DataFrame: object columns as usual when it
+    fits in the memory budget, Arrow-backed columns sharing the table's
+    buffers (and its memory map) when it does not.
+    """
+    if memory_budget is not None and table.nbytes > memory_budget:
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return pd.DataFrame({name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names},
+                        columns=table.column_names)
+
+
+def dataframe_to_table(df):
+    """
+    Convert a DataFrame to an Arrow table for writing; Arrow-backed columns
+    are passed on without a copy.
+    """
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError:
+        return False
+
+
+def remove_spill_files(max_age=None, spill_dir=SPILL_DIR):
+    """
+    Remove the closed spill files that could not be removed before, and also
+    this process's other spill files, or with max_age every spill file older
+    than that many seconds (left over by a crashed process). Files still
+    mapped (on Windows) are left for a later call.
+    """
+    with _spill_files_lock:
+        lstPaths = list(_released_spill_files)
+        _released_spill_files.clear()
+        if max_age is None:
+            lstPaths += _spill_files
+            _spill_files.clear()
+
+    if max_age is not None and os.path.isdir(spill_dir):
+        cutoff = time.time() - max_age
+        lstPaths += [os.path.join(spill_dir, file_name) for file_name in os.listdir(spill_dir)
+                     if os.path.getmtime(os.path.join(spill_dir, file_name)) < cutoff]
+
+    lstKept = [path for path in dict.fromkeys(lstPaths) if not _remove_file(path)]
+    if lstKept and max_age is not None:
+        with _spill_files_lock:
+            _released_spill_files.extend(path for path in lstKept if path not in _released_spill_files)
+
+
+# Backstop for spill files of reads that never closed their buffer
+atexit.register(remove_spill_files)
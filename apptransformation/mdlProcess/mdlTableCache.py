@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow.parquet as pq
+from .logger import Logger
+from .mdlSpill import dataframe_to_table, table_to_dataframe
+
+
+logger = Logger.get_logger()
+
+TABLE_CACHE_DIR = os.path.join("cache", "sap_tables")
+TABLE_CACHE_TTL = 8 * 60 * 60  # Seconds a cached table stays valid
+TABLE_CACHE_MAX_BYTES = 20 * 1024 ** 3  # Disk budget before least recently used tables are evicted
+SNAPSHOT_TTL = 30 * 24 * 60 * 60  # Seconds a snapshot with a delta watermark is kept for delta merges
+DELTA_WATERMARK_OVERLAP_DAYS = 1  # Re-read this many days before the last extraction to cover SAP server time zones
+
+# Delta reads only see created and changed rows, so rows deleted in SAP stay in
+# a merged snapshot; a full extraction this many days after the last one drops
+# them. Overridden per table by ECC_Delta_Config.FullRefreshDays.
+DELTA_FULL_REFRESH_DAYS = 7
+
+
+class SapTableCache:
+    """
+    On-disk Parquet cache of extracted SAP tables, keyed by SAP system,
+    client, user, table, field set and row filter. Every entry is a Parquet file plus a
+    small JSON sidecar holding its metadata, so several processes can share
+    one cache directory. Entries stored with a delta watermark are kept past
+    the TTL as snapshots that delta extractions are merged into.
+    """
+
+    def __init__(self, cache_dir=TABLE_CACHE_DIR, ttl=TABLE_CACHE_TTL, max_bytes=TABLE_CACHE_MAX_BYTES, snapshot_ttl=SNAPSHOT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.snapshot_ttl = snapshot_ttl
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(connection_params, tbl, lstFields, lstConditions=None):
+        parts = [
+            str(connection_params.get('ashost') or connection_params.get('mshost') or ''),
+            str(connection_params.get('sysnr', '')),
+            str(connection_params.get('client', '')),
+            str(connection_params.get('user', '')).upper(),
+            tbl.upper(),
+            ",".join(sorted(set(lstFields))),
+            " AND ".join(lstConditions or []),
+        ]
+        return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()
+
+    def _data_path(self, key):
+        return os.path.join(self.cache_dir, key + ".parquet")
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        tmp_path = self._meta_path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(key))
+
+    def _is_expired(self, meta, now):
+        ttl = self.snapshot_ttl if meta.get('watermark') else self.ttl
+        return now - meta['created'] > ttl
+
+    def _remove(self, key):
+        for path in (self._data_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def contains(self, connection_params, tbl, lstFields, lstConditions=None):
+        """
+        True when a fresh entry exists, without loading it.
+        """
+        key = self.make_key(connection_params, tbl, lstFields, lstConditions)
+        meta = self._read_meta(key)
+        return meta is not None and time.time() - meta['created'] <= self.ttl and os.path.isfile(self._data_path(key))
+
+    def get(self, connection_params, tbl, lstFields, lstConditions=None):
+        """
+        Return the cached DataFrame, or None when it is missing or older than the TTL.
+        """
+        key = self.make_key(connection_params, tbl, lstFields, lstConditions)
+        try:
+            meta = self._read_meta(key)
+            if meta is None or not os.path.isfile(self._data_path(key)):
+                return None
+            if time.time() - meta['created'] > self.ttl:
+                logger.info(f"Cached table {tbl} expired, extracting again.")
+                if self._is_expired(meta, time.time()):
+                    self._remove(key)
+                return None
+
+            df = table_to_dataframe(pq.read_table(self._data_path(key), memory_map=True))
+            meta['last_access'] = time.time()
+            self._write_meta(key, meta)
+            logger.info(f"Loaded table {tbl} ({len(df)} rows) from cache.")
+            return df
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry for table {tbl}: {e}")
+            return None
+
+    def get_snapshot(self, connection_params, tbl, lstFields, lstConditions=None):
+        """
+        Return (DataFrame, metadata) of a snapshot with a delta watermark, even
+        past the TTL, or (None, None) when there is no usable snapshot.
+        """
+        key = self.make_key(connection_params, tbl, lstFields, lstConditions)
+        try:
+            meta = self._read_meta(key)
+            if meta is None or not meta.get('watermark') or not os.path.isfile(self._data_path(key)):
+                return None, None
+            if self._is_expired(meta, time.time()):
+                self._remove(key)
+                return None, None
+            return table_to_dataframe(pq.read_table(self._data_path(key), memory_map=True)), meta
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot for table {tbl}: {e}")
+            return None, None
+
+    def put(self, connection_params, tbl, lstFields, df, watermark=None, key_fields=None, lstConditions=None, full_refresh=None):
+        """
+        Store a freshly extracted DataFrame and evict down to the byte budget.
+        A watermark (YYYYMMDD) and the key fields make the entry usable as a
+        snapshot for later delta extractions. full_refresh is the time of the
+        last full extraction the entry derives from, now when not given.
+        """
+        key = self.make_key(connection_params, tbl, lstFields, lstConditions)
+        try:
+            tmp_path = self._data_path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            pq.write_table(dataframe_to_table(df), tmp_path)
+            os.replace(tmp_path, self._data_path(key))
+
+            now = time.time()
+            self._write_meta(key, {
+                'table': tbl,
+                'ashost': connection_params.get('ashost') or connection_params.get('mshost'),
+                'client': connection_params.get('client'),
+                'fields': sorted(set(lstFields)),
+                'conditions': list(lstConditions or []),
+                'rows': len(df),
+                'bytes': os.path.getsize(self._data_path(key)),
+                'created': now,
+                'last_access': now,
+                'watermark': watermark,
+                'key_fields': list(key_fields or []),
+                'full_refresh': now if full_refresh is None else full_refresh,
+            })
+            self.evict()
+        except Exception as e:
+            logger.warning(f"Could not cache table {tbl}: {e}")
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones until the
+        cache fits in max_bytes.
+        """
+        with self._lock:
+            now = time.time()
+            entries = []
+            for file_name in os.listdir(self.cache_dir):
+                if not file_name.endswith(".json"):
+                    continue
+                key = file_name[:-len(".json")]
+                meta = self._read_meta(key)
+                if meta is None or self._is_expired(meta, now):
+                    self._remove(key)
+                    continue
+                entries.append((meta['last_access'], meta['bytes'], key, meta['table']))
+
+            total_bytes = sum(entry[1] for entry in entries)
+            for last_access, size, key, tbl in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                logger.info(f"Evicting cached table {tbl} ({size} bytes).")
+                self._remove(key)
+                total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(".json"):
+                    self._remove(file_name[:-len(".json")])
+
+
+def get_delta_watermark():
+    """
+    Watermark for an extraction starting now, as a SAP date (YYYYMMDD).
+    """
+    return (datetime.now() - timedelta(days=DELTA_WATERMARK_OVERLAP_DAYS)).strftime("%Y%m%d")
+
+
+def is_full_refresh_due(snapshot_meta, full_refresh_days=DELTA_FULL_REFRESH_DAYS):
+    """
+    True when the last full extraction behind a snapshot is older than
+    full_refresh_days, so that the table is extracted in full instead of
+    merging another delta.
+    """
+    full_refresh = snapshot_meta.get('full_refresh')
+    return full_refresh is None or time.time() - full_refresh > full_refresh_days * 24 * 60 * 60
+
+
+def merge_delta(snapshot_df, delta_df, key_fields):
+    """
+    Upsert delta rows into a snapshot by primary key; a changed row replaces
+    its snapshot version. Rows deleted in SAP are not in the delta and stay
+    until the periodic full extraction (see DELTA_FULL_REFRESH_DAYS).
+    """
+    if delta_df.empty:
+        return snapshot_df
+    # A snapshot over the memory budget is Arrow-backed; the delta takes its dtypes so the merge stays Arrow-backed too
+    merged_df = pd.concat([snapshot_df, delta_df[snapshot_df.columns].astype(snapshot_df.dtypes.to_dict())], ignore_index=True)
+    return merged_df.drop_duplicates(subset=key_fields, keep='last').reset_index(drop=True)
+
+
+_table_cache = None
+_table_cache_lock = threading.Lock()
+
+
+def get_table_cache():
+    """
+    Return the process-wide table cache.
+    """
+    global _table_cache
+    with _table_cache_lock:
+        if _table_cache is None:
+            _table_cache = SapTableCache()
+        return _table_cache
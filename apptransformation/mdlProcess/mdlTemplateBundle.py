@@ -0,0 +1,145 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import text
+from .logger import Logger
+from .mdlDbPool import SqlEngineRegistry, sql_table_exists
+
+
+logger = Logger.get_logger()
+
+TEMPLATE_BUNDLE_DIR = os.path.join("cache", "template_bundles")
+TEMPLATE_BUNDLE_VERIFY_INTERVAL = 60  # Seconds a bundle is used without checking the database for changes
+TEMPLATE_BUNDLE_FORMAT = 3  # Bump when the bundle layout changes
+
+# Compiled metadata of one (template, LTMC version, client); shared between runs, so treat it as read-only
+TemplateBundle = namedtuple('TemplateBundle', ['details', 'mapping_df', 'ecc_dict', 'filters', 'delta_config', 'rules', 'checksum'])
+
+# One round trip: row count and aggregate checksum of every source the bundle is compiled from
+_BUNDLE_CHECKSUM_SQL = """
+    WITH [Template] AS (
+        SELECT [TemplateID] FROM [tblTransformationMaster]
+        WHERE [LTMCVersion] = :saptemversion AND [TemplateName] = :templatename
+    )
+    SELECT
+        (SELECT COUNT(*) FROM [tblTransformationMaster] WHERE [LTMCVersion] = :saptemversion AND [TemplateName] = :templatename),
+        (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM [tblTransformationMaster] WHERE [LTMCVersion] = :saptemversion AND [TemplateName] = :templatename),
+        (SELECT COUNT(*) FROM [ECC_Field_Mapping] WHERE [TemplateID] IN (SELECT [TemplateID] FROM [Template])),
+        (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM [ECC_Field_Mapping] WHERE [TemplateID] IN (SELECT [TemplateID] FROM [Template])),
+        {filter_checksum},
+        {delta_checksum},
+        (SELECT COUNT(*) FROM [INNOVAPTE].[dbo].[ConditionalRules] WHERE [ClientID] = :clientid),
+        (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM [INNOVAPTE].[dbo].[ConditionalRules] WHERE [ClientID] = :clientid)
+"""
+_FILTER_CHECKSUM_SQL = """(SELECT COUNT(*) FROM [ECC_Extraction_Filter] WHERE [TemplateID] IN (SELECT [TemplateID] FROM [Template])),
+        (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM [ECC_Extraction_Filter] WHERE [TemplateID] IN (SELECT [TemplateID] FROM [Template]))"""
+_DELTA_CHECKSUM_SQL = """(SELECT COUNT(*) FROM [ECC_Delta_Config]),
+        (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM [ECC_Delta_Config])"""
+# A missing optional table gives NULL columns, so creating it invalidates the bundle
+_BUNDLE_CHECKSUM_QUERIES = {
+    (has_filters, has_delta): text(_BUNDLE_CHECKSUM_SQL.format(filter_checksum=_FILTER_CHECKSUM_SQL if has_filters else "NULL, NULL",
+                                                               delta_checksum=_DELTA_CHECKSUM_SQL if has_delta else "NULL, NULL"))
+    for has_filters in (True, False) for has_delta in (True, False)
+}
+
+
+def query_bundle_checksum(engine, saptemversion, templatename, clientid):
+    """
+    Checksum of the database rows behind a template bundle; any insert,
+    update or delete changes it.
+    """
+    with engine.connect() as conn:
+        query = _BUNDLE_CHECKSUM_QUERIES[(sql_table_exists(conn, 'ECC_Extraction_Filter'), sql_table_exists(conn, 'ECC_Delta_Config'))]
+        row = conn.execute(query, {"saptemversion": saptemversion, "templatename": templatename, "clientid": clientid}).fetchone()
+    return tuple(row)
+
+
+class TemplateBundleCache:
+    """
+    Template bundles kept in memory and pickled to disk, so that a new
+    process starts warm. A bundle is trusted for the verify interval and then
+    revalidated with a single checksum query.
+    """
+
+    def __init__(self, cache_dir=TEMPLATE_BUNDLE_DIR, verify_interval=TEMPLATE_BUNDLE_VERIFY_INTERVAL):
+        self.cache_dir = cache_dir
+        self.verify_interval = verify_interval
+        self._memory = {}  # key -> (bundle, checked_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(server, database, username, password, saptemversion, templatename, clientid):
+        # The login selects what the database returns (default schema, permissions), so it is part of the key like the database
+        parts = [*SqlEngineRegistry.engine_key(server, database, username, password), str(saptemversion), str(templatename), str(clientid).lower()]
+        return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def get(self, key):
+        """
+        Return (bundle, checked_at) from memory or disk, or (None, None).
+        """
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = pickle.load(f)
+            if entry.get('format') != TEMPLATE_BUNDLE_FORMAT:
+                return None, None
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            # Truncated, or pickled by another version of the code: a cache miss
+            logger.warning(f"Discarding unreadable template bundle {key}: {e}")
+            self.invalidate(key)
+            return None, None
+        # Loaded from disk: revalidate before first use
+        with self._lock:
+            self._memory[key] = (entry['bundle'], 0.0)
+        return entry['bundle'], 0.0
+
+    def is_fresh(self, checked_at):
+        return time.time() - checked_at <= self.verify_interval
+
+    def touch(self, key, bundle):
+        with self._lock:
+            self._memory[key] = (bundle, time.time())
+
+    def put(self, key, bundle):
+        self.touch(key, bundle)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'format': TEMPLATE_BUNDLE_FORMAT, 'bundle': bundle}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            logger.warning(f"Could not write template bundle to disk: {e}")
+
+    def invalidate(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+_template_bundle_cache = None
+_template_bundle_cache_lock = threading.Lock()
+
+
+def get_template_bundle_cache():
+    """
+    Return the process-wide template bundle cache.
+    """
+    global _template_bundle_cache
+    with _template_bundle_cache_lock:
+        if _template_bundle_cache is None:
+            _template_bundle_cache = TemplateBundleCache()
+        return _template_bundle_cache
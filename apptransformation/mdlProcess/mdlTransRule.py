@@ -1,4 +1,41 @@
 import re
+import pandas as pd
+from .mdlDtypes import sap_text
+
+# Pipe-delimited ConditionalRules columns and the rule_info key each one fills
+RULE_PARAMETER_COLUMNS = {'Format': 'format', 'Custome1': 'custom1', 'Custome2': 'custom2', 'Custome3': 'custom3'}
+
+
+def compile_rule_dict(df):
+    """
+    Turn ConditionalRules rows into {TargetTable: {TargetField: [rule_info, ...]}}.
+    RuleName and the parameter columns are pipe-delimited in parallel: the
+    i-th rule name takes the i-th value of every parameter column, or ''.
+    """
+    def split_long(column):
+        # One row per pipe-delimited value, indexed by (rule row, position)
+        values = df[column].where(df[column].notna(), '').astype(str).str.split('|').explode()
+        return pd.Series(values.str.strip().to_numpy(), index=pd.MultiIndex.from_arrays([values.index, values.groupby(level=0).cumcount()]))
+
+    df = df.reset_index(drop=True)
+    rule_names = split_long('RuleName')
+    rule_names = rule_names[rule_names != '']
+
+    df_rules = pd.DataFrame({
+        'table': df['TargetTable'].to_numpy()[rule_names.index.get_level_values(0)],
+        'field': df['TargetField'].to_numpy()[rule_names.index.get_level_values(0)],
+        'rule_name': rule_names.to_numpy(),
+    })
+    for column, key in RULE_PARAMETER_COLUMNS.items():
+        df_rules[key] = split_long(column).reindex(rule_names.index).fillna('').to_numpy()
+
+    # Rows are already in rule row and position order, which is the order rules are applied in
+    rules_dict = {}
+    for table, field, rule_name, rule_format, custom1, custom2, custom3 in zip(
+            df_rules['table'], df_rules['field'], df_rules['rule_name'], df_rules['format'], df_rules['custom1'], df_rules['custom2'], df_rules['custom3']):
+        rules_dict.setdefault(table, {}).setdefault(field, []).append(
+            {'rule_name': rule_name, 'format': (rule_format,), 'custom1': (custom1,), 'custom2': (custom2,), 'custom3': (custom3,)})
+    return rules_dict
 
 # REPLACE_FIELD_WITH_VALUE
 def replace_field_with_value(df, field_name, new_value):
@@ -23,7 +60,7 @@ def replace_value_case_insensitive(df, field_name, old_value, new_value):
         dicResult['iserror'] = False
 
         # Convert everything to string first (safe replacement)
-        df[field_name] = df[field_name].astype(str).apply(
+        df[field_name] = sap_text(df[field_name]).astype(str).apply(
             lambda x: new_value if x.strip().lower() == str(old_value).strip().lower() else x
         )
 
@@ -41,7 +78,7 @@ def replace_value(df, field_name, old_value, new_value):
         dicResult['iserror'] = False
 
         # Replace old_value with new_value in the given column (vectorized)
-        df[field_name] = df[field_name].replace(old_value, new_value)
+        df[field_name] = sap_text(df[field_name]).replace(old_value, new_value)
 
     except Exception as e:
         dicResult['iserror'] = True
@@ -59,9 +96,9 @@ def add_prefix_suffix(df, field_name, affix, position='LEFT'):
         dicResult['iserror'] = False
 
         if position == 'LEFT':
-            df[field_name] = affix + df[field_name].astype(str)
+            df[field_name] = affix + sap_text(df[field_name]).astype(str)
         else:
-            df[field_name] = df[field_name].astype(str) + affix
+            df[field_name] = sap_text(df[field_name]).astype(str) + affix
 
     except (ValueError, TypeError) as e:
         dicResult['iserror'] = True
@@ -76,7 +113,7 @@ def strip_whitespace(df, field_name):
         dicResult['iserror'] = False
 
         # Strip leading and trailing whitespace (vectorized)
-        df[field_name] = df[field_name].astype(str).str.strip()
+        df[field_name] = sap_text(df[field_name]).astype(str).str.strip()
 
     except Exception as e:
         dicResult['iserror'] = True
@@ -103,7 +140,7 @@ def zero_pad_field(df, field_name, max_length):
             return dicResult
         
         # Perform zero padding
-        df[field_name] = df[field_name].astype(str).str.zfill(max_length)
+        df[field_name] = sap_text(df[field_name]).astype(str).str.zfill(max_length)
         
     except (ValueError, TypeError) as e:
         dicResult['iserror'] = True
@@ -128,7 +165,7 @@ def remove_special_characters(df, field_name, allowed_chars=""):
 
         # Apply regex replacement to remove unwanted characters
          # Vectorized operation
-        df[field_name] = df[field_name].astype(str).str.replace(pattern, '', regex=True)
+        df[field_name] = sap_text(df[field_name]).astype(str).str.replace(pattern, '', regex=True)
 
     except Exception as e:
         dicResult['iserror'] = True
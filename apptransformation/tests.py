@@ -1,3 +1,1151 @@
-from django.test import TestCase
+import inspect
+import os
+import tempfile
+import threading
+from unittest import mock
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from .mdlProcess import mdlMain, mdlMapping
+from .mdlProcess.mdlBenchmark import (generate_mapping_metadata, legacy_ecc_field_list, legacy_rule_dict, run_extraction_benchmark, run_metadata_benchmark,
+                                      write_blank_template)
+from .mdlProcess.mdlCheckpoint import RunCheckpoint
+from .mdlProcess.mdlDbPool import SqlEngineRegistry
+from .mdlProcess.mdlDtypes import CATEGORY_MIN_ROWS, compact_sap_dtypes, to_output_frame
+from .mdlProcess.mdlEnum import Extraction_mode, Join_policy
+from .mdlProcess.mdlExtraction import (RFC_OPTION_LINE_LENGTH, RFC_WA_LENGTH, KeyRange, build_filter_condition, build_key_range_condition,
+                                       build_rfc_options, compile_delta_config, compile_extraction_filters, decode_wa_rows, estimate_table_sizes,
+                                       get_data_from_sap_table_1, merge_key_ranges, plan_field_chunks, plan_key_ranges, read_field_chunk,
+                                       stitch_field_chunks)
+from .mdlProcess.mdlFakeSap import FakeSapConnection, FakeSapSystem, install_fake_sap
+from .mdlProcess.mdlJoinIndex import JoinIndexCache, join_target_keys, lookup_join_positions, predict_join_rows, take_join_column
+from .mdlProcess.mdlMapping import add_columns, compile_join_plan, describe_join_plan, execute_join_plan, missing_column, table_mapping_parallel
+from .mdlProcess.mdlMetadata import SapMetadataCache
+from .mdlProcess.mdlMetadataStore import SqliteMetadataStore, SqlServerMetadataStore
+from .mdlProcess.mdlProjection import apply_template_projection, build_ecc_field_list, project_ecc_mapping, read_template_headers
+from .mdlProcess.mdlRfc import ABAPApplicationError, CommunicationError
+from .mdlProcess.mdlSapPool import SapConnectionPool, get_sap_connection
+from .mdlProcess.mdlSpill import EXTRACTION_MEMORY_BUDGET, SpillBuffer
+from .mdlProcess.mdlTableCache import DELTA_FULL_REFRESH_DAYS, SapTableCache
+from .mdlProcess.mdlTemplateBundle import TEMPLATE_BUNDLE_FORMAT, TemplateBundleCache, query_bundle_checksum
+from .mdlProcess.mdlTransRule import add_prefix_suffix, compile_rule_dict
+
+
+class RfcOptionsTests(SimpleTestCase):
+
+    def test_conditions_are_anded_in_parentheses(self):
+        lstOptions = build_rfc_options(["BUKRS = '1000'", "", "GJAHR >= '2020'"])
+        self.assertEqual(" ".join(line['TEXT'] for line in lstOptions), "( BUKRS = '1000' ) AND ( GJAHR >= '2020' )")
+
+    def test_lines_fit_option_length_and_keep_literals_whole(self):
+        values = ", ".join(f"'VALUE {idx:03d}'" for idx in range(40))
+        lstOptions = build_rfc_options([f"MATNR IN ( {values} )"])
+        self.assertGreater(len(lstOptions), 1)
+        for line in lstOptions:
+            self.assertLessEqual(len(line['TEXT']), RFC_OPTION_LINE_LENGTH)
+            self.assertEqual(line['TEXT'].count("'") % 2, 0)
+        self.assertEqual(" ".join(line['TEXT'] for line in lstOptions), f"MATNR IN ( {values} )")
+
+    def test_quotes_in_range_bounds_are_escaped(self):
+        self.assertEqual(build_key_range_condition('NAME1', ("O'Brien", None)), ["NAME1 >= 'O''Brien'"])
+        self.assertEqual(build_key_range_condition('NAME1', KeyRange(None, 'B', 10)), ["NAME1 < 'B'"])
+
+    def test_no_conditions_give_no_options(self):
+        self.assertEqual(build_rfc_options([]), [])
+
+
+class WaDecoderTests(SimpleTestCase):
+
+    def test_fields_are_sliced_by_offset(self):
+        fields = [{'FIELDNAME': 'MATNR', 'OFFSET': '000000', 'LENGTH': '000006', 'TYPE': 'C'},
+                  {'FIELDNAME': 'MENGE', 'OFFSET': '000007', 'LENGTH': '000008', 'TYPE': 'P'},
+                  {'FIELDNAME': 'MAKTX', 'OFFSET': '000016', 'LENGTH': '000006', 'TYPE': 'C'}]
+        data_rows = ["A|B   |  1.500-| x|y", "C     |   2.000|"]
+        df = decode_wa_rows(data_rows, fields)
+        self.assertEqual(list(df.columns), ['MATNR', 'MENGE', 'MAKTX'])
+        self.assertEqual(df['MATNR'].tolist(), ['A|B', 'C'])
+        self.assertEqual(df['MENGE'].tolist(), ['1.500-', '2.000'])
+        self.assertEqual(df['MAKTX'].tolist(), [' x|y', ''])
+
+    def test_arrow_strings(self):
+        fields = [{'FIELDNAME': 'KUNNR', 'OFFSET': '000000', 'LENGTH': '000010', 'TYPE': 'C'}]
+        df = decode_wa_rows(["0000001000"], fields, arrow_strings=True)
+        self.assertIsInstance(df['KUNNR'].dtype, pd.ArrowDtype)
+        self.assertEqual(df['KUNNR'].tolist(), ['0000001000'])
+
+    def test_short_lines_decode_to_empty_values(self):
+        # SAP drops the trailing blanks of a WA line, so later fields can be missing altogether
+        fields = [{'FIELDNAME': 'MATNR', 'OFFSET': '000000', 'LENGTH': '000004', 'TYPE': 'C'},
+                  {'FIELDNAME': 'MAKTX', 'OFFSET': '000005', 'LENGTH': '000010', 'TYPE': 'C'}]
+        df = decode_wa_rows(["A1", "B2  |Text"], fields)
+        self.assertEqual(df['MATNR'].tolist(), ['A1', 'B2'])
+        self.assertEqual(df['MAKTX'].tolist(), ['', 'Text'])
+
+    def test_values_containing_the_delimiter_survive_a_read(self):
+        system = FakeSapSystem()
+        system.add_table('ZPIPE', [{'FIELDNAME': 'KEY1', 'LENG': 4, 'KEYFLAG': 'X'}, {'FIELDNAME': 'TEXT', 'LENG': 8}],
+                         pd.DataFrame({'KEY1': ['0001', '0002'], 'TEXT': ['a|b', '|']}))
+        df = read_field_chunk(FakeSapConnection(system), 'ZPIPE', ['KEY1', 'TEXT'])
+        self.assertEqual(df.sort_values('KEY1')['TEXT'].tolist(), ['a|b', '|'])
+
+
+class KeyRangePlanTests(SimpleTestCase):
+
+    def setUp(self):
+        self.system = FakeSapSystem()
+        self.system.generate_table('ZTEST', 1000, fields=2, key_fields=2)
+        self.connection = FakeSapConnection(self.system)
+
+    def read_table(self, key_ranges, lstConditions=None):
+        return read_field_chunk(self.connection, 'ZTEST', ['KEY1', 'KEY2', 'F001'], 'KEY1', key_ranges, lstConditions)
+
+    def test_neighbouring_ranges_are_merged_up_to_the_range_size(self):
+        key_ranges = [KeyRange(None, 'B', 40), KeyRange('B', 'C', 40), KeyRange('C', 'D', 40), KeyRange('D', 'E', None), KeyRange('E', None, 1)]
+        self.assertEqual(merge_key_ranges(key_ranges, range_size=80),
+                         [KeyRange(None, 'C', 80), KeyRange('C', 'D', 40), KeyRange('D', 'E', None), KeyRange('E', None, 1)])
+
+    def test_key_ranges_read_every_row_once(self):
+        key_ranges = plan_key_ranges(self.connection, 'ZTEST', 'KEY1', range_size=250)
+        self.assertEqual(sum(key_range.rows for key_range in key_ranges), 1000)
+        self.assertTrue(all(key_range.rows <= 250 for key_range in key_ranges))
+        self.assertEqual((key_ranges[0].low, key_ranges[-1].high), (None, None))
+        for previous, key_range in zip(key_ranges, key_ranges[1:]):
+            self.assertEqual(previous.high, key_range.low)
+        df = self.read_table(key_ranges)
+        self.assertEqual(len(df), 1000)
+        self.assertFalse(df.duplicated(['KEY1', 'KEY2']).any())
+
+    def test_planning_reads_bounded_probes_without_rowskips(self):
+        with mock.patch.object(self.connection, 'call', wraps=self.connection.call) as call_mock:
+            plan_key_ranges(self.connection, 'ZTEST', 'KEY1', range_size=100)
+        for call in call_mock.call_args_list:
+            self.assertEqual(call.kwargs.get('ROWSKIPS', 0), 0)
+            self.assertEqual(call.kwargs['ROWCOUNT'], 101)
+        # Paging 1000 rows in pages of 100 rescans the skipped rows: 100 + 200 + ... + 1000 + 1000 = 6500
+        self.assertLessEqual(self.system.stats['ZTEST']['rows_scanned'], 3000)
+
+    def test_key_ranges_respect_filters(self):
+        lstConditions = ["KEY1 >= '000000000000000005'"]
+        key_ranges = plan_key_ranges(self.connection, 'ZTEST', 'KEY1', lstConditions, range_size=250)
+        self.assertEqual(sum(key_range.rows for key_range in key_ranges), 950)
+        df = self.read_table(key_ranges, lstConditions)
+        self.assertEqual(len(df), 950)
+        self.assertTrue((df['KEY1'] >= '000000000000000005').all())
+
+    def test_a_key_value_over_the_range_size_is_not_split(self):
+        data = pd.DataFrame({'KEY1': ['A'] * 300 + ['B'] * 10, 'KEY2': [f"{idx:03d}" for idx in range(310)], 'F001': 'x'})
+        self.system.add_table('ZSKEW', [{'FIELDNAME': 'KEY1', 'LENG': 1, 'KEYFLAG': 'X'}, {'FIELDNAME': 'KEY2', 'LENG': 3, 'KEYFLAG': 'X'},
+                                        {'FIELDNAME': 'F001', 'LENG': 1}], data)
+        key_ranges = plan_key_ranges(self.connection, 'ZSKEW', 'KEY1', range_size=100)
+        self.assertIn(None, [key_range.rows for key_range in key_ranges])
+        df = read_field_chunk(self.connection, 'ZSKEW', ['KEY1', 'KEY2', 'F001'], 'KEY1', key_ranges)
+        self.assertEqual(len(df), 310)
+        self.assertFalse(df.duplicated(['KEY1', 'KEY2']).any())
+
+
+class JoinPolicyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.source_data = {
+            'ZMAIN': pd.DataFrame({'ID': ['1', '2', '3'], 'NAME': ['one', 'two', 'three']}),
+            # Key 2 appears twice
+            'ZADDR': pd.DataFrame({'ID': ['1', '2', '2', '4'], 'CITY': ['Berlin', 'Paris', 'Lyon', 'Rome']}),
+            'ZUNIQ': pd.DataFrame({'ID': ['1', '2', '3'], 'LAND': ['DE', 'FR', 'IT']}),
+        }
+
+    def mapping(self, source_table, source_field, join_policies=None):
+        rows = [{'SoruceTable': 'ZMAIN', 'SoruceField': 'ID', 'TargetTable': 'Sheet', 'TargetField': 'ID', 'IsMainTable': 1},
+                {'SoruceTable': 'ZMAIN', 'SoruceField': 'NAME', 'TargetTable': 'Sheet', 'TargetField': 'NAME', 'IsMainTable': 1}]
+        for idx, join_policy in enumerate(join_policies or [None]):
+            rows.append({'SoruceTable': source_table, 'SoruceField': source_field, 'TargetTable': 'Sheet', 'TargetField': f"{source_field}{idx or ''}",
+                         'IsMainTable': 0, 'SoruceJoinFiled': 'ID', 'TargetJoinField': 'ID', 'JoinPolicy': join_policy})
+        return pd.DataFrame(rows)
+
+    def run_mapping(self, dfmapping, join_policy=Join_policy.EnumWarn):
+        return table_mapping_parallel(dfmapping, self.source_data, num_workers=1, join_policy=join_policy)
+
+    def test_unique_keys_are_looked_up(self):
+        dicResult = self.run_mapping(self.mapping('ZUNIQ', 'LAND'))
+        self.assertFalse(dicResult['iserror'])
+        self.assertEqual(dicResult['value']['Sheet']['LAND'].tolist(), ['DE', 'FR', 'IT'])
+        self.assertEqual(dicResult['join_report'][0]['action'], 'lookup')
+
+    def test_repeated_keys_not_hit_are_merged(self):
+        self.source_data['ZMAIN'] = self.source_data['ZMAIN'][self.source_data['ZMAIN']['ID'] != '2']
+        dicResult = self.run_mapping(self.mapping('ZADDR', 'CITY'), Join_policy.EnumRefuse)
+        self.assertFalse(dicResult['iserror'])
+        self.assertEqual(dicResult['value']['Sheet']['CITY'].fillna('').tolist(), ['Berlin', ''])
+        self.assertEqual(dicResult['join_report'][0]['action'], 'merge')
+
+    def test_warn_merges_every_matching_row(self):
+        dicResult = self.run_mapping(self.mapping('ZADDR', 'CITY'), Join_policy.EnumWarn)
+        self.assertFalse(dicResult['iserror'])
+        df = dicResult['value']['Sheet']
+        self.assertEqual(df['ID'].tolist(), ['1', '2', '2', '3'])
+        self.assertEqual(df['CITY'].fillna('').tolist(), ['Berlin', 'Paris', 'Lyon', ''])
+        check = dicResult['join_report'][0]
+        self.assertEqual((check['action'], check['rows'], check['predicted_rows'], check['duplicate_keys']), ('warn', 3, 4, 1))
+
+    def test_dedupe_takes_the_first_source_row_per_key(self):
+        dicResult = self.run_mapping(self.mapping('ZADDR', 'CITY'), Join_policy.EnumDedupe)
+        self.assertFalse(dicResult['iserror'])
+        df = dicResult['value']['Sheet']
+        self.assertEqual(df['ID'].tolist(), ['1', '2', '3'])
+        self.assertEqual(df['CITY'].fillna('').tolist(), ['Berlin', 'Paris', ''])
+        self.assertEqual(dicResult['join_report'][0]['action'], 'dedupe')
+
+    def test_refuse_fails_the_target_table(self):
+        dicResult = self.run_mapping(self.mapping('ZADDR', 'CITY'), Join_policy.EnumRefuse)
+        self.assertTrue(dicResult['iserror'])
+        self.assertIn('Sheet', dicResult['table_errors'])
+        self.assertNotIn('value', dicResult)
+        self.assertEqual(dicResult['join_report'][0]['action'], 'refuse')
+
+    def test_strictest_mapping_row_policy_wins(self):
+        dicResult = self.run_mapping(self.mapping('ZADDR', 'CITY', [Join_policy.EnumWarn, 'dedupe ']), Join_policy.EnumRefuse)
+        self.assertFalse(dicResult['iserror'])
+        self.assertEqual(dicResult['value']['Sheet']['CITY1'].fillna('').tolist(), ['Berlin', 'Paris', ''])
+        self.assertEqual(dicResult['join_report'][0]['policy'], Join_policy.EnumDedupe)
+
+    def test_joins_over_the_row_limit_are_refused_unless_deduplicated(self):
+        with mock.patch('apptransformation.mdlProcess.mdlJoinIndex.JOIN_MAX_OUTPUT_ROWS', 3):
+            dicWarn = self.run_mapping(self.mapping('ZADDR', 'CITY'), Join_policy.EnumWarn)
+            dicDedupe = self.run_mapping(self.mapping('ZADDR', 'CITY'), Join_policy.EnumDedupe)
+        self.assertTrue(dicWarn['iserror'])
+        self.assertEqual(dicWarn['join_report'][0]['action'], 'refuse')
+        self.assertFalse(dicDedupe['iserror'])
+        self.assertEqual(len(dicDedupe['value']['Sheet']), 3)
+
+    def test_predicted_rows_match_the_merge(self):
+        target_df = pd.DataFrame({'ID': ['1', '2', '2', '3', '4']})
+        source_df = self.source_data['ZADDR']
+        join_index = JoinIndexCache().get('ZADDR', source_df, ['ID'])
+        self.assertEqual(predict_join_rows(join_index, join_target_keys(target_df, ['ID'])), len(target_df.merge(source_df, how='left', on='ID')))
+
+
+class SqlServerJoinPolicyTests(SimpleTestCase):
+
+    def read_mapping_query(self, has_join_policy):
+        dfmapping = pd.DataFrame({'SoruceTable': ['ZADDR'], 'JoinPolicy': ['DEDUPE']})
+        with mock.patch('apptransformation.mdlProcess.mdlMetadataStore.SqlEngineRegistry.get_engine', return_value=mock.MagicMock()), \
+                mock.patch('apptransformation.mdlProcess.mdlMetadataStore.sql_column_exists', return_value=has_join_policy) as column_exists, \
+                mock.patch('apptransformation.mdlProcess.mdlMetadataStore.sql_table_exists', return_value=False), \
+                mock.patch('apptransformation.mdlProcess.mdlMetadataStore.pd.read_sql', return_value=dfmapping) as read_sql:
+            df, df_filters = SqlServerMetadataStore('server', 'database', 'user', 'password').read_ecc_mapping(1, 'C100')
+        self.assertEqual(column_exists.call_args.args[1:], ('ECC_Field_Mapping', 'JoinPolicy'))
+        self.assertEqual(read_sql.call_count, 1)
+        self.assertTrue(df_filters.empty)
+        return str(read_sql.call_args.args[0])
+
+    def test_join_policy_is_selected_when_the_column_exists(self):
+        self.assertIn('[JoinPolicy]', self.read_mapping_query(True))
+
+    def test_databases_without_the_column_still_load(self):
+        self.assertNotIn('JoinPolicy', self.read_mapping_query(False))
+
+
+class TemplateProjectionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.dfeccmapping = pd.DataFrame([
+            {'SoruceTable': 'KNA1', 'SoruceField': 'KUNNR', 'TargetTable': 'customer', 'TargetField': 'KUNNR', 'IsMainTable': 1},
+            {'SoruceTable': 'KNA1', 'SoruceField': 'NAME1', 'TargetTable': 'customer', 'TargetField': 'NAME1', 'IsMainTable': 1},
+            {'SoruceTable': 'KNA1', 'SoruceField': 'ORT01', 'TargetTable': 'customer', 'TargetField': 'ORT01', 'IsMainTable': 1},
+            {'SoruceTable': 'KNVV', 'SoruceField': 'VKORG', 'TargetTable': 'customer', 'TargetField': 'VKORG', 'IsMainTable': 0,
+             'SoruceJoinFiled': 'KUNNR', 'TargetJoinField': 'KUNNR'},
+            {'SoruceTable': 'LFA1', 'SoruceField': 'LIFNR', 'TargetTable': 'Supplier', 'TargetField': 'LIFNR', 'IsMainTable': 1},
+        ])
+        self.dictHeaders = {'Customer': ['NAME1', 'VKORG']}
+
+    def test_header_and_join_fields_are_kept(self):
+        df = project_ecc_mapping(self.dfeccmapping, self.dictHeaders)
+        # KUNNR is no header, but the KNVV join needs it
+        self.assertEqual(df['TargetField'].tolist(), ['KUNNR', 'NAME1', 'VKORG'])
+
+    def test_sheets_are_matched_without_regard_to_case(self):
+        df = project_ecc_mapping(self.dfeccmapping, {'CUSTOMER': ['NAME1']})
+        self.assertEqual(df['TargetTable'].tolist(), ['customer'])
+
+    def test_tables_without_sheet_are_dropped_with_a_warning(self):
+        with self.assertLogs('app_logger', level='WARNING') as logs:
+            df = project_ecc_mapping(self.dfeccmapping, self.dictHeaders)
+        self.assertNotIn('Supplier', df['TargetTable'].tolist())
+        self.assertTrue(any('Supplier' in line for line in logs.output))
+
+    def test_projection_from_a_template_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            template_path = os.path.join(tmp_dir, 'template.xml')
+            write_blank_template(template_path, self.dictHeaders)
+            self.assertEqual(read_template_headers(template_path), self.dictHeaders)
+            dicResult = apply_template_projection(self.dfeccmapping, template_path)
+        self.assertFalse(dicResult['iserror'])
+        self.assertEqual(dicResult['value'], {'KNA1': ('KUNNR', 'NAME1'), 'KNVV': ('VKORG', 'KUNNR')})
+
+
+class DeltaExtractionTests(SimpleTestCase):
+
+    fields = [{'FIELDNAME': 'DOCNR', 'LENG': 10, 'KEYFLAG': 'X'}, {'FIELDNAME': 'AEDAT', 'LENG': 8, 'DATATYPE': 'DATS'},
+              {'FIELDNAME': 'WERT', 'LENG': 5}]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.system = FakeSapSystem()
+        self.set_rows([('0000000001', '20200101', '1'), ('0000000002', '20200101', '2'), ('0000000003', '20200101', '3')])
+        self.connection_params = {'ashost': 'fake-delta', 'sysnr': '00', 'client': '100', 'user': 'TEST', 'passwd': 'secret'}
+        install_fake_sap(self.system, self.connection_params)
+        # A zero TTL sends every run past the plain cache to the snapshot
+        self.table_cache = SapTableCache(cache_dir=os.path.join(self.tmp_dir.name, 'cache'), ttl=0)
+        patcher = mock.patch.object(mdlMain, 'get_table_cache', return_value=self.table_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def set_rows(self, rows):
+        self.system.add_table('ZDLT', self.fields, pd.DataFrame(rows, columns=['DOCNR', 'AEDAT', 'WERT']))
+
+    def extract(self, full_refresh_days=7):
+        dicResult = mdlMain.extract_sap_table(self.connection_params, 'ZDLT', ['DOCNR', 'AEDAT', 'WERT'], delta_extraction=True,
+                                              delta_config={'fields': ['AEDAT'], 'full_refresh_days': full_refresh_days})
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        return dicResult['value']['ZDLT'].sort_values('DOCNR').reset_index(drop=True)
+
+    def test_config_rows_are_compiled_per_table(self):
+        store = SqliteMetadataStore(os.path.join(self.tmp_dir.name, 'metadata.db'))
+        store.set_delta_config([{'SoruceTable': 'VBAK', 'ChangeFields': 'erdat| AEDAT', 'FullRefreshDays': 3},
+                                {'SoruceTable': 'MARA', 'ChangeFields': 'LAEDA'},
+                                {'SoruceTable': 'KNA1', 'ChangeFields': ''}])
+        self.assertEqual(compile_delta_config(store.read_delta_config()),
+                         {'MARA': {'fields': ['LAEDA'], 'full_refresh_days': DELTA_FULL_REFRESH_DAYS},
+                          'VBAK': {'fields': ['ERDAT', 'AEDAT'], 'full_refresh_days': 3}})
+
+    def test_invalid_change_fields_are_rejected(self):
+        df_delta = pd.DataFrame([{'SoruceTable': 'VBAK', 'ChangeFields': "AEDAT >= '0' OR 1", 'FullRefreshDays': None}])
+        with self.assertRaises(ValueError):
+            compile_delta_config(df_delta)
+
+    def test_changed_rows_are_merged_into_the_snapshot(self):
+        self.extract()
+        today = pd.Timestamp.now().strftime('%Y%m%d')
+        self.set_rows([('0000000001', '20200101', '1'), ('0000000002', today, '20'), ('0000000004', today, '4')])
+        df = self.extract()
+        self.assertEqual(df['DOCNR'].tolist(), ['0000000001', '0000000002', '0000000003', '0000000004'])
+        # Row 3 is kept from the snapshot: a delta read only sees created and changed rows
+        self.assertEqual(df['WERT'].tolist(), ['1', '20', '3', '4'])
+
+    def test_full_refresh_drops_rows_deleted_in_sap(self):
+        self.extract()
+        self.set_rows([('0000000001', '20200101', '1'), ('0000000002', '20200101', '2')])
+        self.assertEqual(len(self.extract()), 3)
+        df = self.extract(full_refresh_days=0)
+        self.assertEqual(df['DOCNR'].tolist(), ['0000000001', '0000000002'])
+        # The full extraction restarts the refresh interval for later deltas
+        _, snapshot_meta = self.table_cache.get_snapshot(self.connection_params, 'ZDLT', ['DOCNR', 'AEDAT', 'WERT'])
+        self.assertEqual(snapshot_meta['rows'], 2)
+
+
+class RunCheckpointTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.checkpoint_dir = os.path.join(self.tmp_dir.name, 'runs')
+
+    def test_run_ids_that_leave_the_checkpoint_directory_are_rejected(self):
+        for run_id in ('../other', 'a/b', 'a\\b', '..', 'run 1'):
+            with self.assertRaises(ValueError):
+                RunCheckpoint(run_id, checkpoint_dir=self.checkpoint_dir)
+        self.assertEqual(RunCheckpoint('Run_2026-10-18', checkpoint_dir=self.checkpoint_dir).run_id, 'Run_2026-10-18')
+
+    def test_key_range_plan_round_trips(self):
+        checkpoint = RunCheckpoint('run1', checkpoint_dir=self.checkpoint_dir)
+        key_ranges = [KeyRange(None, 'B', 10), KeyRange('B', "O'Brien", None), KeyRange("O'Brien", None, 0)]
+        self.assertIsNone(checkpoint.load_key_ranges('ZTEST', 'KEY1'))
+        checkpoint.save_key_ranges('ZTEST', 'KEY1', key_ranges)
+        self.assertEqual(RunCheckpoint('run1', checkpoint_dir=self.checkpoint_dir).load_key_ranges('ZTEST', 'KEY1'), [tuple(key_range) for key_range in key_ranges])
+        self.assertIsNone(checkpoint.load_key_ranges('ZTEST', 'KEY1', ["KEY1 >= 'B'"]))
+
+    def test_resumed_run_reuses_the_key_range_plan(self):
+        system = FakeSapSystem()
+        system.generate_table('ZTEST', 1000, fields=2, key_fields=2)
+        connection_params = {'ashost': 'fake-checkpoint', 'sysnr': '00', 'client': '100', 'user': 'TEST', 'passwd': 'secret'}
+        install_fake_sap(system, connection_params)
+        lstFields = ['KEY1', 'KEY2', 'F001']
+
+        dicResult = get_data_from_sap_table_1(connection_params, 'ZTEST', lstFields, checkpoint=RunCheckpoint('run1', checkpoint_dir=self.checkpoint_dir))
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        rfc_calls = system.stats['ZTEST']['RFC_READ_TABLE']
+
+        with mock.patch('apptransformation.mdlProcess.mdlExtraction.plan_key_ranges') as plan_mock:
+            dicResult = get_data_from_sap_table_1(connection_params, 'ZTEST', lstFields, checkpoint=RunCheckpoint('run1', checkpoint_dir=self.checkpoint_dir))
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        plan_mock.assert_not_called()
+        # Every range is found in the checkpoint, so SAP is not read again
+        self.assertEqual(system.stats['ZTEST']['RFC_READ_TABLE'], rfc_calls)
+        self.assertEqual(len(dicResult['value']['ZTEST']), 1000)
+
+
+class SpillStitchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.spill_dir = os.path.join(self.tmp_dir.name, 'spill')
+
+    def test_extraction_spills_by_default(self):
+        for function in (mdlMain.extract_sap_table, mdlMain.get_data_from_sap_table, get_data_from_sap_table_1, read_field_chunk):
+            self.assertEqual(inspect.signature(function).parameters['memory_budget'].default, EXTRACTION_MEMORY_BUDGET)
+
+        # process_transformation is wrapped by log_execution_time, so its budget is checked where it is passed on
+        stop = {'iserror': True, 'error': 'stop', 'error_details': 'stop'}
+        with mock.patch.object(mdlMain, 'RunCheckpoint', side_effect=lambda run_id: RunCheckpoint(run_id, checkpoint_dir=self.tmp_dir.name)), \
+                mock.patch.object(mdlMain, 'load_template_bundle', return_value={'iserror': False, 'value': mock.MagicMock()}), \
+                mock.patch.object(mdlMain, 'apply_template_projection', return_value={'iserror': False, 'mapping_df': pd.DataFrame(), 'value': {}}), \
+                mock.patch.object(mdlMain, 'thread_extract_data_from_sap', return_value=stop) as extract_mock:
+            mdlMain.process_transformation('sqlite', 'metadata.db', '', '', 'V1', 'Template', 'user', 'pass', 'host', '100', self.tmp_dir.name, 'CLIENT')
+        self.assertEqual(extract_mock.call_args.kwargs['memory_budget'], EXTRACTION_MEMORY_BUDGET)
+
+    def test_pages_over_the_budget_are_memory_mapped(self):
+        with SpillBuffer(memory_budget=100, name='ZTEST', spill_dir=self.spill_dir) as spill_buffer:
+            for page in range(3):
+                spill_buffer.append(pa.table({'KEY1': [f"{page}{idx:03d}" for idx in range(20)]}))
+            self.assertTrue(spill_buffer.spilled)
+            df = spill_buffer.to_dataframe(['KEY1'])
+        self.assertIsInstance(df['KEY1'].dtype, pd.ArrowDtype)
+        self.assertEqual(len(df), 60)
+
+    def test_chunks_are_stitched_range_by_range(self):
+        # Range 1 lost a row in the second chunk between the two reads, as a full outer join keeps it
+        left = pa.table({'KEY1': ['A', 'B', 'C', 'D', 'E'], 'F1': ['a', 'b', 'c', 'd', 'e']})
+        right = pa.table({'KEY1': ['B', 'A', 'E', 'D'], 'F2': ['2', '1', '5', '4']})
+        for memory_budget in (None, 10):
+            df = stitch_field_chunks([(left, [2, 3]), (right, [2, 2])], ['KEY1'], memory_budget)
+            self.assertEqual(df['KEY1'].tolist(), ['A', 'B', 'C', 'D', 'E'])
+            self.assertEqual([None if pd.isna(value) else value for value in df['F2']], ['1', '2', None, '4', '5'])
+            self.assertEqual(isinstance(df['F1'].dtype, pd.ArrowDtype), memory_budget is not None)
+
+    def test_wide_table_over_the_budget_stays_arrow_backed(self):
+        system = FakeSapSystem()
+        system.generate_table('ZWIDE', 600, fields=40, key_fields=2, field_lengths=(20,))
+        connection_params = {'ashost': 'fake-spill', 'sysnr': '00', 'client': '100', 'user': 'TEST', 'passwd': 'secret'}
+        install_fake_sap(system, connection_params)
+        lstFields = ['KEY1', 'KEY2'] + [f"F{idx:03d}" for idx in range(1, 39)]
+
+        dictExpected = get_data_from_sap_table_1(connection_params, 'ZWIDE', lstFields, memory_budget=None)
+        dicResult = get_data_from_sap_table_1(connection_params, 'ZWIDE', lstFields, memory_budget=4096)
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        self.assertGreater(len(dicResult['plan']['chunks']), 1)
+
+        df = dicResult['value']['ZWIDE']
+        self.assertTrue(all(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes))
+        expected = dictExpected['value']['ZWIDE'].sort_values(['KEY1', 'KEY2']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(df.astype(object).sort_values(['KEY1', 'KEY2']).reset_index(drop=True)[list(expected.columns)], expected)
+
+    def test_arrow_backed_tables_round_trip_through_the_cache(self):
+        table_cache = SapTableCache(cache_dir=os.path.join(self.tmp_dir.name, 'cache'))
+        df = pd.DataFrame({'KEY1': ['A', 'B'], 'F1': ['x', None]}).astype(pd.ArrowDtype(pa.string()))
+        table_cache.put({'ashost': 'fake'}, 'ZTEST', ['KEY1', 'F1'], df)
+        self.assertEqual(table_cache.get({'ashost': 'fake'}, 'ZTEST', ['KEY1', 'F1']).astype(object).to_dict('list'),
+                         {'KEY1': ['A', 'B'], 'F1': ['x', None]})
+
+
+class SapConnectionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.system = FakeSapSystem()
+        self.factory = mock.Mock(side_effect=lambda **params: FakeSapConnection(self.system, **params))
+
+    def make_pool(self, host, user='TEST', **kwargs):
+        return SapConnectionPool({'ashost': host, 'sysnr': '00', 'client': '100', 'user': user}, connection_factory=self.factory, **kwargs)
+
+    def test_connections_are_reused(self):
+        pool = self.make_pool('fake-pool-reuse')
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_broken_connections_are_not_returned(self):
+        pool = self.make_pool('fake-pool-broken')
+        with self.assertRaises(CommunicationError):
+            with pool.connection() as first:
+                raise CommunicationError("Connection reset", 1, 'RFC_COMMUNICATION_FAILURE')
+        self.assertFalse(first.alive)
+        with pool.connection() as second:
+            self.assertIsNot(first, second)
+
+    def test_idle_connections_are_closed(self):
+        pool = self.make_pool('fake-pool-idle', idle_timeout=-1)
+        with pool.connection() as conn:
+            pass
+        pool.close_idle()
+        self.assertFalse(conn.alive)
+
+    def test_pools_of_one_host_share_its_budget(self):
+        with mock.patch.dict('apptransformation.mdlProcess.mdlSapPool.SAP_HOST_CONNECTION_BUDGET', {'fake-pool-budget': 1}):
+            pool_a = self.make_pool('fake-pool-budget', user='A')
+            pool_b = self.make_pool('fake-pool-budget', user='B')
+        with pool_a.connection():
+            self.assertFalse(pool_b._slots.acquire(blocking=False))
+        self.assertTrue(pool_b._slots.acquire(blocking=False))
+        pool_b._slots.release()
+
+
+class FieldChunkPlanTests(SimpleTestCase):
+
+    @staticmethod
+    def dfies(widths, key_fields=('KEY1',)):
+        return [{'FIELDNAME': name, 'LENG': str(width), 'OUTPUTLEN': '0', 'KEYFLAG': 'X' if name in key_fields else ''}
+                for name, width in widths.items()]
+
+    def test_chunks_are_packed_first_fit_decreasing(self):
+        dfies_tab = self.dfies({'KEY1': 10, 'A': 100, 'B': 300, 'C': 200, 'D': 200})
+        dictPlan = plan_field_chunks(dfies_tab, ['A', 'B', 'C', 'D'], ['KEY1'])
+        # Every chunk keeps the requested field order
+        self.assertEqual(dictPlan['chunks'], [['B', 'C'], ['A', 'D']])
+        self.assertEqual(dictPlan['chunk_widths'], [10 + 1 + 300 + 1 + 200, 10 + 1 + 100 + 1 + 200])
+        self.assertTrue(all(width <= RFC_WA_LENGTH for width in dictPlan['chunk_widths']))
+
+    def test_output_length_wider_than_the_field_counts(self):
+        dfies_tab = self.dfies({'KEY1': 10, 'A': 250, 'B': 250})
+        self.assertEqual(plan_field_chunks(dfies_tab, ['A', 'B'], ['KEY1'])['chunks'], [['A', 'B']])
+        dfies_tab[1]['OUTPUTLEN'] = '000260'
+        self.assertEqual(plan_field_chunks(dfies_tab, ['A', 'B'], ['KEY1'])['chunks'], [['A'], ['B']])
+
+    def test_fields_wider_than_the_line_are_skipped(self):
+        dfies_tab = self.dfies({'KEY1': 10, 'A': 10, 'LONG': 1000})
+        dictPlan = plan_field_chunks(dfies_tab, ['A', 'LONG', 'KEY1'], ['KEY1'])
+        self.assertEqual(dictPlan['chunks'], [['A']])
+        self.assertEqual(dictPlan['skipped'], ['LONG'])
+        self.assertEqual(dictPlan['key_width'], 10)
+
+
+class SapTableCacheTests(SimpleTestCase):
+
+    connection_params = {'ashost': 'fake-cache', 'sysnr': '00', 'client': '100', 'user': 'TEST'}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.table_cache = SapTableCache(cache_dir=self.tmp_dir.name)
+        self.df = pd.DataFrame({'KEY1': [f"{idx:04d}" for idx in range(100)], 'F1': 'x'})
+
+    def test_key_ignores_field_order_but_not_filters(self):
+        key = SapTableCache.make_key(self.connection_params, 'ZTEST', ['KEY1', 'F1'])
+        self.assertEqual(SapTableCache.make_key(self.connection_params, 'ztest', ['F1', 'KEY1', 'F1']), key)
+        self.assertNotEqual(SapTableCache.make_key(self.connection_params, 'ZTEST', ['KEY1', 'F1'], ["F1 = 'x'"]), key)
+        self.assertNotEqual(SapTableCache.make_key(dict(self.connection_params, client='200'), 'ZTEST', ['KEY1', 'F1']), key)
+
+    def test_entries_expire_after_the_ttl(self):
+        self.table_cache.put(self.connection_params, 'ZTEST', ['KEY1', 'F1'], self.df)
+        self.assertTrue(self.table_cache.contains(self.connection_params, 'ZTEST', ['KEY1', 'F1']))
+        self.table_cache.ttl = -1
+        self.assertFalse(self.table_cache.contains(self.connection_params, 'ZTEST', ['KEY1', 'F1']))
+        self.assertIsNone(self.table_cache.get(self.connection_params, 'ZTEST', ['KEY1', 'F1']))
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for tbl in ('ZA', 'ZB'):
+            self.table_cache.put(self.connection_params, tbl, ['KEY1', 'F1'], self.df)
+        self.assertIsNotNone(self.table_cache.get(self.connection_params, 'ZA', ['KEY1', 'F1']))
+        entry_bytes = os.path.getsize(os.path.join(self.tmp_dir.name, SapTableCache.make_key(self.connection_params, 'ZA', ['KEY1', 'F1']) + ".parquet"))
+        self.table_cache.max_bytes = 2 * entry_bytes
+        self.table_cache.put(self.connection_params, 'ZC', ['KEY1', 'F1'], self.df)
+        self.assertIsNotNone(self.table_cache.get(self.connection_params, 'ZA', ['KEY1', 'F1']))
+        self.assertIsNone(self.table_cache.get(self.connection_params, 'ZB', ['KEY1', 'F1']))
+        self.assertIsNotNone(self.table_cache.get(self.connection_params, 'ZC', ['KEY1', 'F1']))
+
+    def test_unreadable_entries_are_misses(self):
+        self.table_cache.put(self.connection_params, 'ZTEST', ['KEY1', 'F1'], self.df)
+        with open(os.path.join(self.tmp_dir.name, SapTableCache.make_key(self.connection_params, 'ZTEST', ['KEY1', 'F1']) + ".parquet"), 'wb') as f:
+            f.write(b"truncated")
+        with self.assertLogs('app_logger', level='WARNING'):
+            self.assertIsNone(self.table_cache.get(self.connection_params, 'ZTEST', ['KEY1', 'F1']))
+
+
+class ExtractionFilterTests(SimpleTestCase):
+
+    def test_operators_compile_to_open_sql(self):
+        self.assertEqual(build_filter_condition(' bukrs ', 'eq', '1000'), "BUKRS = '1000'")
+        self.assertEqual(build_filter_condition('NAME1', 'LIKE', "O'B%"), "NAME1 LIKE 'O''B%'")
+        self.assertEqual(build_filter_condition('WERKS', 'not  in', '1000| 2000'), "WERKS NOT IN ( '1000', '2000' )")
+        self.assertEqual(build_filter_condition('GJAHR', 'BETWEEN', '2020|2024'), "GJAHR BETWEEN '2020' AND '2024'")
+        self.assertEqual(build_filter_condition('LOEVM', 'EQ', None), "LOEVM = ''")
+
+    def test_invalid_filters_are_rejected(self):
+        for field, operator, value in (("BUKRS = '1' OR MANDT", 'EQ', '1'), ('BUKRS', 'OR', '1'), ('GJAHR', 'BETWEEN', '2020')):
+            with self.assertRaises(ValueError):
+                build_filter_condition(field, operator, value)
+
+    def test_filters_are_grouped_per_table_without_repeats(self):
+        df_filters = pd.DataFrame([{'SoruceTable': 'EKKO', 'FilterField': 'BUKRS', 'Operator': 'EQ', 'FilterValue': '1000'},
+                                   {'SoruceTable': 'EKKO', 'FilterField': 'BSART', 'Operator': 'IN', 'FilterValue': 'NB|UB'},
+                                   {'SoruceTable': 'EKKO', 'FilterField': 'BUKRS', 'Operator': 'EQ', 'FilterValue': '1000'},
+                                   {'SoruceTable': 'LFA1', 'FilterField': 'LOEVM', 'Operator': 'NE', 'FilterValue': 'X'}])
+        self.assertEqual(compile_extraction_filters(df_filters),
+                         {'EKKO': ["BUKRS = '1000'", "BSART IN ( 'NB', 'UB' )"], 'LFA1': ["LOEVM <> 'X'"]})
+
+    def test_filters_of_other_clients_are_not_read(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = SqliteMetadataStore(os.path.join(tmp_dir, 'metadata.db'))
+            templateid = store.add_template('V1', 'Template', '', [], filter_rows=[
+                {'SoruceTable': 'EKKO', 'FilterField': 'BUKRS', 'Operator': 'EQ', 'FilterValue': '1000'},
+                {'SoruceTable': 'EKKO', 'FilterField': 'BSART', 'Operator': 'EQ', 'FilterValue': 'NB', 'ClientFlag': 'OTHER'},
+                {'SoruceTable': 'EKKO', 'FilterField': 'EKORG', 'Operator': 'EQ', 'FilterValue': '0001', 'ClientFlag': 'CLIENT'}])
+            _, df_filters = store.read_ecc_mapping(templateid, 'CLIENT')
+            store.engine.dispose()
+        self.assertEqual(compile_extraction_filters(df_filters), {'EKKO': ["BUKRS = '1000'", "EKORG = '0001'"]})
+
+
+class ExtractionScheduleTests(SimpleTestCase):
+
+    connection_params = {'ashost': 'fake-schedule', 'sysnr': '00', 'client': '100', 'user': 'TEST', 'passwd': 'secret'}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.system = FakeSapSystem()
+        self.system.generate_table('ZSMALL', 10, fields=2)
+        self.system.generate_table('ZWIDE', 100, fields=20, field_lengths=(20,))
+        self.system.generate_table('ZLONG', 1000, fields=2)
+        install_fake_sap(self.system, self.connection_params)
+        patcher = mock.patch.object(mdlMain, 'get_table_cache', return_value=SapTableCache(cache_dir=self.tmp_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dictFields = {'ZSMALL': ['F001'], 'ZWIDE': ['F001', 'F002', 'F003'], 'ZLONG': ['F001']}
+
+    def test_sizes_are_estimated_from_row_counts_and_field_widths(self):
+        with get_sap_connection(self.connection_params) as connection:
+            dictSizes = estimate_table_sizes(connection, self.connection_params, self.dictFields)
+        self.assertEqual({tbl: size['rows'] for tbl, size in dictSizes.items()}, {'ZSMALL': 10, 'ZWIDE': 100, 'ZLONG': 1000})
+        # The key field is read with every chunk, and every field takes a delimiter
+        self.assertEqual(dictSizes['ZWIDE']['width'], (18 + 1) + 3 * (20 + 1))
+
+    def test_largest_tables_are_extracted_first(self):
+        lstStarted = []
+
+        def extract_sap_table(connection_params, tbl, *args):
+            lstStarted.append(tbl)
+            return {'iserror': False, 'value': {tbl: pd.DataFrame()}}
+
+        with mock.patch.dict('apptransformation.mdlProcess.mdlSapPool.SAP_HOST_CONNECTION_BUDGET', {'fake-schedule': 1}), \
+                mock.patch.object(mdlMain, 'extract_sap_table', side_effect=extract_sap_table):
+            dicResult = mdlMain.thread_extract_data_from_sap(self.connection_params, self.dictFields, 'V1_Template_')
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        self.assertEqual(lstStarted, ['ZLONG', 'ZWIDE', 'ZSMALL'])
+
+    def test_a_failed_table_fails_the_extraction(self):
+        def extract_sap_table(connection_params, tbl, *args):
+            if tbl == 'ZWIDE':
+                return {'iserror': True, 'error': 'failed', 'error_details': 'ZWIDE failed'}
+            return {'iserror': False, 'value': {tbl: pd.DataFrame()}}
+
+        with mock.patch.object(mdlMain, 'extract_sap_table', side_effect=extract_sap_table):
+            dicResult = mdlMain.thread_extract_data_from_sap(self.connection_params, self.dictFields, 'V1_Template_')
+        self.assertTrue(dicResult['iserror'])
+        self.assertEqual(dicResult['error_details'], 'ZWIDE failed')
+
+
+class FakeSapTests(SimpleTestCase):
+
+    def setUp(self):
+        self.system = FakeSapSystem()
+        self.system.add_table('ZFAKE', [{'FIELDNAME': 'KEY1', 'LENG': 4, 'KEYFLAG': 'X'}, {'FIELDNAME': 'TEXT', 'LENG': 10},
+                                        {'FIELDNAME': 'AMOUNT', 'LENG': 5, 'INTTYPE': 'P'}],
+                              pd.DataFrame({'KEY1': ['0001', '0002', '0003', '0004', '0005'],
+                                            'TEXT': ['APPLE', 'BANANA', 'CHERRY', 'DATE', 'ELDER'],
+                                            'AMOUNT': ['1', '20', '300', '4000', '5']}))
+
+    def read_keys(self, where_clause, **params):
+        result = self.system.call('RFC_READ_TABLE', QUERY_TABLE='ZFAKE', DELIMITER='|', FIELDS=[{'FIELDNAME': 'KEY1'}],
+                                  OPTIONS=[{'TEXT': where_clause}], **params)
+        return [row['WA'] for row in result['DATA']]
+
+    def test_where_clause_is_evaluated(self):
+        self.assertEqual(self.read_keys("KEY1 IN ( '0001' , '0003' )"), ['0001', '0003'])
+        self.assertEqual(self.read_keys("KEY1 BETWEEN '0002' AND '0004' AND NOT TEXT LIKE 'C%'"), ['0002', '0004'])
+        self.assertEqual(self.read_keys("( TEXT = 'APPLE' OR TEXT = 'ELDER' ) AND KEY1 <> '0005'"), ['0001'])
+        self.assertEqual(self.read_keys("KEY1 NOT IN ( '0001' ) AND KEY1 > '0003'"), ['0004', '0005'])
+
+    def test_syntax_errors_are_rejected(self):
+        with self.assertRaises(ABAPApplicationError) as context:
+            self.read_keys("KEY1 = '0001' '0002'")
+        self.assertEqual(context.exception.key, 'OPTION_NOT_VALID')
+
+    def test_rowskips_walk_past_skipped_rows(self):
+        self.assertEqual(self.read_keys("", ROWSKIPS=2, ROWCOUNT=2), ['0003', '0004'])
+        self.assertEqual(self.system.stats['ZFAKE']['rows_scanned'], 4)
+        self.assertEqual(self.system.stats['ZFAKE']['rows_returned'], 2)
+        self.assertEqual(self.system.stats['ZFAKE']['RFC_READ_TABLE'], 1)
+
+    def test_wa_lines_are_padded_like_sap(self):
+        result = self.system.call('RFC_READ_TABLE', QUERY_TABLE='ZFAKE', DELIMITER='|', OPTIONS=[{'TEXT': "KEY1 = '0002'"}])
+        self.assertEqual(result['DATA'], [{'WA': '0002|BANANA    |   20'}])
+        self.assertEqual([field['OFFSET'] for field in result['FIELDS']], ['000000', '000005', '000016'])
+
+    def test_errors_use_the_sap_exception_keys(self):
+        for func_name, params, key in [('RFC_READ_TABLE', {'QUERY_TABLE': 'ZMISSING'}, 'TABLE_NOT_AVAILABLE'),
+                                       ('RFC_READ_TABLE', {'QUERY_TABLE': 'ZFAKE', 'FIELDS': [{'FIELDNAME': 'NOPE'}]}, 'FIELD_NOT_VALID'),
+                                       ('Z_UNKNOWN_FM', {}, 'FU_NOT_FOUND')]:
+            with self.subTest(key=key), self.assertRaises(ABAPApplicationError) as context:
+                self.system.call(func_name, **params)
+            self.assertEqual(context.exception.key, key)
+
+        self.system.generate_table('ZWIDE', 1, fields=30, field_lengths=(20,))
+        with self.assertRaises(ABAPApplicationError) as context:
+            self.system.call('RFC_READ_TABLE', QUERY_TABLE='ZWIDE', DELIMITER='|')
+        self.assertEqual(context.exception.key, 'DATA_BUFFER_EXCEEDED')
+
+    def test_benchmark_extracts_every_row(self):
+        for extraction_mode in (Extraction_mode.EnumKeyRange, Extraction_mode.EnumOffset):
+            with self.subTest(mode=extraction_mode):
+                result = run_extraction_benchmark(f'tiny-{extraction_mode.lower()}', rows=200, fields=3, extraction_mode=extraction_mode)
+                self.assertEqual(result['rows'], 200)
+                self.assertEqual(result['columns'], 4)
+                self.assertGreater(result['rfc_calls'], 0)
+                self.assertGreaterEqual(result['rows_scanned'], 200)
+
+
+class SapMetadataCacheTests(SimpleTestCase):
+
+    connection_params = {'ashost': 'fake-metadata', 'sysnr': '00', 'client': '100', 'user': 'TEST', 'passwd': 'secret'}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.system = FakeSapSystem()
+        self.system.generate_table('ZMETA', 10, fields=2)
+        self.connection = FakeSapConnection(self.system)
+
+    def test_cached_fields_do_not_call_sap(self):
+        cache = SapMetadataCache(cache_dir=self.tmp_dir.name)
+        lstFields = cache.get_fields(self.connection_params, 'ZMETA', self.connection)
+        self.assertEqual([field['FIELDNAME'] for field in lstFields], ['MANDT', 'KEY1', 'F001', 'F002'])
+        self.assertEqual(cache.get_fields(self.connection_params, 'ZMETA', self.connection), lstFields)
+        # A new cache instance reads the entry from disk
+        self.assertEqual(SapMetadataCache(cache_dir=self.tmp_dir.name).get_fields(self.connection_params, 'ZMETA', self.connection), lstFields)
+        self.assertEqual(self.system.stats['ZMETA']['DDIF_FIELDINFO_GET'], 1)
+        self.assertEqual(self.system.stats['DD02L']['RFC_READ_TABLE'], 1)
+
+    def test_unchanged_ddic_version_is_only_checked(self):
+        cache = SapMetadataCache(cache_dir=self.tmp_dir.name, verify_interval=-1)
+        cache.get_fields(self.connection_params, 'ZMETA', self.connection)
+        cache.get_fields(self.connection_params, 'ZMETA', self.connection)
+        self.assertEqual(self.system.stats['ZMETA']['DDIF_FIELDINFO_GET'], 1)
+        self.assertEqual(self.system.stats['DD02L']['RFC_READ_TABLE'], 2)
+
+    def test_activated_table_is_read_again(self):
+        cache = SapMetadataCache(cache_dir=self.tmp_dir.name, verify_interval=-1)
+        cache.get_fields(self.connection_params, 'ZMETA', self.connection)
+        self.system.generate_table('ZMETA', 10, fields=3)
+        lstFields = cache.get_fields(self.connection_params, 'ZMETA', self.connection)
+        self.assertEqual([field['FIELDNAME'] for field in lstFields], ['MANDT', 'KEY1', 'F001', 'F002', 'F003'])
+        self.assertEqual(self.system.stats['ZMETA']['DDIF_FIELDINFO_GET'], 2)
+
+    def test_cached_fields_are_served_when_sap_is_unreachable(self):
+        cache = SapMetadataCache(cache_dir=self.tmp_dir.name, verify_interval=-1)
+        lstFields = cache.get_fields(self.connection_params, 'ZMETA', self.connection)
+        self.connection.close()
+        self.assertEqual(cache.get_fields(self.connection_params, 'ZMETA', self.connection), lstFields)
+        with self.assertRaises(CommunicationError):
+            cache.get_fields(self.connection_params, 'ZOTHER', self.connection)
+
+    def test_namespaced_tables_are_cached_per_system(self):
+        self.system.generate_table('/ABC/TABLE', 10, fields=1)
+        cache = SapMetadataCache(cache_dir=self.tmp_dir.name)
+        cache.get_fields(self.connection_params, '/ABC/TABLE', self.connection)
+        self.assertEqual(cache.cached_tables(self.connection_params), ['/ABC/TABLE'])
+        self.assertEqual(cache.cached_tables(dict(self.connection_params, client='200')), [])
+
+
+class CompactDtypesTests(SimpleTestCase):
+
+    dfies_tab = [{'FIELDNAME': 'KUNNR', 'KEYFLAG': 'X', 'DATATYPE': 'CHAR'},
+                 {'FIELDNAME': 'COUNT', 'DATATYPE': 'INT4'},
+                 {'FIELDNAME': 'AMOUNT', 'DATATYPE': 'CURR', 'LENG': '000013', 'DECIMALS': '000002'},
+                 {'FIELDNAME': 'ERDAT', 'DATATYPE': 'DATS'},
+                 {'FIELDNAME': 'NAME1', 'DATATYPE': 'CHAR'}]
+
+    def setUp(self):
+        self.df = pd.DataFrame({'KUNNR': ['0000000001', '0000000002', '0000000003'],
+                                'COUNT': ['  12', ' 3- ', '    '],
+                                'AMOUNT': ['1.50', '20.00-', ''],
+                                'ERDAT': ['20240131', '00000000', '99991231'],
+                                'NAME1': ['Alpha', 'Beta', None]})
+
+    def test_columns_get_native_dtypes(self):
+        df = compact_sap_dtypes(self.df, self.dfies_tab)
+        self.assertEqual(df['KUNNR'].dtype, 'string[pyarrow]')
+        self.assertEqual(str(df['COUNT'].dtype), 'int64[pyarrow]')
+        self.assertEqual(str(df['AMOUNT'].dtype), 'decimal128(13, 2)[pyarrow]')
+        self.assertEqual(str(df['ERDAT'].dtype), 'date32[day][pyarrow]')
+        self.assertEqual(df['COUNT'].tolist()[:2], [12, -3])
+        self.assertTrue(pd.isna(df['ERDAT'].iloc[1]))
+
+    def test_output_frame_restores_sap_text(self):
+        df = to_output_frame(compact_sap_dtypes(self.df, self.dfies_tab))
+        self.assertTrue(all(dtype == object for dtype in df.dtypes))
+        self.assertEqual(df['COUNT'].tolist(), ['12', '3-', ''])
+        self.assertEqual(df['AMOUNT'].tolist(), ['1.50', '20.00-', ''])
+        self.assertEqual(df['ERDAT'].tolist(), ['20240131', '00000000', '99991231'])
+        self.assertTrue(pd.isna(df['NAME1'].iloc[2]))
+
+    def test_invalid_values_keep_the_column_as_text(self):
+        df = compact_sap_dtypes(self.df.assign(ERDAT=['20240131', '2024-01-31', ''], COUNT=['1', 'x', '2']), self.dfies_tab)
+        self.assertEqual(df['ERDAT'].dtype, 'string[pyarrow]')
+        self.assertEqual(df['COUNT'].dtype, 'string[pyarrow]')
+
+    def test_low_cardinality_text_becomes_categorical(self):
+        rows = CATEGORY_MIN_ROWS
+        df = compact_sap_dtypes(pd.DataFrame({'BUKRS': ['1000', '2000'] * (rows // 2), 'NAME1': [f"N{idx}" for idx in range(rows)]}), [])
+        self.assertEqual(df['BUKRS'].dtype, 'category')
+        self.assertEqual(df['NAME1'].dtype, 'string[pyarrow]')
+
+    def test_mapping_and_rules_run_on_compacted_columns(self):
+        dictCompact = {'ZMAIN': compact_sap_dtypes(pd.DataFrame({'ID': ['1', '2'], 'ERDAT': ['20240131', '00000000']}), [{'FIELDNAME': 'ERDAT', 'DATATYPE': 'DATS'}]),
+                       'ZREF': compact_sap_dtypes(pd.DataFrame({'ID': ['2', '1'], 'COUNT': ['5', '7-']}), [{'FIELDNAME': 'COUNT', 'DATATYPE': 'INT4'}])}
+        dfmapping = pd.DataFrame([
+            {'SoruceTable': 'ZMAIN', 'SoruceField': 'ID', 'TargetTable': 'Sheet', 'TargetField': 'ID', 'IsMainTable': 1},
+            {'SoruceTable': 'ZMAIN', 'SoruceField': 'ERDAT', 'TargetTable': 'Sheet', 'TargetField': 'ERDAT', 'IsMainTable': 1},
+            {'SoruceTable': 'ZREF', 'SoruceField': 'COUNT', 'TargetTable': 'Sheet', 'TargetField': 'COUNT', 'IsMainTable': 0,
+             'SoruceJoinFiled': 'ID', 'TargetJoinField': 'ID'}])
+        dicResult = table_mapping_parallel(dfmapping, dictCompact, num_workers=1)
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        df = dicResult['value']['Sheet']
+        self.assertFalse(add_prefix_suffix(df, 'ERDAT', 'D')['iserror'])
+        df = to_output_frame(df)
+        self.assertEqual(df['ERDAT'].tolist(), ['D20240131', 'D00000000'])
+        self.assertEqual(df['COUNT'].tolist(), ['7-', '5'])
+
+
+class SqlEngineRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(SqlEngineRegistry._engines, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('apptransformation.mdlProcess.mdlDbPool.create_engine', side_effect=lambda *args, **kwargs: mock.MagicMock())
+        self.create_engine = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_engines_are_shared_per_database_and_credentials(self):
+        engine = SqlEngineRegistry.get_engine('SQL01', 'MIGRATION', 'app', 'secret')
+        self.assertIs(SqlEngineRegistry.get_engine('sql01', 'migration', 'APP', 'secret'), engine)
+        self.assertIs(mdlMain.get_sqlalchemy_connection('SQL01', 'MIGRATION', 'app', 'secret'), engine)
+        self.assertIsNot(SqlEngineRegistry.get_engine('SQL01', 'MIGRATION', 'app', 'changed'), engine)
+        self.assertIsNot(SqlEngineRegistry.get_engine('SQL01', 'ARCHIVE', 'app', 'secret'), engine)
+        self.assertEqual(self.create_engine.call_count, 3)
+
+    def test_engine_is_pooled_and_pinged(self):
+        SqlEngineRegistry.get_engine('SQL01', 'MIGRATION', 'app', 'p@ss:word')
+        (connection_string,), kwargs = self.create_engine.call_args
+        self.assertIn('app:p%40ss%3Aword@SQL01/MIGRATION', connection_string)
+        self.assertTrue(kwargs['pool_pre_ping'])
+        self.assertGreater(kwargs['pool_size'], 0)
+        self.assertGreater(kwargs['pool_recycle'], 0)
+
+    def test_concurrent_runs_create_one_engine(self):
+        lstEngines = []
+        threads = [threading.Thread(target=lambda: lstEngines.append(SqlEngineRegistry.get_engine('SQL01', 'MIGRATION', 'app', 'secret')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.create_engine.call_count, 1)
+        self.assertEqual(len({id(engine) for engine in lstEngines}), 1)
+
+    def test_dispose_all_closes_every_engine(self):
+        lstEngines = [SqlEngineRegistry.get_engine('SQL01', database, 'app', 'secret') for database in ('MIGRATION', 'ARCHIVE')]
+        SqlEngineRegistry.dispose_all()
+        for engine in lstEngines:
+            engine.dispose.assert_called_once_with()
+        self.assertEqual(SqlEngineRegistry._engines, {})
+
+
+class TemplateBundleTests(SimpleTestCase):
+
+    mapping_rows = [{'SoruceTable': 'KNA1', 'SoruceField': 'KUNNR', 'TargetTable': 'Sheet', 'TargetField': 'KUNNR', 'IsMainTable': 1}]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.database = os.path.join(self.tmp_dir.name, 'metadata.db')
+        self.store = SqliteMetadataStore(self.database)
+        self.store.add_template('V1', 'Template', '', self.mapping_rows)
+        self.bundle_dir = os.path.join(self.tmp_dir.name, 'bundles')
+        self.bundle_cache = TemplateBundleCache(cache_dir=self.bundle_dir, verify_interval=-1)
+        patcher = mock.patch.object(mdlMain, 'get_template_bundle_cache', side_effect=lambda: self.bundle_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(mdlMain, 'fetch_ecc_mapping', wraps=mdlMain.fetch_ecc_mapping)
+        self.fetch_ecc_mapping = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load(self):
+        dicResult = mdlMain.load_template_bundle('sqlite', self.database, '', '', 'V1', 'Template', 'CLIENT')
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        return dicResult['value']
+
+    def test_fresh_bundle_skips_the_database(self):
+        self.bundle_cache.verify_interval = 60
+        bundle = self.load()
+        with mock.patch.object(SqliteMetadataStore, 'bundle_checksum') as bundle_checksum:
+            self.assertIs(self.load(), bundle)
+        bundle_checksum.assert_not_called()
+        self.assertEqual(self.fetch_ecc_mapping.call_count, 1)
+
+    def test_unchanged_checksum_keeps_the_bundle(self):
+        bundle = self.load()
+        self.assertIs(self.load(), bundle)
+        self.assertEqual(self.fetch_ecc_mapping.call_count, 1)
+
+    def test_changed_metadata_recompiles_the_bundle(self):
+        self.load()
+        self.store.add_template('V1', 'Template', '', self.mapping_rows + [
+            {'SoruceTable': 'KNA1', 'SoruceField': 'NAME1', 'TargetTable': 'Sheet', 'TargetField': 'NAME1', 'IsMainTable': 1}])
+        bundle = self.load()
+        self.assertEqual(self.fetch_ecc_mapping.call_count, 2)
+        self.assertEqual(bundle.mapping_df['SoruceField'].tolist(), ['KUNNR', 'NAME1'])
+
+    def test_bundle_is_read_back_from_disk(self):
+        bundle = self.load()
+        key = self.bundle_cache.make_key('sqlite', self.database, '', '', 'V1', 'Template', 'CLIENT')
+        self.bundle_cache = TemplateBundleCache(cache_dir=self.bundle_dir, verify_interval=-1)
+        self.assertEqual(self.load().checksum, bundle.checksum)
+        self.assertEqual(self.fetch_ecc_mapping.call_count, 1)
+
+        # Bundles of another format or unreadable files are cache misses
+        with mock.patch('apptransformation.mdlProcess.mdlTemplateBundle.TEMPLATE_BUNDLE_FORMAT', TEMPLATE_BUNDLE_FORMAT + 1):
+            self.assertEqual(TemplateBundleCache(cache_dir=self.bundle_dir).get(key), (None, None))
+        with open(os.path.join(self.bundle_dir, key + '.pkl'), 'wb') as f:
+            f.write(b'truncated')
+        self.assertEqual(TemplateBundleCache(cache_dir=self.bundle_dir).get(key), (None, None))
+        self.assertFalse(os.path.exists(os.path.join(self.bundle_dir, key + '.pkl')))
+
+    def test_missing_optional_tables_are_left_out_of_the_checksum(self):
+        engine = mock.MagicMock()
+        conn = engine.connect.return_value.__enter__.return_value
+        conn.execute.return_value.fetchone.return_value = (1, 2, 3, 4, None, None, None, None, 5, 6)
+        with mock.patch('apptransformation.mdlProcess.mdlTemplateBundle.sql_table_exists', return_value=False):
+            self.assertEqual(query_bundle_checksum(engine, 'V1', 'Template', 'CLIENT'), (1, 2, 3, 4, None, None, None, None, 5, 6))
+        query = str(conn.execute.call_args[0][0])
+        self.assertNotIn('ECC_Extraction_Filter', query)
+        self.assertNotIn('ECC_Delta_Config', query)
+
+
+class MetadataParsingTests(SimpleTestCase):
+
+    def test_field_list_keeps_first_use_order_without_duplicates(self):
+        dfeccmapping = pd.DataFrame([
+            {'SoruceTable': 'KNA1', 'SoruceField': 'KUNNR', 'IsMainTable': 1, 'SoruceJoinFiled': None},
+            {'SoruceTable': 'KNVV', 'SoruceField': 'VKORG', 'IsMainTable': 0, 'SoruceJoinFiled': 'KUNNR | VKORG|'},
+            {'SoruceTable': 'KNA1', 'SoruceField': 'KUNNR', 'IsMainTable': 1, 'SoruceJoinFiled': None},
+            {'SoruceTable': 'KNVV', 'SoruceField': 'VTWEG', 'IsMainTable': 0, 'SoruceJoinFiled': 'KUNNR'},
+            # Join fields of main table rows are not extracted
+            {'SoruceTable': 'KNA1', 'SoruceField': 'NAME1', 'IsMainTable': 1, 'SoruceJoinFiled': 'LAND1'},
+        ])
+        self.assertEqual(build_ecc_field_list(dfeccmapping), {'KNA1': ('KUNNR', 'NAME1'), 'KNVV': ('VKORG', 'KUNNR', 'VTWEG')})
+
+    def test_rule_parameters_are_matched_by_position(self):
+        dfrules = pd.DataFrame([
+            {'TargetTable': 'Sheet', 'TargetField': 'NAME', 'RuleName': 'PREFIX| |TRIM', 'Format': 'A | B', 'Custome1': None, 'Custome2': 'X', 'Custome3': ''},
+            {'TargetTable': 'Sheet', 'TargetField': 'NAME', 'RuleName': 'UPPER', 'Format': None, 'Custome1': None, 'Custome2': None, 'Custome3': None},
+            {'TargetTable': 'Sheet', 'TargetField': 'CITY', 'RuleName': None, 'Format': 'Y', 'Custome1': None, 'Custome2': None, 'Custome3': None},
+        ])
+        self.assertEqual(compile_rule_dict(dfrules), {'Sheet': {'NAME': [
+            {'rule_name': 'PREFIX', 'format': ('A',), 'custom1': ('',), 'custom2': ('X',), 'custom3': ('',)},
+            {'rule_name': 'TRIM', 'format': ('',), 'custom1': ('',), 'custom2': ('',), 'custom3': ('',)},
+            {'rule_name': 'UPPER', 'format': ('',), 'custom1': ('',), 'custom2': ('',), 'custom3': ('',)}]}})
+
+    def test_vectorized_parsing_matches_the_row_by_row_reference(self):
+        dfeccmapping, dfrules = generate_mapping_metadata(2000)
+        self.assertEqual(build_ecc_field_list(dfeccmapping), {tbl: tuple(lst) for tbl, lst in legacy_ecc_field_list(dfeccmapping).items()})
+        legacy_rules = legacy_rule_dict(dfrules)
+        self.assertEqual(compile_rule_dict(dfrules), {table: {field: [{key: tuple(value) if isinstance(value, list) else value for key, value in rule.items()}
+                                                                      for rule in rules] for field, rules in fields.items()}
+                                                      for table, fields in legacy_rules.items()})
+
+    def test_metadata_benchmark_reports_both_implementations(self):
+        result = run_metadata_benchmark(500, repeat=1)
+        self.assertEqual(result['rows'], 500)
+        for key in ('fields_legacy_seconds', 'fields_seconds', 'rules_legacy_seconds', 'rules_seconds'):
+            self.assertGreater(result[key], 0)
+
+
+class JoinPlanTests(SimpleTestCase):
+
+    def setUp(self):
+        self.source_data = {
+            'KNA1': pd.DataFrame({'KUNNR': ['1', '2', '3'], 'NAME1': ['one', 'two', 'three']}),
+            # Repeated keys, so that the joins are merged rather than looked up
+            'KNVV': pd.DataFrame({'KUNNR': ['1', '1', '2'], 'VKORG': ['1000', '2000', '1000'], 'VTWEG': ['10', '20', '10'], 'SPART': ['00', '01', '00']}),
+            'KNB1': pd.DataFrame({'KUNNR': ['1', '3'], 'BUKRS': ['1000', '2000']}),
+        }
+        rows = [('KNA1', 'KUNNR', 'KUNNR', 1, None, None, None), ('KNA1', 'NAME1', 'NAME1', 1, None, None, None),
+                ('KNVV', 'VKORG', 'VKORG', 0, 'KUNNR', 'KUNNR', 'WARN'), ('KNB1', 'BUKRS', 'BUKRS', 0, 'KUNNR', 'KUNNR', None),
+                ('KNVV', 'VTWEG', 'VTWEG', 0, 'KUNNR', 'KUNNR', 'REFUSE'), ('KNVV', 'SPART', 'SPART', 0, ' KUNNR ', 'KUNNR', None),
+                # Already mapped by an earlier row
+                ('KNB1', 'KUNNR', 'NAME1', 0, 'KUNNR', 'KUNNR', None)]
+        self.dfmapping = pd.DataFrame(rows, columns=['SoruceTable', 'SoruceField', 'TargetField', 'IsMainTable', 'SoruceJoinFiled', 'TargetJoinField', 'JoinPolicy'])
+        self.dfmapping['TargetTable'] = 'Customer'
+
+    def test_rows_with_the_same_source_and_join_fields_become_one_step(self):
+        plan = compile_join_plan('Customer', self.dfmapping, Join_policy.EnumDedupe)
+        self.assertEqual(plan.main_tables, ('KNA1',))
+        self.assertEqual(plan.main_fields, (('KNA1', 'KUNNR', 'KUNNR'), ('KNA1', 'NAME1', 'NAME1')))
+        self.assertEqual([(step.source_table, step.source_join_fields, step.fields) for step in plan.joins],
+                         [('KNVV', ('KUNNR',), (('VKORG', 'VKORG'), ('VTWEG', 'VTWEG'), ('SPART', 'SPART'))),
+                          ('KNB1', ('KUNNR',), (('BUKRS', 'BUKRS'),))])
+        # The strictest policy of the step's rows applies; rows without one take the run's policy
+        self.assertEqual([step.policy for step in plan.joins], [Join_policy.EnumRefuse, Join_policy.EnumDedupe])
+
+    def test_plan_is_described_step_by_step(self):
+        lstLines = describe_join_plan(compile_join_plan('Customer', self.dfmapping)).splitlines()
+        self.assertEqual(lstLines[0], "Join plan for Customer: 2 main fields from KNA1, 2 joins for 4 joined fields")
+        self.assertEqual(lstLines[1], "  1. KNVV on KUNNR -> KUNNR (REFUSE): VKORG, VTWEG, SPART")
+        self.assertEqual(lstLines[2], "  2. KNB1 on KUNNR -> KUNNR (WARN): BUKRS")
+
+    def test_each_step_is_one_merge_of_all_its_fields(self):
+        dfmapping = self.dfmapping.assign(JoinPolicy=None)
+        plan = compile_join_plan('Customer', dfmapping)
+        with mock.patch('apptransformation.mdlProcess.mdlMapping.pd.merge', wraps=pd.merge) as merge:
+            df = execute_join_plan(plan, self.source_data)
+        self.assertEqual(merge.call_count, 1)  # KNB1 has unique keys and is looked up
+
+        # Fields of one source row stay together, instead of every row merge multiplying the repeated keys again
+        expected = self.source_data['KNA1'].merge(self.source_data['KNVV'], how='left', on='KUNNR').merge(self.source_data['KNB1'], how='left', on='KUNNR')
+        pd.testing.assert_frame_equal(df[expected.columns].fillna(''), expected.fillna(''), check_dtype=False)
+
+
+class MappingConcurrencyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.source_data = {'ZSRC': pd.DataFrame({'ID': ['1', '2'], 'NAME': ['one', 'two']})}
+        self.dfmapping = pd.DataFrame([{'SoruceTable': 'ZSRC', 'SoruceField': 'NAME', 'TargetTable': target_table, 'TargetField': 'NAME',
+                                        'IsMainTable': 1, 'SoruceJoinFiled': None, 'TargetJoinField': None}
+                                       for target_table in ('Sheet3', 'Sheet1', 'Sheet2')])
+
+    def test_target_tables_are_mapped_at_the_same_time(self):
+        barrier = threading.Barrier(3, timeout=10)
+        lstSourceData = []
+
+        def process_target_table(target_table, group, source_data, *args):
+            lstSourceData.append(source_data)
+            # Only returns when all three target tables are in progress together
+            barrier.wait()
+            return target_table, pd.DataFrame({'NAME': source_data['ZSRC']['NAME']})
+
+        with mock.patch('apptransformation.mdlProcess.mdlMapping.process_target_table', side_effect=process_target_table):
+            dicResult = table_mapping_parallel(self.dfmapping, self.source_data, num_workers=3)
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        self.assertTrue(all(source_data is self.source_data for source_data in lstSourceData))
+        self.assertEqual(list(dicResult['value']), ['Sheet1', 'Sheet2', 'Sheet3'])
+
+    def test_failures_are_reported_per_target_table(self):
+        # ID repeats in ZSRC, so the refused joins fail Sheet1 and Sheet3 while Sheet2 is mapped
+        self.source_data['ZSRC'] = pd.DataFrame({'ID': ['1', '1'], 'NAME': ['one', 'two']})
+        dfjoins = pd.DataFrame([{'SoruceTable': 'ZSRC', 'SoruceField': 'NAME', 'TargetTable': target_table, 'TargetField': 'CITY', 'IsMainTable': 0,
+                                 'SoruceJoinFiled': 'ID', 'TargetJoinField': 'ID'} for target_table in ('Sheet1', 'Sheet3')])
+        dfmapping = pd.concat([self.dfmapping.assign(SoruceField='ID', TargetField='ID'), dfjoins], ignore_index=True)
+        dicResult = table_mapping_parallel(dfmapping, self.source_data, num_workers=2, join_policy=Join_policy.EnumRefuse)
+        self.assertTrue(dicResult['iserror'])
+        self.assertEqual(sorted(dicResult['table_errors']), ['Sheet1', 'Sheet3'])
+        self.assertIn('Sheet1: Join of ZSRC', dicResult['error_details'])
+        self.assertNotIn('value', dicResult)
+
+    def test_workers_are_bounded_by_the_target_tables(self):
+        with mock.patch('apptransformation.mdlProcess.mdlMapping.ThreadPoolExecutor', wraps=mdlMapping.ThreadPoolExecutor) as executor:
+            dicResult = table_mapping_parallel(self.dfmapping, self.source_data, num_workers=16)
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        self.assertEqual(executor.call_args.kwargs['max_workers'], 3)
+
+
+class JoinIndexCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.source_df = pd.DataFrame({'KUNNR': ['1', '2', '2', '3', '3', '3'], 'VKORG': ['A', 'A', 'B', 'A', 'B', 'C'],
+                                       'NAME1': ['one', 'two', 'two-b', 'three', 'three-b', 'three-c']})
+
+    def test_index_is_built_once_per_source_and_keys(self):
+        join_indexes = JoinIndexCache()
+        with mock.patch.object(JoinIndexCache, '_build', wraps=JoinIndexCache._build) as build:
+            threads = [threading.Thread(target=join_indexes.get, args=('KNVV', self.source_df, ['KUNNR'])) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            join_indexes.get('KNVV', self.source_df, ['KUNNR', 'VKORG'])
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual(len(join_indexes), 2)
+
+    def test_duplicate_keys_are_detected_when_built(self):
+        join_indexes = JoinIndexCache()
+        join_index = join_indexes.get('KNVV', self.source_df, ['KUNNR'])
+        self.assertFalse(join_index.is_unique)
+        self.assertEqual(join_index.duplicate_keys, 3)
+        self.assertEqual(join_index.key_counts.tolist(), [1, 2, 3])
+        self.assertTrue(join_indexes.get('KNVV', self.source_df, ['KUNNR', 'VKORG']).is_unique)
+
+    def test_lookup_gathers_the_source_rows(self):
+        join_index = JoinIndexCache().get('KNVV', self.source_df, ['KUNNR', 'VKORG'])
+        target_df = pd.DataFrame({'KUNNR': ['3', '9', '2'], 'VKORG': ['B', 'A', 'A']}, index=[10, 11, 12])
+        positions = lookup_join_positions(join_index, join_target_keys(target_df, ['KUNNR', 'VKORG']))
+        self.assertEqual(positions.tolist(), [4, -1, 1])
+        column = take_join_column(self.source_df['NAME1'], positions, target_df.index)
+        self.assertEqual(column.index.tolist(), [10, 11, 12])
+        self.assertEqual(column.fillna('').tolist(), ['three-b', '', 'two'])
+
+    def test_repeated_keys_look_up_the_first_source_row(self):
+        join_index = JoinIndexCache().get('KNVV', self.source_df, ['KUNNR'])
+        target_keys = join_target_keys(pd.DataFrame({'KUNNR': ['3', '2', '4']}), ['KUNNR'])
+        self.assertEqual(lookup_join_positions(join_index, target_keys).tolist(), [3, 1, -1])
+        self.assertEqual(predict_join_rows(join_index, target_keys), 3 + 2 + 1)
+
+    def test_compacted_keys_match_text_keys(self):
+        source_df = compact_sap_dtypes(pd.DataFrame({'POSNR': ['10', '20']}), [{'FIELDNAME': 'POSNR', 'DATATYPE': 'INT4'}])
+        join_index = JoinIndexCache().get('VBAP', source_df, ['POSNR'])
+        target_keys = join_target_keys(pd.DataFrame({'POSNR': ['20', '30']}), ['POSNR'])
+        self.assertEqual(lookup_join_positions(join_index, target_keys).tolist(), [1, -1])
+
+
+class ColumnAssemblyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.source_data = {'KNA1': pd.DataFrame({'KUNNR': ['1', '2', '3'], 'NAME1': ['one', 'two', 'three']}, index=[5, 6, 7])}
+        self.dfmapping = pd.DataFrame([
+            {'SoruceTable': 'KNA1', 'SoruceField': field, 'TargetTable': target_table, 'TargetField': field, 'IsMainTable': 1,
+             'SoruceJoinFiled': None, 'TargetJoinField': None}
+            for target_table in ('Customer', 'Contact') for field in ('KUNNR', 'NAME1', 'NAME2')])
+
+    def test_target_tables_share_the_source_columns(self):
+        dicResult = table_mapping_parallel(self.dfmapping, self.source_data, num_workers=2)
+        self.assertFalse(dicResult['iserror'], dicResult.get('error_details'))
+        source_names = self.source_data['KNA1']['NAME1'].to_numpy()
+        for target_table, df in dicResult['value'].items():
+            with self.subTest(target_table=target_table):
+                self.assertEqual(df.index.tolist(), [0, 1, 2])
+                self.assertTrue(np.shares_memory(df['NAME1'].to_numpy(), source_names))
+                self.assertTrue(df['NAME2'].isna().all())
+
+    def test_rules_do_not_write_through_to_the_source(self):
+        df = table_mapping_parallel(self.dfmapping, self.source_data, num_workers=1)['value']['Customer']
+        self.assertFalse(add_prefix_suffix(df, 'NAME1', 'X')['iserror'])
+        self.assertEqual(df['NAME1'].tolist(), ['Xone', 'Xtwo', 'Xthree'])
+        self.assertEqual(self.source_data['KNA1']['NAME1'].tolist(), ['one', 'two', 'three'])
+
+    def test_missing_column_is_one_broadcast_value(self):
+        column = missing_column(1000000)
+        self.assertEqual(len(column), 1000000)
+        self.assertEqual(column.to_numpy().strides, (0,))
+        self.assertTrue(column.isna().all())
+
+    def test_added_columns_keep_the_existing_buffers(self):
+        df = pd.DataFrame({'A': np.arange(3), 'B': ['x', 'y', 'z']})
+        df_added = add_columns(df, {'C': pd.Series([1.0, 2.0, 3.0])})
+        self.assertEqual(df_added.columns.tolist(), ['A', 'B', 'C'])
+        self.assertTrue(np.shares_memory(df_added['A'].to_numpy(), df['A'].to_numpy()))
+        self.assertTrue(np.shares_memory(df_added['B'].to_numpy(), df['B'].to_numpy()))